@@ -0,0 +1,115 @@
+"""
+Benchmark de escritura de auditoría: un commit por registro vs group commit
+
+Registra N movimientos de auditoría desde muchas corrutinas concurrentes:
+    - individual: ServicioAuditoria.registrar_movimiento (una transacción por registro)
+    - cola: ColaAuditoria (los registros se encadenan y confirman por lotes)
+
+Reporta el costo por registro y al final verifica que la cadena de hashes
+siga íntegra desde el primer registro insertado por el benchmark.
+
+Uso (desde backend/, con .env apuntando a una BD de pruebas):
+    python benchmarks/bench_auditoria.py --registros 5000 --concurrencia 200 --usuario-id 1
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from database import SessionLocal
+from security.auditoria import AuditoriaMovimiento, ServicioAuditoria
+from security.cola_auditoria import ColaAuditoria
+
+
+def registrar_individual(usuario_id: int, i: int):
+    db = SessionLocal()
+    try:
+        ServicioAuditoria(db).registrar_movimiento(
+            usuario_id=usuario_id, usuario_nombre="bench", accion="MODIFICACION",
+            tipo_entidad="PRODUCTO", entidad_id=f"BENCH{i % 50:03d}",
+            datos_nuevos={"i": i}, cantidad_movida=1
+        )
+    finally:
+        db.close()
+
+
+async def medir_individual(registros: int, concurrencia: int, usuario_id: int) -> float:
+    loop = asyncio.get_running_loop()
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def uno(i):
+        async with semaforo:
+            await loop.run_in_executor(None, registrar_individual, usuario_id, i)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(uno(i) for i in range(registros)))
+    return time.perf_counter() - inicio
+
+
+async def medir_cola(registros: int, concurrencia: int, usuario_id: int) -> float:
+    cola = ColaAuditoria(SessionLocal)
+    await cola.iniciar()
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def uno(i):
+        async with semaforo:
+            await cola.registrar(
+                usuario_id, "bench", "MODIFICACION", "PRODUCTO", f"BENCH{i % 50:03d}",
+                datos_nuevos={"i": i}, cantidad_movida=1
+            )
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(uno(i) for i in range(registros)))
+    duracion = time.perf_counter() - inicio
+    await cola.detener()
+    print(f"     lotes={cola.lotes_escritos} promedio_por_lote={cola.obtener_estadisticas()['promedio_por_lote']:.1f}")
+    return duracion
+
+
+def verificar_cadena(desde_id: int) -> bool:
+    """Cada registro nuevo debe partir del hash del anterior"""
+    db = SessionLocal()
+    try:
+        filas = db.query(AuditoriaMovimiento.id, AuditoriaMovimiento.hash_integridad,
+                         AuditoriaMovimiento.hash_anterior) \
+            .filter(AuditoriaMovimiento.id >= desde_id).order_by(AuditoriaMovimiento.id).all()
+    finally:
+        db.close()
+    return all(b.hash_anterior == a.hash_integridad for a, b in zip(filas, filas[1:]))
+
+
+def ultimo_id() -> int:
+    db = SessionLocal()
+    try:
+        fila = db.query(AuditoriaMovimiento.id).order_by(AuditoriaMovimiento.id.desc()).first()
+        return fila.id if fila else 0
+    finally:
+        db.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--registros", type=int, default=5000)
+    parser.add_argument("--concurrencia", type=int, default=200)
+    parser.add_argument("--usuario-id", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"🧾 Registros: {args.registros} | Concurrencia: {args.concurrencia}")
+    desde_id = ultimo_id()
+
+    for nombre, medir in (("individual", medir_individual), ("cola", medir_cola)):
+        duracion = await medir(args.registros, args.concurrencia, args.usuario_id)
+        print(
+            f"  {nombre:<10} {args.registros / duracion:>10,.0f} registros/s "
+            f"{duracion * 1000 / args.registros:8.3f} ms/registro"
+        )
+
+    integra = verificar_cadena(desde_id)
+    print(f"{'✅' if integra else '❌'} Cadena de hashes {'íntegra' if integra else 'ROTA'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""
+Benchmark del hash de integridad de la auditoría: JSON (v1) vs binario (v2)
+
+Encadena N registros sintéticos con cada versión, como lo harían
+CabezaCadena al escribir y TramoCadena al verificar, y reporta hashes por
+segundo. Antes comprueba que el hash calculado al escribir coincida con el de
+la fecha releída de la columna (DATETIME2(3)) para fechas con microsegundos.
+No necesita base de datos.
+
+Uso (desde backend/):
+    python benchmarks/bench_hash_auditoria.py --registros 200000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from security.auditoria import (
+    HASH_GENESIS, VERSION_HASH_BINARIO, VERSION_HASH_JSON, calcular_hash, calcular_hash_fila,
+    fecha_auditoria
+)
+
+Fila = namedtuple("Fila", "fecha_hora usuario_id accion entidad_id datos_nuevos version_hash")
+
+
+def generar_filas(cantidad: int, version: int):
+    random.seed(11)
+    inicio = datetime(2026, 1, 1, 8, 0, 0)
+    return [
+        Fila(
+            # Microsegundos arbitrarios, como datetime.utcnow(), normalizados como en preparar_registro
+            fecha_hora=fecha_auditoria(inicio + timedelta(microseconds=i * 137_000 + random.randint(0, 999_999))),
+            usuario_id=random.randint(1, 40),
+            accion=random.choice(["ENTRADA", "SALIDA", "MODIFICACION"]),
+            entidad_id=f"PROD{random.randint(1, 5000):05d}",
+            datos_nuevos=json.dumps({"stock": random.randint(0, 900), "ubicacion": "Almacén A - Estante 3"}),
+            version_hash=version
+        )
+        for i in range(cantidad)
+    ]
+
+
+def guardar_datetime2_3(fecha: datetime) -> datetime:
+    """Valor que devuelve una columna DATETIME2(3): redondeo al milisegundo"""
+    return datetime.min + round((fecha - datetime.min) / timedelta(milliseconds=1)) * timedelta(milliseconds=1)
+
+
+def comprobar_ida_y_vuelta(filas, version: int) -> int:
+    """Registros cuyo hash de escritura no coincide con el recalculado tras guardar y releer la fecha"""
+    fallidos = 0
+    for fila in filas:
+        hash_escritura = calcular_hash(fila._asdict(), HASH_GENESIS, version)
+        releida = fila._replace(fecha_hora=guardar_datetime2_3(fila.fecha_hora))
+        if calcular_hash_fila(releida, HASH_GENESIS) != hash_escritura:
+            fallidos += 1
+    return fallidos
+
+
+def encadenar_escritura(filas, version: int) -> float:
+    """Como CabezaCadena.escribir_lote: desde el diccionario del registro"""
+    registros = [fila._asdict() for fila in filas]
+    hash_anterior = HASH_GENESIS
+    inicio = time.perf_counter()
+    for datos in registros:
+        hash_anterior = calcular_hash(datos, hash_anterior, version)
+    return time.perf_counter() - inicio
+
+
+def encadenar_verificacion(filas) -> float:
+    """Como TramoCadena.verificar: directamente desde la fila leída"""
+    hash_anterior = HASH_GENESIS
+    inicio = time.perf_counter()
+    for fila in filas:
+        hash_anterior = calcular_hash_fila(fila, hash_anterior)
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--registros", type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"#️⃣  Registros: {args.registros}")
+    resultados = {}
+    for nombre, version in (("v1 JSON", VERSION_HASH_JSON), ("v2 binario", VERSION_HASH_BINARIO)):
+        filas = generar_filas(args.registros, version)
+        fallidos = comprobar_ida_y_vuelta(filas, version)
+        if fallidos:
+            print(f"❌ {nombre}: {fallidos} hashes no sobreviven la ida y vuelta por DATETIME2(3)")
+            sys.exit(1)
+        escritura = encadenar_escritura(filas, version)
+        verificacion = encadenar_verificacion(filas)
+        resultados[version] = verificacion
+        print(
+            f"  {nombre:<11} escritura {args.registros / escritura:>10,.0f} hashes/s | "
+            f"verificación {args.registros / verificacion:>10,.0f} hashes/s"
+        )
+
+    print("✅ Hashes estables al guardar y releer fecha_hora (DATETIME2(3))")
+    print(f"🚀 Verificación v2 {resultados[VERSION_HASH_JSON] / resultados[VERSION_HASH_BINARIO]:.1f}x más rápida que v1")
+
+
+if __name__ == "__main__":
+    main()
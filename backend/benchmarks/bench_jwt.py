@@ -0,0 +1,75 @@
+"""
+Microbenchmark de backends JWT: throughput de codificar y decodificar
+
+Mide tokens/s de cada backend registrado en security/tokens_jwt.py con un
+payload igual al de un access token real (sub, rol, perm, exp, type).
+Los backends cuya librería no está instalada se omiten.
+
+Uso (desde backend/):
+    python benchmarks/bench_jwt.py --iteraciones 50000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from security.tokens_jwt import BACKENDS, AnilloClaves
+
+
+def medir(funcion, iteraciones: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(iteraciones):
+        funcion()
+    return iteraciones / (time.perf_counter() - inicio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iteraciones", type=int, default=50000)
+    args = parser.parse_args()
+
+    anillo = AnilloClaves({"2025a": "clave-anterior-de-prueba", "2025b": "clave-activa-de-prueba"}, "2025b")
+    payload = {
+        "sub": "operador01",
+        "rol": "operador",
+        "perm": 0b10001,
+        "type": "access",
+        "exp": datetime.utcnow() + timedelta(hours=1)
+    }
+
+    print(f"🔐 Iteraciones por prueba: {args.iteraciones}")
+    resultados = {}
+    for nombre, clase in BACKENDS.items():
+        backend = clase(anillo)
+        try:
+            token = backend.codificar(payload)
+        except ImportError as e:
+            print(f"  {nombre:<6} omitido ({e})")
+            continue
+
+        # Los tokens deben ser intercambiables entre backends
+        for otro in BACKENDS.values():
+            try:
+                otro(anillo).decodificar(token)
+            except ImportError:
+                pass
+
+        resultados[nombre] = (
+            medir(lambda: backend.codificar(payload), args.iteraciones),
+            medir(lambda: backend.decodificar(token), args.iteraciones)
+        )
+
+    # python-jose es la implementación original: las demás se comparan contra ella
+    referencia = resultados.get("jose")
+    for nombre, (codificar, decodificar) in resultados.items():
+        comparacion = ""
+        if referencia and nombre != "jose":
+            comparacion = f" ({codificar / referencia[0]:.1f}x / {decodificar / referencia[1]:.1f}x vs jose)"
+        print(f"  {nombre:<6} codificar={codificar:>10,.0f}/s decodificar={decodificar:>10,.0f}/s{comparacion}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Prueba de carga: latencia de la API con muchos scanners concurrentes
+
+Simula N scanners que alternan consultas a BD (historial de movimientos) con
+escaneos resueltos en memoria, y reporta p50/p95/p99 por endpoint. Si las
+consultas bloquean el event loop, la latencia de /escanear (que no toca la BD)
+se dispara junto con la del historial; con la capa async se mantiene baja.
+
+Para comparar antes/después, levantar la API en cada versión y correr:
+    uvicorn main:app --port 8000
+    python benchmarks/bench_latencia_scanners.py --scanners 200 --duracion 30
+
+Requiere httpx (pip install httpx), solo para este script.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+
+import httpx
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+async def scanner(cliente: httpx.AsyncClient, codigos, fin: float, latencias, errores):
+    i = 0
+    while time.perf_counter() < fin:
+        codigo = codigos[i % len(codigos)]
+        i += 1
+        for nombre, peticion in (
+            ("escanear", lambda: cliente.post("/api/scanner/escanear", params={"codigo": codigo})),
+            ("historial", lambda: cliente.get(f"/api/scanner/historial-movimientos/{codigo}")),
+        ):
+            inicio = time.perf_counter()
+            try:
+                respuesta = await peticion()
+                if respuesta.status_code >= 500:
+                    errores[nombre] += 1
+            except httpx.HTTPError:
+                errores[nombre] += 1
+                continue
+            latencias[nombre].append((time.perf_counter() - inicio) * 1000)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--scanners", type=int, default=200)
+    parser.add_argument("--duracion", type=float, default=30, help="Segundos de prueba")
+    parser.add_argument("--codigos", default="PROD001,PROD002,PROD003,PROD004,PROD005")
+    args = parser.parse_args()
+
+    codigos = args.codigos.split(",")
+    latencias = defaultdict(list)
+    errores = defaultdict(int)
+    limites = httpx.Limits(max_connections=args.scanners, max_keepalive_connections=args.scanners)
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limites, timeout=60) as cliente:
+        fin = time.perf_counter() + args.duracion
+        await asyncio.gather(*[
+            scanner(cliente, codigos[i % len(codigos):] + codigos[:i % len(codigos)], fin, latencias, errores)
+            for i in range(args.scanners)
+        ])
+
+    print(f"📡 {args.url} | Scanners: {args.scanners} | Duración: {args.duracion:.0f}s")
+    for nombre, valores in latencias.items():
+        print(
+            f"  {nombre:<10} n={len(valores):>7} "
+            f"p50={percentil(valores, 50):8.1f}ms "
+            f"p95={percentil(valores, 95):8.1f}ms "
+            f"p99={percentil(valores, 99):8.1f}ms "
+            f"media={statistics.fmean(valores):8.1f}ms "
+            f"errores={errores[nombre]}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+Prueba de carga: ola de logins concurrentes vs latencia del scanner
+
+Lanza N logins simultáneos (inicio de turno) y, mientras duran, mide la
+latencia de /api/scanner/escanear con una sonda continua. Con bcrypt dentro
+del event loop la sonda queda bloqueada hasta que terminan los logins; con
+el pool de hashing su latencia debe mantenerse en milisegundos.
+
+Uso (API levantada y un usuario de prueba existente):
+    uvicorn main:app --port 8000
+    python benchmarks/bench_logins_concurrentes.py --logins 100 --usuario operador01 --password 'Clave#2025'
+
+Requiere httpx (pip install httpx), solo para este script.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from bench_latencia_scanners import percentil
+
+
+async def login(cliente: httpx.AsyncClient, usuario: str, password: str, latencias, estados):
+    inicio = time.perf_counter()
+    respuesta = await cliente.post("/api/auth/login", data={"username": usuario, "password": password})
+    latencias.append((time.perf_counter() - inicio) * 1000)
+    estados[respuesta.status_code] = estados.get(respuesta.status_code, 0) + 1
+
+
+async def sonda(cliente: httpx.AsyncClient, codigo: str, activa: asyncio.Event, latencias):
+    while not activa.is_set():
+        inicio = time.perf_counter()
+        try:
+            await cliente.post("/api/scanner/escanear", params={"codigo": codigo})
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.02)
+
+
+def reportar(nombre: str, valores):
+    if not valores:
+        print(f"  {nombre:<10} sin datos")
+        return
+    print(
+        f"  {nombre:<10} n={len(valores):>5} "
+        f"p50={percentil(valores, 50):8.1f}ms "
+        f"p99={percentil(valores, 99):8.1f}ms "
+        f"max={max(valores):8.1f}ms "
+        f"media={statistics.fmean(valores):8.1f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--usuario", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--codigo", default="PROD001", help="Código que consulta la sonda")
+    args = parser.parse_args()
+
+    latencias_login = []
+    latencias_sonda = []
+    estados = {}
+    fin_logins = asyncio.Event()
+    limites = httpx.Limits(max_connections=args.logins + 5)
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limites, timeout=120) as cliente:
+        tarea_sonda = asyncio.create_task(sonda(cliente, args.codigo, fin_logins, latencias_sonda))
+        inicio = time.perf_counter()
+        await asyncio.gather(*[
+            login(cliente, args.usuario, args.password, latencias_login, estados)
+            for _ in range(args.logins)
+        ])
+        duracion = time.perf_counter() - inicio
+        fin_logins.set()
+        await tarea_sonda
+
+        hashing = (await cliente.get("/health/hashing")).json()
+
+    print(f"🔑 {args.url} | Logins concurrentes: {args.logins} | Duración de la ola: {duracion:.2f}s")
+    print(f"   Respuestas: {estados}")
+    reportar("login", latencias_login)
+    reportar("escanear", latencias_sonda)
+    print(f"📊 Pool de hashing: {hashing}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
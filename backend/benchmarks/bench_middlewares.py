@@ -0,0 +1,145 @@
+"""
+Benchmark de la pila de middlewares: ASGI puro vs BaseHTTPMiddleware
+
+Arma una aplicación Starlette mínima en el mismo proceso y la invoca por
+ASGI directamente (sin red ni servidor), con tres pilas:
+    - sin middlewares (referencia)
+    - RateLimit + SecurityHeaders sobre BaseHTTPMiddleware (implementación anterior)
+    - RateLimit + SecurityHeaders ASGI puros (security/middleware.py)
+
+Reporta el costo por request agregado por cada pila y, para una respuesta
+en streaming (5 partes separadas por 50 ms, como una exportación grande),
+en qué momento llega cada parte al servidor: si llegan espaciadas, la
+respuesta se transmite mientras se genera.
+
+Uso (desde backend/):
+    python benchmarks/bench_middlewares.py --peticiones 20000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from security.limitador import LimitadorTokens
+from security.middleware import RateLimitMiddleware, SecurityHeadersMiddleware
+
+PARTES_STREAMING = 5
+PAUSA_STREAMING = 0.05
+
+
+async def ping(request):
+    return JSONResponse({"ok": True})
+
+
+async def exportacion(request):
+    async def generar():
+        for i in range(PARTES_STREAMING):
+            yield f"parte {i}\n".encode() * 1000
+            await asyncio.sleep(PAUSA_STREAMING)
+    return StreamingResponse(generar(), media_type="text/plain")
+
+
+def crear_app():
+    return Starlette(routes=[Route("/ping", ping), Route("/exportacion", exportacion)])
+
+
+class RateLimitAnterior(BaseHTTPMiddleware):
+    """Implementación anterior (BaseHTTPMiddleware) con el mismo limitador"""
+
+    def __init__(self, app, requests_per_minute: int):
+        super().__init__(app)
+        self.limitador = LimitadorTokens(por_minuto=requests_per_minute)
+
+    async def dispatch(self, request, call_next):
+        permitida, _ = self.limitador.consumir(request.client.host, request.url.path)
+        if not permitida:
+            return JSONResponse({"detail": "Límite excedido"}, status_code=429)
+        return await call_next(request)
+
+
+class SecurityHeadersAnterior(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-XSS-Protection"] = "1; mode=block"
+        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+        response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
+        return response
+
+
+def crear_pilas(limite: int):
+    sin_middlewares = crear_app()
+
+    anterior = crear_app()
+    anterior.add_middleware(RateLimitAnterior, requests_per_minute=limite)
+    anterior.add_middleware(SecurityHeadersAnterior)
+
+    asgi = crear_app()
+    asgi.add_middleware(RateLimitMiddleware, requests_per_minute=limite, limites_ruta=[])
+    asgi.add_middleware(SecurityHeadersMiddleware)
+
+    return {"sin middlewares": sin_middlewares, "BaseHTTP": anterior, "ASGI puro": asgi}
+
+
+async def invocar(app, ruta: str, ip: str = "10.0.0.1"):
+    """Ejecuta una petición GET y retorna (status, [instante de cada parte del cuerpo])"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": ruta, "raw_path": ruta.encode(),
+        "query_string": b"", "root_path": "", "headers": [(b"host", b"bench")],
+        "client": (ip, 50000), "server": ("bench", 80),
+    }
+    estado = {}
+    partes = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            estado["status"] = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            partes.append(time.perf_counter())
+
+    await app(scope, receive, send)
+    return estado.get("status"), partes
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--peticiones", type=int, default=20000)
+    args = parser.parse_args()
+
+    pilas = crear_pilas(limite=args.peticiones * 10)
+    print(f"🧅 Peticiones por pila: {args.peticiones}")
+
+    referencia = None
+    for nombre, app in pilas.items():
+        await invocar(app, "/ping")  # calentamiento
+        inicio = time.perf_counter()
+        for i in range(args.peticiones):
+            await invocar(app, "/ping", ip=f"10.0.{i // 256 % 256}.{i % 256}")
+        por_request = (time.perf_counter() - inicio) / args.peticiones * 1e6
+        referencia = referencia or por_request
+        print(f"  {nombre:<16} {por_request:8.1f} µs/request (+{por_request - referencia:6.1f} µs)")
+
+    print(f"📦 Streaming: {PARTES_STREAMING} partes generadas cada {PAUSA_STREAMING * 1000:.0f} ms")
+    for nombre, app in pilas.items():
+        inicio = time.perf_counter()
+        status, partes = await invocar(app, "/exportacion")
+        llegadas = ", ".join(f"{(t - inicio) * 1000:.0f}" for t in partes)
+        print(f"  {nombre:<16} status={status} partes={len(partes)} llegada_ms=[{llegadas}]")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
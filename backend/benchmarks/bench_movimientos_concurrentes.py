@@ -0,0 +1,175 @@
+"""
+Benchmark de concurrencia para ServicioMovimientos
+
+Lanza muchos hilos registrando entradas y salidas sobre el MISMO producto
+(SKU caliente) y al final verifica que no haya deriva:
+
+    stock_final == stock_inicial + suma(deltas confirmados)
+    stock_final == stock_inicial + suma(movimientos insertados en BD)
+
+Con --modo cola los mismos movimientos pasan por la cola de group commit
+(ColaMovimientos) en lugar de una transacción por movimiento.
+
+Uso (desde backend/, con .env apuntando a una BD de pruebas):
+    python benchmarks/bench_movimientos_concurrentes.py --hilos 32 --movimientos 200
+    python benchmarks/bench_movimientos_concurrentes.py --modo cola --hilos 200 --movimientos 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import text
+
+from database import SessionLocal
+from services.movimientos_service import (
+    ServicioMovimientos, StockInsuficiente, calcular_delta
+)
+from services.cola_movimientos import ColaMovimientos
+
+CODIGO_BENCH = "BENCHHOT001"
+STOCK_INICIAL = 1_000_000
+
+
+def preparar_producto():
+    db = SessionLocal()
+    try:
+        db.execute(text("""
+            IF NOT EXISTS (SELECT 1 FROM productos WHERE codigo = :codigo)
+                INSERT INTO productos (codigo, nombre, stock_actual, activo)
+                VALUES (:codigo, 'Producto benchmark', :stock, 1)
+            ELSE
+                UPDATE productos SET stock_actual = :stock, activo = 1 WHERE codigo = :codigo
+        """), {"codigo": CODIGO_BENCH, "stock": STOCK_INICIAL})
+        producto_id = db.execute(
+            text("SELECT id FROM productos WHERE codigo = :codigo"), {"codigo": CODIGO_BENCH}
+        ).scalar()
+        db.execute(text("DELETE FROM movimientos WHERE producto_id = :id"), {"id": producto_id})
+        db.commit()
+        return producto_id
+    finally:
+        db.close()
+
+
+def leer_estado(producto_id: int):
+    db = SessionLocal()
+    try:
+        stock = db.execute(
+            text("SELECT stock_actual FROM productos WHERE id = :id"), {"id": producto_id}
+        ).scalar()
+        suma_movimientos = db.execute(text("""
+            SELECT ISNULL(SUM(CASE tipo_movimiento
+                WHEN 'ENTRADA' THEN cantidad
+                WHEN 'SALIDA' THEN -cantidad
+                ELSE cantidad END), 0)
+            FROM movimientos WHERE producto_id = :id
+        """), {"id": producto_id}).scalar()
+        return stock, suma_movimientos
+    finally:
+        db.close()
+
+
+def movimiento_aleatorio():
+    return random.choice(("ENTRADA", "SALIDA")), random.randint(1, 20)
+
+
+async def ejecutar_con_cola(servicio: ServicioMovimientos, scanners: int, movimientos: int):
+    """Cada scanner es una corrutina que registra sus movimientos vía group commit"""
+    cola = ColaMovimientos(servicio=servicio)
+    await cola.iniciar()
+
+    async def scanner():
+        suma = 0
+        errores = 0
+        for _ in range(movimientos):
+            tipo, cantidad = movimiento_aleatorio()
+            try:
+                await cola.registrar(CODIGO_BENCH, tipo, cantidad, referencia="BENCH")
+                suma += calcular_delta(tipo, cantidad)
+            except StockInsuficiente:
+                pass
+            except Exception as e:
+                errores += 1
+                print(f"Error en movimiento: {e}")
+        return suma, errores
+
+    resultados = await asyncio.gather(*[scanner() for _ in range(scanners)])
+    await cola.detener()
+    print(f"📊 Cola: {cola.obtener_estadisticas()}")
+    return sum(r[0] for r in resultados), sum(r[1] for r in resultados)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modo", choices=("directo", "cola"), default="directo")
+    parser.add_argument("--hilos", type=int, default=32, help="Hilos o scanners concurrentes")
+    parser.add_argument("--movimientos", type=int, default=200, help="Movimientos por hilo")
+    args = parser.parse_args()
+
+    producto_id = preparar_producto()
+    servicio = ServicioMovimientos()
+
+    if args.modo == "cola":
+        inicio = time.perf_counter()
+        suma_confirmada, errores = asyncio.run(
+            ejecutar_con_cola(servicio, args.hilos, args.movimientos)
+        )
+        reportar(args, producto_id, suma_confirmada, errores, time.perf_counter() - inicio)
+        return
+
+    suma_confirmada = 0
+    errores = 0
+    lock = threading.Lock()
+
+    def trabajador():
+        nonlocal suma_confirmada, errores
+        suma_local = 0
+        errores_local = 0
+        for _ in range(args.movimientos):
+            tipo, cantidad = movimiento_aleatorio()
+            try:
+                servicio.registrar(CODIGO_BENCH, tipo, cantidad, referencia="BENCH")
+                suma_local += calcular_delta(tipo, cantidad)
+            except StockInsuficiente:
+                pass
+            except Exception as e:
+                errores_local += 1
+                print(f"Error en movimiento: {e}")
+        with lock:
+            suma_confirmada += suma_local
+            errores += errores_local
+
+    hilos = [threading.Thread(target=trabajador) for _ in range(args.hilos)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    reportar(args, producto_id, suma_confirmada, errores, time.perf_counter() - inicio)
+
+
+def reportar(args, producto_id: int, suma_confirmada: int, errores: int, duracion: float):
+    total = args.hilos * args.movimientos
+    stock_final, suma_movimientos = leer_estado(producto_id)
+    deriva_confirmada = stock_final - (STOCK_INICIAL + suma_confirmada)
+    deriva_tabla = stock_final - (STOCK_INICIAL + suma_movimientos)
+
+    print(f"🧵 Modo: {args.modo} | Concurrencia: {args.hilos} | Movimientos: {total} | Errores: {errores}")
+    print(f"⏱️  Duración: {duracion:.2f}s | Throughput: {total / duracion:,.0f} mov/s")
+    print(f"📦 Stock final: {stock_final}")
+    print(f"🔎 Deriva vs deltas confirmados: {deriva_confirmada}")
+    print(f"🔎 Deriva vs tabla movimientos: {deriva_tabla}")
+
+    if deriva_confirmada or deriva_tabla:
+        print("❌ Se detectaron actualizaciones perdidas")
+        sys.exit(1)
+    print("✅ Sin deriva")
+
+
+if __name__ == "__main__":
+    main()
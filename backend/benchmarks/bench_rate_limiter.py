@@ -0,0 +1,101 @@
+"""
+Benchmark del rate limiter con muchas IPs distintas
+
+Compara el algoritmo original de RateLimitMiddleware (lista de timestamps por
+IP reconstruida en cada request) con LimitadorTokens (token bucket O(1)),
+repartiendo peticiones entre N IPs. Reporta peticiones/s y memoria retenida.
+
+Uso (desde backend/):
+    python benchmarks/bench_rate_limiter.py --ips 10000 --peticiones 500000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from security.limitador import LimitadorTokens, LimiteRuta
+
+
+class LimitadorListas:
+    """Reproducción del algoritmo anterior, sin la capa HTTP"""
+
+    def __init__(self, por_minuto: int):
+        self.por_minuto = por_minuto
+        self.requests = defaultdict(list)
+        self.blocked_ips = {}
+
+    def consumir(self, ip: str, ruta: str):
+        if ip in self.blocked_ips:
+            if time.time() < self.blocked_ips[ip]:
+                return False, 0
+            del self.blocked_ips[ip]
+        now = time.time()
+        minute_ago = now - 60
+        self.requests[ip] = [t for t in self.requests[ip] if t > minute_ago]
+        if len(self.requests[ip]) >= self.por_minuto:
+            self.blocked_ips[ip] = now + 900
+            return False, 900
+        self.requests[ip].append(now)
+        return True, 0
+
+
+def ejecutar(limitador, secuencia, rutas) -> int:
+    rechazadas = 0
+    for i, ip in enumerate(secuencia):
+        permitida, _ = limitador.consumir(ip, rutas[i % len(rutas)])
+        rechazadas += not permitida
+    return rechazadas
+
+
+def medir(nombre: str, crear_limitador, secuencia, rutas):
+    inicio = time.perf_counter()
+    rechazadas = ejecutar(crear_limitador(), secuencia, rutas)
+    duracion = time.perf_counter() - inicio
+
+    # Memoria en una corrida aparte: tracemalloc distorsiona los tiempos
+    tracemalloc.start()
+    limitador = crear_limitador()
+    ejecutar(limitador, secuencia, rutas)
+    retenida, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"  {nombre:<8} {len(secuencia) / duracion:>12,.0f} req/s "
+        f"rechazadas={rechazadas:>7} memoria_retenida={retenida / 1024 / 1024:7.1f} MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ips", type=int, default=10000)
+    parser.add_argument("--peticiones", type=int, default=500000)
+    parser.add_argument("--por-minuto", type=int, default=100)
+    args = parser.parse_args()
+
+    random.seed(7)
+    ips = [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(args.ips)]
+    random.shuffle(ips)
+    rutas = ["/api/scanner/escanear", "/api/scanner/historial-movimientos/PROD001", "/api/productos"]
+
+    # Tráfico sesgado: el 80% de las peticiones viene del 5% de las IPs (handhelds activos)
+    calientes = ips[:max(1, len(ips) // 20)]
+    secuencia = [
+        random.choice(calientes) if random.random() < 0.8 else random.choice(ips)
+        for _ in range(args.peticiones)
+    ]
+
+    print(f"🚦 IPs: {args.ips} | Peticiones: {args.peticiones} | Límite: {args.por_minuto}/min")
+    medir("listas", lambda: LimitadorListas(args.por_minuto), secuencia, rutas)
+    medir("tokens", lambda: LimitadorTokens(
+        por_minuto=args.por_minuto,
+        limites_ruta=[LimiteRuta("/api/scanner/escanear", args.por_minuto * 6)]
+    ), secuencia, rutas)
+
+
+if __name__ == "__main__":
+    main()
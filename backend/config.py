@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Literal
 
 class Settings(BaseSettings):
     # Database
@@ -9,6 +9,14 @@ class Settings(BaseSettings):
     DATABASE_PASSWORD: str
     DATABASE_DRIVER: str = "ODBC Driver 17 for SQL Server"
     
+    # Pool de conexiones (por worker)
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 10.0
+    DB_POOL_RECYCLE: int = 3600
+    DB_PRE_PING: Literal["siempre", "inactivas", "nunca"] = "inactivas"
+    DB_PRE_PING_INACTIVIDAD: int = 30  # segundos ociosa antes de hacer ping
+    
     # API
     SECRET_KEY: str
     API_HOST: str = "0.0.0.0"
@@ -27,6 +35,11 @@ class Settings(BaseSettings):
             f"?driver={self.DATABASE_DRIVER.replace(' ', '+')}"
         )
     
+    @property
+    def async_database_url(self) -> str:
+        """Cadena de conexión para el engine asíncrono (aioodbc)"""
+        return self.database_url.replace("mssql+pyodbc://", "mssql+aioodbc://", 1)
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
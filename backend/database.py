@@ -1,19 +1,150 @@
-from sqlalchemy import create_engine
+import time
+import threading
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from config import settings
 
+# Límites (ms) de los buckets del histograma de espera por conexión
+BUCKETS_ESPERA_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class EstadisticasPool:
+    """Métricas de uso del pool: esperas por conexión, overflow y agotamientos"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkouts_en_overflow = 0
+        self.agotamientos = 0  # Timeouts esperando conexión
+        self.espera_total_ms = 0.0
+        self.espera_max_ms = 0.0
+        self.histograma = [0] * (len(BUCKETS_ESPERA_MS) + 1)
+    
+    def registrar_checkout(self, espera_ms: float, en_overflow: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.espera_total_ms += espera_ms
+            self.espera_max_ms = max(self.espera_max_ms, espera_ms)
+            if en_overflow:
+                self.checkouts_en_overflow += 1
+            for i, limite in enumerate(BUCKETS_ESPERA_MS):
+                if espera_ms <= limite:
+                    self.histograma[i] += 1
+                    break
+            else:
+                self.histograma[-1] += 1
+    
+    def registrar_agotamiento(self):
+        with self._lock:
+            self.agotamientos += 1
+    
+    def como_dict(self) -> dict:
+        etiquetas = [f"<={b}ms" for b in BUCKETS_ESPERA_MS] + [f">{BUCKETS_ESPERA_MS[-1]}ms"]
+        return {
+            "checkouts": self.checkouts,
+            "checkouts_en_overflow": self.checkouts_en_overflow,
+            "agotamientos": self.agotamientos,
+            "espera_promedio_ms": self.espera_total_ms / self.checkouts if self.checkouts else 0.0,
+            "espera_max_ms": self.espera_max_ms,
+            "histograma_espera": dict(zip(etiquetas, self.histograma))
+        }
+
+
+class _PoolMedido:
+    """Mixin que mide cuánto espera cada checkout por una conexión libre"""
+    
+    estadisticas: EstadisticasPool
+    
+    def _do_get(self):
+        inicio = time.perf_counter()
+        overflow_antes = self.overflow()
+        try:
+            conexion = super()._do_get()
+        except exc.TimeoutError:
+            self.estadisticas.registrar_agotamiento()
+            raise
+        # En overflow solo si este checkout abrió una conexión por encima de pool_size
+        # (overflow() tras el checkout refleja conexiones de otros requests)
+        overflow_despues = self.overflow()
+        self.estadisticas.registrar_checkout(
+            (time.perf_counter() - inicio) * 1000,
+            overflow_despues > overflow_antes and overflow_despues > 0
+        )
+        return conexion
+
+
+class QueuePoolMedido(_PoolMedido, QueuePool):
+    estadisticas = EstadisticasPool()
+
+
+class AsyncQueuePoolMedido(_PoolMedido, AsyncAdaptedQueuePool):
+    estadisticas = EstadisticasPool()
+
+
+def _opciones_pool() -> dict:
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        # "siempre": ping en cada checkout (un round trip extra por request)
+        "pool_pre_ping": settings.DB_PRE_PING == "siempre",
+    }
+
+
+def _configurar_ping_inactivas(engine_sync):
+    """
+    Estrategia de pre-ping "inactivas": solo se hace ping a conexiones que
+    estuvieron ociosas más de DB_PRE_PING_INACTIVIDAD segundos.
+    """
+    @event.listens_for(engine_sync, "checkin")
+    def _marcar_devolucion(dbapi_connection, connection_record):
+        connection_record.info["devuelta_en"] = time.monotonic()
+    
+    @event.listens_for(engine_sync, "checkout")
+    def _ping_si_inactiva(dbapi_connection, connection_record, connection_proxy):
+        devuelta_en = connection_record.info.get("devuelta_en")
+        if devuelta_en is None or time.monotonic() - devuelta_en < settings.DB_PRE_PING_INACTIVIDAD:
+            return
+        if not engine_sync.dialect.do_ping(dbapi_connection):
+            # El pool descarta esta conexión y reintenta con una nueva
+            raise exc.DisconnectionError("Conexión inactiva no responde al ping")
+
+
 # Crear engine de SQLAlchemy
 engine = create_engine(
     settings.database_url,
     echo=settings.DEBUG,
-    pool_pre_ping=True,
-    pool_recycle=3600
+    poolclass=QueuePoolMedido,
+    **_opciones_pool()
+)
+
+# Engine asíncrono (aioodbc) para los endpoints async: las consultas no
+# bloquean el event loop mientras esperan a SQL Server
+async_engine = create_async_engine(
+    settings.async_database_url,
+    echo=settings.DEBUG,
+    poolclass=AsyncQueuePoolMedido,
+    **_opciones_pool()
 )
 
+if settings.DB_PRE_PING == "inactivas":
+    _configurar_ping_inactivas(engine)
+    _configurar_ping_inactivas(async_engine.sync_engine)
+
 # Crear sesión
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Base para modelos
 Base = declarative_base()
 
@@ -24,3 +155,24 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependencia para obtener sesión asíncrona de BD (usar en endpoints async def)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def obtener_estadisticas_pool() -> dict:
+    """Estado actual y métricas acumuladas de los pools sync y async"""
+    resultado = {}
+    for nombre, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)):
+        resultado[nombre] = {
+            "tamano": pool.size(),
+            "max_overflow": settings.DB_MAX_OVERFLOW,
+            "en_uso": pool.checkedout(),
+            "disponibles": pool.checkedin(),
+            "overflow_actual": pool.overflow(),
+            "pre_ping": settings.DB_PRE_PING,
+            **type(pool).estadisticas.como_dict()
+        }
+    return resultado
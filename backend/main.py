@@ -10,6 +10,16 @@ load_dotenv()
 # Importar routers
 from routes.scanner import router as scanner_router
 from routes.notificaciones import router as notificaciones_router
+from routes.inventario import router as inventario_router
+from routes.auth import router as auth_router
+from services.indice_productos import indice_productos
+from services.cola_movimientos import cola_movimientos
+from services.kpis_incrementales import agregador_kpis
+from services.detector_stock import detector_stock, notificar_por_whatsapp
+from database import obtener_estadisticas_pool, SessionLocal
+from security.auth import cache_tokens, cache_usuarios, modelo_permisos, pool_hashing
+from security.sesiones import registro_sesiones
+from security.cola_auditoria import cola_auditoria
 
 # Crear aplicación FastAPI
 app = FastAPI(
@@ -38,6 +48,44 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Registrar routers
 app.include_router(scanner_router)
 app.include_router(notificaciones_router)
+app.include_router(inventario_router)
+app.include_router(auth_router)
+
+@app.on_event("startup")
+async def startup():
+    # Cargar índice de productos en memoria para el scanner
+    await indice_productos.iniciar()
+    # KPIs incrementales alimentados por los cambios que detecta el índice
+    indice_productos.suscribir(agregador_kpis.aplicar_producto)
+    await agregador_kpis.iniciar()
+    # Alertas de stock por cruce de banda (CRÍTICO / BAJO / NORMAL)
+    indice_productos.suscribir(detector_stock.aplicar_producto)
+    telefono_alertas = os.getenv("ADMIN_WHATSAPP_NUMBER")
+    if telefono_alertas:
+        try:
+            detector_stock.suscribir(notificar_por_whatsapp(telefono_alertas))
+        except Exception as e:
+            print(f"Alertas de stock por WhatsApp desactivadas: {e}")
+    await detector_stock.iniciar()
+    # Permisos por rol desde roles_permisos (recarga en caliente)
+    await modelo_permisos.iniciar(SessionLocal)
+    # Revocaciones de sesiones (logout / desactivación) hechas en cualquier worker
+    await registro_sesiones.iniciar(SessionLocal)
+    # Cola de group commit para movimientos desde móviles
+    await cola_movimientos.iniciar()
+    # Cola de group commit para la auditoría encadenada
+    await cola_auditoria.iniciar(SessionLocal)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await cola_movimientos.detener()
+    await cola_auditoria.detener()
+    await registro_sesiones.detener()
+    await modelo_permisos.detener()
+    await detector_stock.detener()
+    await agregador_kpis.detener()
+    await indice_productos.detener()
+    pool_hashing.cerrar()
 
 @app.get("/")
 async def root():
@@ -51,6 +99,31 @@ async def root():
 async def health_check():
     return {"status": "healthy", "database": "pending"}
 
+@app.get("/health/pool")
+async def health_pool():
+    """Métricas del pool de conexiones de este worker"""
+    return obtener_estadisticas_pool()
+
+@app.get("/health/tokens")
+async def health_tokens():
+    """Aciertos y fallos de la caché de tokens verificados de este worker"""
+    return cache_tokens.obtener_estadisticas()
+
+@app.get("/health/usuarios")
+async def health_usuarios():
+    """Aciertos, esperas y fallos de la caché de perfiles de usuario de este worker"""
+    return cache_usuarios.obtener_estadisticas()
+
+@app.get("/health/hashing")
+async def health_hashing():
+    """Cola y tiempos del pool de bcrypt de este worker"""
+    return pool_hashing.obtener_estadisticas()
+
+@app.get("/health/auditoria")
+async def health_auditoria():
+    """Lotes y tiempos de escritura de la auditoría de este worker"""
+    return cola_auditoria.obtener_estadisticas()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, FetchedValue
+from sqlalchemy.dialects.mssql import ROWVERSION
 from sqlalchemy.sql import func
 from database import Base
 
@@ -28,6 +29,8 @@ class Producto(Base):
     activo = Column(Boolean, default=True)
     fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
     fecha_actualizacion = Column(DateTime(timezone=True), onupdate=func.now())
+    # Lo asigna SQL Server en cada INSERT/UPDATE (marca de agua del polling)
+    version_fila = Column(ROWVERSION, server_default=FetchedValue(), server_onupdate=FetchedValue())
 
 class Movimiento(Base):
     __tablename__ = "movimientos"
@@ -41,6 +44,9 @@ class Movimiento(Base):
     referencia = Column(String(100))  # Número de pedido, factura, etc.
     observaciones = Column(String(500))
     
+    # Saldo del producto inmediatamente después de este movimiento
+    stock_resultante = Column(Integer)
+    
     fecha_movimiento = Column(DateTime(timezone=True), server_default=func.now())
 
 class KPI(Base):
@@ -55,3 +61,43 @@ class KPI(Base):
     valor_inventario = Column(Float, default=0.0)
     rotacion_promedio = Column(Float, default=0.0)
     costo_almacenamiento_total = Column(Float, default=0.0)
+
+class UsuarioModelo(Base):
+    """Tabla usuarios (ver security/schema_seguridad.sql); el esquema de API es security.auth.Usuario"""
+    __tablename__ = "usuarios"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String(100), unique=True, nullable=False)
+    email = Column(String(255), unique=True, nullable=False)
+    hashed_password = Column(String(255), nullable=False)
+    nombre_completo = Column(String(200), nullable=False)
+    rol = Column(String(50), nullable=False)
+    
+    # Estado
+    activo = Column(Boolean, default=True)
+    intentos_fallidos = Column(Integer, default=0)
+    bloqueado_hasta = Column(DateTime)
+    ultimo_acceso = Column(DateTime)
+    ultimo_cambio_password = Column(DateTime)
+    
+    # Metadatos
+    fecha_creacion = Column(DateTime, server_default=func.now())
+    fecha_modificacion = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    creado_por = Column(Integer)
+    modificado_por = Column(Integer)
+
+class SesionActiva(Base):
+    """Tabla sesiones_activas: una fila por login; token_sesion guarda el sid de los JWT"""
+    __tablename__ = "sesiones_activas"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, nullable=False)
+    token_sesion = Column(String(500), unique=True, nullable=False)
+    fecha_inicio = Column(DateTime, server_default=func.now())
+    fecha_expiracion = Column(DateTime, nullable=False)
+    ultimo_uso = Column(DateTime, server_default=func.now())
+    ip_address = Column(String(45))
+    dispositivo = Column(String(200))
+    ubicacion_gps = Column(String(100))
+    activa = Column(Boolean, default=True)
+    fecha_revocacion = Column(DateTime)
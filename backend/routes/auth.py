@@ -1,41 +1,123 @@
 """
 Rutas de Autenticación y Autorización
 """
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, or_
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from typing import List, Optional
 
 from security.auth import (
-    Token, Usuario, UsuarioCreate,
-    verificar_password, obtener_hash_password,
+    Token, TokenData, Usuario, UsuarioCreate,
+    pool_hashing, HASH_PASSWORD_FICTICIO,
     crear_access_token, crear_refresh_token, verificar_token,
     validar_password_segura, oauth2_scheme,
-    Rol, Permiso, usuario_tiene_permiso,
-    ACCESS_TOKEN_EXPIRE_MINUTES
+    Rol, Permiso, usuario_tiene_permiso, token_tiene_permiso, cache_tokens, cache_usuarios,
+    ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
 )
 from security.middleware import login_tracker
+from security.hash_passwords import PoolHashingSaturado
 from security.auditoria import ServicioAuditoria
+from security.sesiones import registro_sesiones
+from database import get_async_db, AsyncSessionLocal
+from models import UsuarioModelo
 
 router = APIRouter(prefix="/api/auth", tags=["Autenticación"])
 
-# Dependencia para obtener la sesión de base de datos
-def get_db():
-    # TODO: Implementar con tu conexión a SQL Server
-    # from database import SessionLocal
-    # db = SessionLocal()
-    # try:
-    #     yield db
-    # finally:
-    #     db.close()
-    pass
+def usuario_desde_modelo(modelo: UsuarioModelo) -> Usuario:
+    """Convierte la fila de usuarios al esquema de API (sin hashed_password)"""
+    return Usuario(
+        id=modelo.id,
+        username=modelo.username,
+        email=modelo.email,
+        nombre_completo=modelo.nombre_completo,
+        rol=modelo.rol,
+        activo=modelo.activo,
+        intentos_fallidos=modelo.intentos_fallidos or 0,
+        ultimo_acceso=modelo.ultimo_acceso
+    )
+
+def hashing_no_disponible(e: PoolHashingSaturado) -> HTTPException:
+    """503 cuando el pool de bcrypt tiene la cola llena (el cliente reintenta)"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"Servidor ocupado validando contraseñas, reintente en unos segundos ({e})",
+        headers={"Retry-After": "2"}
+    )
+
+# Dependencia: Usuario actual (para usar en otros routers)
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> Usuario:
+    """
+    Obtiene el usuario actual desde el token JWT
+    Úsalo como dependencia en tus endpoints:
+    
+    @app.get("/api/productos")
+    async def obtener_productos(current_user: Usuario = Depends(get_current_user)):
+        # current_user contiene toda la info del usuario autenticado
+        pass
+    """
+    # Siempre se verifica (tipo y revocación de la sesión); con cache_tokens no cuesta una firma
+    return await usuario_del_token(verificar_token(token))
+
+async def usuario_del_token(token_data: TokenData) -> Usuario:
+    """Usuario activo dueño de un token ya verificado"""
+    # Perfil desde cache_usuarios; solo un fallo consulta usuarios (una vez por username)
+    usuario = await cache_usuarios.obtener(
+        token_data.username,
+        lambda: cargar_usuario(token_data.username)
+    )
+    if usuario is None or not usuario.activo:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Usuario inválido o desactivado",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return usuario
+
+async def cargar_usuario(username: str) -> Optional[Usuario]:
+    """Consulta la fila de usuarios (fallo de cache_usuarios)"""
+    async with AsyncSessionLocal() as db:
+        modelo = await db.scalar(
+            select(UsuarioModelo).where(UsuarioModelo.username == username)
+        )
+        return usuario_desde_modelo(modelo) if modelo is not None else None
+
+# Dependencia: Verificar permiso específico
+def require_permission(permiso: str):
+    """
+    Verifica que el usuario tenga un permiso específico
+    
+    Ejemplo de uso:
+    @app.delete("/api/productos/{id}")
+    async def eliminar_producto(
+        id: int,
+        current_user: Usuario = Depends(require_permission(Permiso.ELIMINAR_PRODUCTO))
+    ):
+        pass
+    
+    El permiso se decide con el claim "perm" del token, antes de buscar al
+    usuario: una petición sin permiso se rechaza sin tocar cache_usuarios ni
+    la BD. Un cambio de rol o de roles_permisos se refleja en el siguiente
+    access token (como mucho ACCESS_TOKEN_EXPIRE_MINUTES después).
+    """
+    async def permission_checker(token: str = Depends(oauth2_scheme)):
+        token_data = verificar_token(token)
+        if not token_tiene_permiso(token_data, permiso):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"No tiene el permiso requerido: {permiso}"
+            )
+        return await usuario_del_token(token_data)
+    
+    return permission_checker
 
 @router.post("/login", response_model=Token)
 async def login(
     request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Endpoint de autenticación con JWT
@@ -50,8 +132,12 @@ async def login(
     username = form_data.username
     password = form_data.password
     
+    # El almacén de intentos puede ser SQLite (E/S bloqueante con timeout de
+    # varios segundos): sus llamadas van al executor, fuera del event loop
+    loop = asyncio.get_running_loop()
+    
     # 1. Verificar si la cuenta está bloqueada
-    esta_bloqueado, minutos_restantes = login_tracker.esta_bloqueado(username)
+    esta_bloqueado, minutos_restantes = await loop.run_in_executor(None, login_tracker.esta_bloqueado, username)
     if esta_bloqueado:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -59,22 +145,25 @@ async def login(
         )
     
     # 2. Buscar usuario en base de datos
-    # TODO: Implementar consulta real a SQL Server
-    # Por ahora, usuario por defecto
-    if username == "admin" and password == "Admin123!":
-        usuario = Usuario(
-            id=1,
-            username="admin",
-            email="admin@inventarios.com",
-            nombre_completo="Administrador del Sistema",
-            rol=Rol.ADMINISTRADOR,
-            activo=True,
-            intentos_fallidos=0,
-            ultimo_acceso=datetime.now()
+    modelo = await db.scalar(
+        select(UsuarioModelo).where(UsuarioModelo.username == username)
+    )
+    
+    # Usuario inexistente: se verifica igual contra un hash ficticio (mismo tiempo de respuesta)
+    try:
+        password_valida, nuevo_hash = await pool_hashing.verificar(
+            password, modelo.hashed_password if modelo is not None else HASH_PASSWORD_FICTICIO
         )
-    else:
+    except PoolHashingSaturado as e:
+        raise hashing_no_disponible(e)
+    if modelo is None:
+        password_valida, nuevo_hash = False, None
+    
+    if not password_valida:
         # Registrar intento fallido
-        bloqueado, intentos_restantes, mins_bloqueo = login_tracker.registrar_intento_fallido(username)
+        bloqueado, intentos_restantes, mins_bloqueo = await loop.run_in_executor(
+            None, login_tracker.registrar_intento_fallido, username
+        )
         
         if bloqueado:
             raise HTTPException(
@@ -88,6 +177,8 @@ async def login(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    usuario = usuario_desde_modelo(modelo)
+    
     # 3. Verificar que el usuario esté activo
     if not usuario.activo:
         raise HTTPException(
@@ -96,19 +187,28 @@ async def login(
         )
     
     # 4. Login exitoso - limpiar intentos fallidos
-    login_tracker.registrar_intento_exitoso(username)
+    await loop.run_in_executor(None, login_tracker.registrar_intento_exitoso, username)
     
-    # 5. Crear tokens JWT
+    # 5. Registrar la sesión (vive lo mismo que el refresh token)
+    sid = await registro_sesiones.crear_sesion(
+        db,
+        usuario_id=usuario.id,
+        expira=datetime.now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        ip_address=request.client.host if request.client else None,
+        dispositivo=request.headers.get("User-Agent")
+    )
+    
+    # 6. Crear tokens JWT
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = crear_access_token(
-        data={"sub": usuario.username, "rol": usuario.rol},
+        data={"sub": usuario.username, "rol": usuario.rol, "sid": sid},
         expires_delta=access_token_expires
     )
     refresh_token = crear_refresh_token(
-        data={"sub": usuario.username}
+        data={"sub": usuario.username, "rol": usuario.rol, "sid": sid}
     )
     
-    # 6. Registrar en auditoría
+    # 7. Registrar en auditoría
     # auditoria = ServicioAuditoria(db)
     # auditoria.registrar_movimiento(
     #     usuario_id=usuario.id,
@@ -120,8 +220,18 @@ async def login(
     #     dispositivo=request.headers.get("User-Agent")
     # )
     
-    # 7. Actualizar último acceso
-    # TODO: UPDATE usuarios SET ultimo_acceso = NOW(), intentos_fallidos = 0 WHERE id = usuario.id
+    # 8. Actualizar último acceso (y el hash si cambió el costo de bcrypt)
+    valores = {"ultimo_acceso": datetime.now(), "intentos_fallidos": 0}
+    if nuevo_hash:
+        valores["hashed_password"] = nuevo_hash
+    await db.execute(
+        update(UsuarioModelo)
+        .where(UsuarioModelo.id == usuario.id)
+        .values(**valores)
+    )
+    await db.commit()
+    usuario.ultimo_acceso = valores["ultimo_acceso"]
+    cache_usuarios.guardar(usuario)
     
     return {
         "access_token": access_token,
@@ -135,14 +245,14 @@ async def refresh_token_endpoint(refresh_token: str):
     Refresca el access token usando el refresh token
     """
     try:
-        token_data = verificar_token(refresh_token)
+        # Solo refresh tokens de una sesión registrada y no revocada
+        token_data = verificar_token(refresh_token, tipo="refresh")
+        if token_data.sid is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
         
-        # Verificar que sea un refresh token
-        # TODO: Agregar validación de tipo de token
-        
-        # Crear nuevo access token
+        # Crear nuevo access token de la misma sesión
         access_token = crear_access_token(
-            data={"sub": token_data.username, "rol": token_data.rol}
+            data={"sub": token_data.username, "rol": token_data.rol, "sid": token_data.sid}
         )
         
         return {
@@ -159,15 +269,18 @@ async def refresh_token_endpoint(refresh_token: str):
 @router.post("/logout")
 async def logout(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Cierra la sesión del usuario
     """
     token_data = verificar_token(token)
+    cache_tokens.invalidar_token(token)
     
-    # TODO: Invalidar token en base de datos
-    # UPDATE sesiones_activas SET activa = 0 WHERE token_sesion = token
+    # Revocar la sesión: invalida también el refresh token y, en los demás
+    # workers, el access token en cuanto refresquen las revocaciones
+    if token_data.sid is not None:
+        await registro_sesiones.revocar(db, token_data.sid)
     
     # Registrar en auditoría
     # auditoria = ServicioAuditoria(db)
@@ -179,7 +292,7 @@ async def logout(
 async def registrar_usuario(
     usuario_nuevo: UsuarioCreate,
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Crea un nuevo usuario
@@ -200,38 +313,55 @@ async def registrar_usuario(
             detail=mensaje
         )
     
-    # Verificar que el username no exista
-    # TODO: SELECT * FROM usuarios WHERE username = usuario_nuevo.username
-    
-    # Verificar que el email no exista
-    # TODO: SELECT * FROM usuarios WHERE email = usuario_nuevo.email
+    # Verificar que el username o el email no existan
+    existente = await db.scalar(
+        select(UsuarioModelo.username).where(or_(
+            UsuarioModelo.username == usuario_nuevo.username,
+            UsuarioModelo.email == usuario_nuevo.email
+        ))
+    )
+    if existente is not None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="El nombre de usuario o el email ya están registrados"
+        )
     
     # Crear usuario
-    hashed_password = obtener_hash_password(usuario_nuevo.password)
-    
-    # TODO: INSERT INTO usuarios (username, email, hashed_password, nombre_completo, rol) VALUES (...)
+    try:
+        hashed_password = await pool_hashing.hash(usuario_nuevo.password)
+    except PoolHashingSaturado as e:
+        raise hashing_no_disponible(e)
     
-    return Usuario(
-        id=999,  # TODO: ID real de la base de datos
+    modelo = UsuarioModelo(
         username=usuario_nuevo.username,
         email=usuario_nuevo.email,
+        hashed_password=hashed_password,
         nombre_completo=usuario_nuevo.nombre_completo,
         rol=usuario_nuevo.rol,
         activo=True,
-        intentos_fallidos=0
+        intentos_fallidos=0,
+        creado_por=current_user.id
     )
+    db.add(modelo)
+    await db.commit()
+    await db.refresh(modelo)
+    
+    usuario = usuario_desde_modelo(modelo)
+    cache_usuarios.guardar(usuario)
+    return usuario
 
 @router.get("/me", response_model=Usuario)
 async def obtener_usuario_actual(current_user: Usuario = Depends(get_current_user)):
     """
     Obtiene información del usuario autenticado
+    Se sirve desde cache_usuarios (sin consultar SQL Server en un acierto)
     """
     return current_user
 
 @router.get("/usuarios", response_model=List[Usuario])
 async def listar_usuarios(
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Lista todos los usuarios
@@ -243,15 +373,15 @@ async def listar_usuarios(
             detail="No tiene permiso para ver usuarios"
         )
     
-    # TODO: SELECT * FROM usuarios
+    modelos = await db.scalars(select(UsuarioModelo).order_by(UsuarioModelo.username))
     
-    return []
+    return [usuario_desde_modelo(m) for m in modelos]
 
 @router.put("/usuarios/{usuario_id}/activar")
 async def activar_usuario(
     usuario_id: int,
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Activa/desactiva un usuario
@@ -263,19 +393,32 @@ async def activar_usuario(
             detail="No tiene permiso para modificar usuarios"
         )
     
-    # TODO: UPDATE usuarios SET activo = NOT activo WHERE id = usuario_id
+    modelo = await db.get(UsuarioModelo, usuario_id)
+    if modelo is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    
+    modelo.activo = not modelo.activo
+    modelo.modificado_por = current_user.id
+    await db.commit()
+    cache_usuarios.guardar(usuario_desde_modelo(modelo))
+    
+    if not modelo.activo:
+        cache_tokens.invalidar_usuario(modelo.username)
+        await registro_sesiones.revocar_usuario(db, modelo.id)
     
-    return {"message": "Usuario actualizado"}
+    return {"message": "Usuario actualizado", "activo": modelo.activo}
 
 @router.put("/usuarios/cambiar-password")
 async def cambiar_password(
     password_actual: str,
     password_nueva: str,
+    token: str = Depends(oauth2_scheme),
     current_user: Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Cambia la contraseña del usuario actual
+    Cierra las demás sesiones del usuario; la actual sigue activa
     """
     # Validar contraseña nueva
     es_valida, mensaje = validar_password_segura(password_nueva)
@@ -285,59 +428,29 @@ async def cambiar_password(
             detail=mensaje
         )
     
-    # TODO: Verificar password actual
-    # TODO: UPDATE usuarios SET hashed_password = nuevo_hash, ultimo_cambio_password = NOW()
-    
-    return {"message": "Contraseña actualizada exitosamente"}
-
-# Dependencia: Usuario actual (para usar en otros routers)
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> Usuario:
-    """
-    Obtiene el usuario actual desde el token JWT
-    Úsalo como dependencia en tus endpoints:
-    
-    @app.get("/api/productos")
-    async def obtener_productos(current_user: Usuario = Depends(get_current_user)):
-        # current_user contiene toda la info del usuario autenticado
-        pass
-    """
-    token_data = verificar_token(token)
-    
-    # TODO: Consultar usuario de base de datos
-    # usuario = db.query(Usuario).filter(Usuario.username == token_data.username).first()
-    # if not usuario or not usuario.activo:
-    #     raise HTTPException(status_code=401, detail="Usuario inválido")
-    
-    # Por ahora, retornar usuario ficticio
-    return Usuario(
-        id=1,
-        username=token_data.username,
-        email="admin@inventarios.com",
-        nombre_completo="Administrador",
-        rol=token_data.rol or Rol.ADMINISTRADOR,
-        activo=True,
-        intentos_fallidos=0
+    modelo = await db.scalar(
+        select(UsuarioModelo).where(UsuarioModelo.username == current_user.username)
     )
-
-# Dependencia: Verificar permiso específico
-def require_permission(permiso: str):
-    """
-    Verifica que el usuario tenga un permiso específico
+    password_valida = False
+    try:
+        if modelo is not None:
+            password_valida, _ = await pool_hashing.verificar(password_actual, modelo.hashed_password)
+        if password_valida:
+            nuevo_hash = await pool_hashing.hash(password_nueva)
+    except PoolHashingSaturado as e:
+        raise hashing_no_disponible(e)
     
-    Ejemplo de uso:
-    @app.delete("/api/productos/{id}")
-    async def eliminar_producto(
-        id: int,
-        current_user: Usuario = Depends(require_permission(Permiso.ELIMINAR_PRODUCTO))
-    ):
-        pass
-    """
-    async def permission_checker(current_user: Usuario = Depends(get_current_user)):
-        if not usuario_tiene_permiso(current_user, permiso):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"No tiene el permiso requerido: {permiso}"
-            )
-        return current_user
+    if not password_valida:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="La contraseña actual es incorrecta"
+        )
     
-    return permission_checker
+    modelo.hashed_password = nuevo_hash
+    modelo.ultimo_cambio_password = datetime.now()
+    await db.commit()
+    cache_usuarios.guardar(usuario_desde_modelo(modelo))
+    cache_tokens.invalidar_usuario(modelo.username)
+    await registro_sesiones.revocar_usuario(db, modelo.id, excepto_sid=verificar_token(token).sid)
+    
+    return {"message": "Contraseña actualizada exitosamente"}
@@ -0,0 +1,250 @@
+"""
+Endpoints de consulta de productos y movimientos (paginación keyset)
+"""
+
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy import select, or_, and_, cast, func, literal, literal_column, String
+from sqlalchemy.dialects.mssql import DATETIME2
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import Optional
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from database import get_async_db
+from models import Producto, Movimiento
+from utils.paginacion import codificar_cursor, decodificar_cursor, es_entero, es_texto, es_fecha_sql
+from services.saldos_movimientos import consulta_saldo_en_fecha, consulta_saldo_previo_a_fecha
+from services.kpis_incrementales import agregador_kpis
+from services.detector_stock import detector_stock
+
+router = APIRouter(prefix="/api", tags=["Inventario"])
+
+
+def _leer_cursor(cursor: Optional[str], claves: dict) -> Optional[dict]:
+    try:
+        return decodificar_cursor(cursor, claves)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _producto_a_dict(producto: Producto) -> dict:
+    return {
+        'id': producto.id,
+        'codigo': producto.codigo,
+        'nombre': producto.nombre,
+        'descripcion': producto.descripcion,
+        'categoria': producto.categoria,
+        'stock_actual': producto.stock_actual,
+        'stock_minimo': producto.stock_minimo,
+        'stock_maximo': producto.stock_maximo,
+        'costo_unitario': float(producto.costo_unitario or 0),
+        'precio_venta': float(producto.precio_venta or 0),
+        'ubicacion_bodega': producto.ubicacion_bodega,
+        'activo': producto.activo,
+        'fecha_actualizacion': producto.fecha_actualizacion
+    }
+
+
+def _movimiento_a_dict(movimiento: Movimiento) -> dict:
+    return {
+        'id': movimiento.id,
+        'producto_id': movimiento.producto_id,
+        'tipo_movimiento': movimiento.tipo_movimiento,
+        'cantidad': movimiento.cantidad,
+        'referencia': movimiento.referencia,
+        'observaciones': movimiento.observaciones,
+        'stock_resultante': movimiento.stock_resultante,
+        'fecha_movimiento': movimiento.fecha_movimiento
+    }
+
+
+@router.get("/productos")
+async def listar_productos(
+    categoria: Optional[str] = None,
+    ubicacion_bodega: Optional[str] = None,
+    incluir_inactivos: bool = False,
+    cursor: Optional[str] = None,
+    limite: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Lista productos ordenados por código con paginación keyset
+
+    Cada página se obtiene con un seek (WHERE codigo > último) sobre el índice
+    de código, o sobre idx_categoria_codigo / idx_ubicacion_codigo cuando se
+    filtra, así que una página profunda cuesta lo mismo que la primera.
+
+    Args:
+        categoria: Filtrar por categoría
+        ubicacion_bodega: Filtrar por ubicación de bodega
+        cursor: Cursor opaco devuelto por la página anterior
+        limite: Productos por página
+
+    Returns:
+        Página de productos y cursor de la siguiente página (None si es la última)
+    """
+    query = select(Producto)
+
+    if categoria:
+        query = query.where(Producto.categoria == categoria)
+    if ubicacion_bodega:
+        query = query.where(Producto.ubicacion_bodega == ubicacion_bodega)
+    if not incluir_inactivos:
+        query = query.where(Producto.activo == True)
+
+    posicion = _leer_cursor(cursor, {'codigo': es_texto})
+    if posicion:
+        query = query.where(Producto.codigo > posicion['codigo'])
+
+    # Se pide una fila extra para saber si hay página siguiente
+    filas = (await db.scalars(query.order_by(Producto.codigo).limit(limite + 1))).all()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+
+    return {
+        'productos': [_producto_a_dict(p) for p in filas],
+        'total_pagina': len(filas),
+        'siguiente_cursor': codificar_cursor({'codigo': filas[-1].codigo}) if hay_mas else None
+    }
+
+
+@router.get("/productos/{codigo}/stock-en-fecha")
+async def obtener_stock_en_fecha(
+    codigo: str,
+    fecha: datetime,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Stock de un producto en un instante dado
+
+    Se resuelve con el saldo guardado en el último movimiento anterior a la
+    fecha (un seek en idx_producto_fecha), sin sumar el historial.
+    """
+    producto = (await db.execute(
+        select(Producto.id, Producto.stock_actual).where(Producto.codigo == codigo)
+    )).first()
+    if producto is None:
+        raise HTTPException(status_code=404, detail=f'Producto no encontrado: {codigo}')
+
+    stock = await db.scalar(consulta_saldo_en_fecha(producto.id, fecha))
+    if stock is None:
+        # Fecha anterior al primer movimiento: stock previo a ese movimiento,
+        # o stock_actual si el producto nunca tuvo movimientos
+        stock = await db.scalar(consulta_saldo_previo_a_fecha(producto.id, fecha))
+        if stock is None:
+            stock = producto.stock_actual
+
+    return {
+        'producto_codigo': codigo,
+        'fecha': fecha,
+        'stock': stock
+    }
+
+
+@router.get("/movimientos")
+async def listar_movimientos(
+    producto_id: Optional[int] = None,
+    fecha_desde: Optional[datetime] = None,
+    fecha_hasta: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limite: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Lista movimientos del más reciente al más antiguo con paginación keyset
+
+    La clave de orden es (fecha_movimiento, id): idx_fecha la cubre (SQL Server
+    agrega la clave del índice clustered, id, a la clave del índice), y con
+    filtro de producto se usa idx_producto_fecha.
+
+    La fecha del cursor viaja como el texto que devuelve SQL Server (100 ns):
+    un datetime de Python la truncaría a µs y el seek saltaría las filas que
+    comparten fecha con la última de la página (un lote de cola_movimientos
+    escribe hasta 200 movimientos con el mismo GETDATE()).
+
+    Args:
+        producto_id: Filtrar por producto
+        fecha_desde: Fecha inicial (inclusive)
+        fecha_hasta: Fecha final (exclusiva)
+        cursor: Cursor opaco devuelto por la página anterior
+        limite: Movimientos por página
+
+    Returns:
+        Página de movimientos y cursor de la siguiente página (None si es la última)
+    """
+    query = select(Movimiento)
+
+    if producto_id is not None:
+        query = query.where(Movimiento.producto_id == producto_id)
+    if fecha_desde:
+        query = query.where(Movimiento.fecha_movimiento >= fecha_desde)
+    if fecha_hasta:
+        query = query.where(Movimiento.fecha_movimiento < fecha_hasta)
+
+    posicion = _leer_cursor(cursor, {'fecha_movimiento': es_fecha_sql, 'id': es_entero})
+    if posicion:
+        fecha_cursor = cast(literal(posicion['fecha_movimiento'], String), DATETIME2(precision=7))
+        # SQL Server no soporta comparación de tuplas: (fecha, id) < (f, i)
+        query = query.where(or_(
+            Movimiento.fecha_movimiento < fecha_cursor,
+            and_(
+                Movimiento.fecha_movimiento == fecha_cursor,
+                Movimiento.id < posicion['id']
+            )
+        ))
+
+    # CONVERT estilo 121: yyyy-mm-dd hh:mi:ss.fffffff
+    query = query.add_columns(
+        func.convert(literal_column('VARCHAR(27)'), Movimiento.fecha_movimiento, 121).label('fecha_cursor')
+    )
+    filas = (await db.execute(
+        query.order_by(Movimiento.fecha_movimiento.desc(), Movimiento.id.desc()).limit(limite + 1)
+    )).all()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+
+    siguiente_cursor = None
+    if hay_mas:
+        siguiente_cursor = codificar_cursor({
+            'fecha_movimiento': filas[-1].fecha_cursor,
+            'id': filas[-1].Movimiento.id
+        })
+
+    return {
+        'movimientos': [_movimiento_a_dict(fila.Movimiento) for fila in filas],
+        'total_pagina': len(filas),
+        'siguiente_cursor': siguiente_cursor
+    }
+
+
+@router.get("/kpis/actuales")
+async def obtener_kpis_actuales():
+    """
+    KPIs al instante desde el agregador incremental (sin consultar la BD)
+
+    La rotación corresponde al periodo abierto desde el último snapshot.
+    """
+    return agregador_kpis.obtener_kpis()
+
+
+@router.get("/stock/eventos")
+async def listar_eventos_stock(
+    desde: int = Query(0, ge=0),
+    limite: int = Query(100, ge=1, le=1000)
+):
+    """
+    Cruces de banda de stock (CRÍTICO / BAJO / NORMAL) detectados por este worker
+
+    Args:
+        desde: Última secuencia ya recibida; se devuelven solo los eventos posteriores
+        limite: Máximo de eventos a devolver
+    """
+    eventos = detector_stock.eventos_desde(desde, limite)
+    return {
+        'eventos': eventos,
+        'ultima_secuencia': eventos[-1]['secuencia'] if eventos else desde,
+        'resumen': detector_stock.resumen()
+    }
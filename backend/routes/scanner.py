@@ -2,8 +2,12 @@
 Endpoints para funcionalidad de scanner móvil
 """
 
-from fastapi import APIRouter, HTTPException, File, UploadFile
+from fastapi import APIRouter, HTTPException, File, UploadFile, Depends
+from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
 from typing import Optional, List
 import sys
 import os
@@ -12,6 +16,15 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from utils.qr_generator import QRGenerator
+from database import get_async_db
+from models import Producto
+from services.indice_productos import indice_productos
+from services.movimientos_service import ProductoNoEncontrado, StockInsuficiente, calcular_delta
+from services.cola_movimientos import ColaNoDisponible, cola_movimientos
+from security.auth import Usuario, cache_usuarios
+from security.cola_auditoria import cola_auditoria
+from routes.auth import get_current_user, cargar_usuario
+from services.saldos_movimientos import consulta_ultimos_con_saldo
 
 router = APIRouter(prefix="/api/scanner", tags=["Scanner Móvil"])
 
@@ -32,69 +45,94 @@ class MovimientoRapido(BaseModel):
     usuario_movil: str
 
 
-@router.post("/escanear")
-async def procesar_escaneo(codigo: str):
+class EscaneoLote(BaseModel):
+    """Lote de códigos escaneados (conteo de estantería completa)"""
+    codigos: List[str]
+
+
+ACCIONES_PRODUCTO = [
+    {'id': 'agregar', 'label': '➕ Agregar Stock', 'color': 'green'},
+    {'id': 'remover', 'label': '➖ Remover Stock', 'color': 'red'},
+    {'id': 'ver_historial', 'label': '📊 Ver Historial', 'color': 'blue'},
+    {'id': 'editar', 'label': '✏️ Editar Producto', 'color': 'orange'}
+]
+
+ACCIONES_UBICACION = [
+    {'id': 'ver_productos', 'label': '📦 Ver Productos', 'color': 'blue'},
+    {'id': 'mover_productos', 'label': '🔄 Mover Productos', 'color': 'orange'},
+    {'id': 'inventario_fisico', 'label': '✅ Inventario Físico', 'color': 'green'}
+]
+
+MAX_CODIGOS_POR_LOTE = 1000
+
+# La app móvil todavía no envía token: si lo trae se audita con ese usuario
+oauth2_opcional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+# auditoria_movimientos.accion no admite AJUSTE
+ACCION_AUDITORIA = {'ENTRADA': 'ENTRADA', 'SALIDA': 'SALIDA', 'AJUSTE': 'MODIFICACION'}
+
+
+def _verificar_indice_cargado():
+    if not indice_productos.cargado:
+        raise HTTPException(
+            status_code=503,
+            detail='Índice de productos no disponible, intente nuevamente'
+        )
+
+
+def _resolver_codigo(codigo: str) -> Optional[dict]:
     """
-    Procesa el código escaneado y retorna información del producto o ubicación
-    
-    Args:
-        codigo: Código de barras o QR escaneado
-    
-    Returns:
-        Información del producto o ubicación
+    Clasifica un código (producto o ubicación) y lo resuelve contra el índice
+    en memoria, sin ir a SQL Server. Retorna None si no se reconoce.
     """
+    producto = indice_productos.buscar(codigo)
     
-    # Detectar tipo de código
-    if codigo.startswith("PROD"):
+    if producto is not None:
         # Es un código de producto
-        # TODO: Buscar en base de datos real
-        producto = {
-            'codigo': codigo,
-            'nombre': 'Producto Ejemplo',
-            'stock_actual': 150,
-            'stock_minimo': 50,
-            'ubicacion_bodega': 'A-01',
-            'categoria': 'Ferretería',
-            'precio_venta': 15.00,
-            'foto_url': None
-        }
-        
         return {
+            'codigo': codigo,
             'tipo': 'producto',
             'encontrado': True,
-            'data': producto,
-            'acciones_disponibles': [
-                {'id': 'agregar', 'label': '➕ Agregar Stock', 'color': 'green'},
-                {'id': 'remover', 'label': '➖ Remover Stock', 'color': 'red'},
-                {'id': 'ver_historial', 'label': '📊 Ver Historial', 'color': 'blue'},
-                {'id': 'editar', 'label': '✏️ Editar Producto', 'color': 'orange'}
-            ]
+            'data': producto
         }
     
-    elif codigo.count('-') == 1:
+    if codigo.count('-') == 1:
         # Parece una ubicación (ej: A-01)
-        # TODO: Buscar productos en esa ubicación
         productos_en_ubicacion = [
-            {'codigo': 'PROD001', 'nombre': 'Tornillo M8x20', 'stock': 150},
-            {'codigo': 'PROD002', 'nombre': 'Tuerca M8', 'stock': 200}
+            {'codigo': p['codigo'], 'nombre': p['nombre'], 'stock': p['stock_actual']}
+            for p in indice_productos.productos_en_ubicacion(codigo)
         ]
         
         return {
+            'codigo': codigo,
             'tipo': 'ubicacion',
             'encontrado': True,
             'data': {
                 'ubicacion': codigo,
                 'productos': productos_en_ubicacion,
                 'total_productos': len(productos_en_ubicacion)
-            },
-            'acciones_disponibles': [
-                {'id': 'ver_productos', 'label': '📦 Ver Productos', 'color': 'blue'},
-                {'id': 'mover_productos', 'label': '🔄 Mover Productos', 'color': 'orange'},
-                {'id': 'inventario_fisico', 'label': '✅ Inventario Físico', 'color': 'green'}
-            ]
+            }
         }
     
-    else:
+    return None
+
+
+@router.post("/escanear")
+async def procesar_escaneo(codigo: str):
+    """
+    Procesa el código escaneado y retorna información del producto o ubicación
+    
+    Args:
+        codigo: Código de barras o QR escaneado
+    
+    Returns:
+        Información del producto o ubicación
+    """
+    _verificar_indice_cargado()
+    
+    resultado = _resolver_codigo(codigo)
+    
+    if resultado is None:
         # Código no reconocido
         raise HTTPException(
             status_code=404,
@@ -104,37 +142,198 @@ async def procesar_escaneo(codigo: str):
                 'sugerencia': 'Verifica que el código sea correcto o regístralo como nuevo producto'
             }
         )
+    
+    if resultado['tipo'] == 'producto':
+        resultado['acciones_disponibles'] = ACCIONES_PRODUCTO
+    else:
+        resultado['acciones_disponibles'] = ACCIONES_UBICACION
+    
+    return resultado
+
+
+@router.post("/escanear/lote")
+async def procesar_escaneo_lote(lote: EscaneoLote):
+    """
+    Procesa un lote de códigos escaneados en una sola petición
+    
+    Pensado para sincronizar conteos de estantería completa desde la app móvil:
+    todos los códigos se clasifican y resuelven contra el índice en memoria en
+    una sola pasada.
+    
+    Args:
+        lote: Lista de códigos escaneados
+    
+    Returns:
+        Resultados en el mismo orden de entrada, con entradas de no encontrado
+    """
+    _verificar_indice_cargado()
+    
+    if len(lote.codigos) > MAX_CODIGOS_POR_LOTE:
+        raise HTTPException(
+            status_code=413,
+            detail=f'Máximo {MAX_CODIGOS_POR_LOTE} códigos por lote'
+        )
+    
+    resultados = []
+    resueltos = {}
+    no_encontrados = 0
+    
+    for codigo in lote.codigos:
+        # Códigos repetidos en el lote se resuelven una sola vez
+        if codigo not in resueltos:
+            resueltos[codigo] = _resolver_codigo(codigo)
+        
+        resultado = resueltos[codigo]
+        if resultado is None:
+            no_encontrados += 1
+            resultado = {
+                'codigo': codigo,
+                'tipo': 'desconocido',
+                'encontrado': False,
+                'data': None
+            }
+        resultados.append(resultado)
+    
+    return {
+        'total': len(resultados),
+        'encontrados': len(resultados) - no_encontrados,
+        'no_encontrados': no_encontrados,
+        'resultados': resultados
+    }
+
+
+# usuario_movil lo manda el cliente sin autenticar: no identifica a nadie. Los
+# movimientos sin token se auditan a nombre de este usuario del sistema
+# (inactivo, no puede iniciar sesión; ver schema_seguridad.sql) y usuario_movil
+# queda solo en el campo dispositivo
+USUARIO_NO_VERIFICADO = 'dispositivo_no_verificado'
+
+
+async def _usuario_auditoria(token: Optional[str]) -> Optional[Usuario]:
+    """Usuario del token verificado; sin token, el usuario de dispositivos no verificados"""
+    if token:
+        return await get_current_user(token)
+    try:
+        return await cache_usuarios.obtener(
+            USUARIO_NO_VERIFICADO, lambda: cargar_usuario(USUARIO_NO_VERIFICADO)
+        )
+    except Exception as e:
+        # Se resuelve por nombre al reintentar el registro pendiente
+        print(f"Error cargando usuario {USUARIO_NO_VERIFICADO}: {e}")
+        return None
+
+
+async def _auditar_movimiento(
+    usuario: Optional[Usuario],
+    movimiento: MovimientoRapido,
+    resultado: dict
+) -> Optional[int]:
+    """
+    Registra el movimiento en auditoria_movimientos por cola_auditoria y
+    espera a que su lote quede confirmado. Retorna el id del registro, o None
+    si no se pudo escribir: en ese caso queda guardado en los pendientes de
+    cola_auditoria para reintentarlo (el movimiento ya está confirmado y no se
+    revierte).
+    """
+    registro = dict(
+        usuario_id=usuario.id if usuario is not None else None,
+        usuario_nombre=usuario.username if usuario is not None else USUARIO_NO_VERIFICADO,
+        accion=ACCION_AUDITORIA[movimiento.tipo_movimiento],
+        tipo_entidad='PRODUCTO',
+        entidad_id=movimiento.codigo_producto,
+        datos_nuevos={
+            'movimiento_id': resultado['movimiento_id'],
+            'referencia': movimiento.referencia
+        },
+        dispositivo=f'Móvil: {movimiento.usuario_movil}',
+        stock_antes=resultado['nuevo_stock'] - calcular_delta(movimiento.tipo_movimiento, movimiento.cantidad),
+        stock_despues=resultado['nuevo_stock'],
+        cantidad_movida=movimiento.cantidad
+    )
+    if usuario is not None:
+        try:
+            return (await cola_auditoria.registrar(**registro)).id
+        except Exception as e:
+            print(f"Error auditando movimiento {resultado['movimiento_id']}: {e}")
+
+    try:
+        await cola_auditoria.guardar_pendiente(**registro)
+    except Exception as e:
+        print(f"❌ Movimiento {resultado['movimiento_id']} sin auditar ni guardar como pendiente: {e}")
+    return None
 
 
 @router.post("/movimiento-rapido")
-async def crear_movimiento_rapido(movimiento: MovimientoRapido):
+async def crear_movimiento_rapido(
+    movimiento: MovimientoRapido,
+    token: Optional[str] = Depends(oauth2_opcional)
+):
     """
     Crea un movimiento de inventario desde la app móvil
     
+    La respuesta sale recién con el registro de auditoría confirmado. El
+    usuario auditado es el del token o, sin token, el usuario del sistema
+    'dispositivo_no_verificado' (usuario_movil va en dispositivo). Si la
+    auditoría falla el movimiento igual queda aplicado y la respuesta trae
+    auditado False: el registro se reintenta desde los pendientes de
+    cola_auditoria.
+    
     Args:
         movimiento: Datos del movimiento
     
     Returns:
         Confirmación del movimiento
     """
+    # Antes de mover stock: un token inválido se rechaza sin registrar nada
+    usuario = await _usuario_auditoria(token)
+    
+    try:
+        # Group commit: se agrupa con los movimientos de otros scanners
+        resultado = await cola_movimientos.registrar(
+            codigo_producto=movimiento.codigo_producto,
+            tipo_movimiento=movimiento.tipo_movimiento,
+            cantidad=movimiento.cantidad,
+            referencia=movimiento.referencia,
+            observaciones=f'Móvil: {movimiento.usuario_movil}'
+        )
+    except ColaNoDisponible as e:
+        # Worker arrancando o apagándose: el scanner reintenta (el movimiento no se aplicó)
+        raise HTTPException(
+            status_code=503,
+            detail=f'Servidor no disponible para registrar movimientos, reintente en unos segundos ({e})',
+            headers={'Retry-After': '2'}
+        )
+    except ProductoNoEncontrado as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except StockInsuficiente as e:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                'mensaje': str(e),
+                'stock_actual': e.stock_actual,
+                'solicitado': e.solicitado
+            }
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # TODO: Validar que el producto existe
-    # TODO: Insertar en base de datos
-    # TODO: Actualizar stock
+    auditoria_id = await _auditar_movimiento(usuario, movimiento, resultado)
     
     return {
         'exito': True,
         'mensaje': f'✅ Movimiento registrado: {movimiento.tipo_movimiento} de {movimiento.cantidad} unidades',
-        'movimiento_id': 12345,
+        'movimiento_id': resultado['movimiento_id'],
         'producto_codigo': movimiento.codigo_producto,
-        'nuevo_stock': 175,  # TODO: Calcular stock real
-        'fecha': '2025-12-08T15:30:00',
-        'usuario': movimiento.usuario_movil
+        'nuevo_stock': resultado['nuevo_stock'],
+        'fecha': resultado['fecha'],
+        'usuario': movimiento.usuario_movil,
+        'auditoria_id': auditoria_id,
+        'auditado': auditoria_id is not None
     }
 
 
 @router.get("/generar-qrs/productos")
-async def generar_qrs_productos():
+async def generar_qrs_productos(db: AsyncSession = Depends(get_async_db)):
     """
     Genera códigos QR para todos los productos
     
@@ -142,14 +341,12 @@ async def generar_qrs_productos():
         Lista de QRs generados
     """
     
-    # TODO: Obtener productos de la base de datos
-    productos = [
-        {'codigo': 'PROD001', 'nombre': 'Tornillo M8x20'},
-        {'codigo': 'PROD002', 'nombre': 'Tuerca M8'},
-        {'codigo': 'PROD003', 'nombre': 'Arandela M8'},
-        {'codigo': 'PROD004', 'nombre': 'Cable 2x14 AWG'},
-        {'codigo': 'PROD005', 'nombre': 'Interruptor Simple'}
-    ]
+    filas = await db.execute(
+        select(Producto.codigo, Producto.nombre)
+        .where(Producto.activo == True)
+        .order_by(Producto.codigo)
+    )
+    productos = [{'codigo': f.codigo, 'nombre': f.nombre} for f in filas]
     
     generator = QRGenerator()
     resultado = generator.generar_qrs_masivos_productos(productos)
@@ -209,7 +406,10 @@ async def generar_qrs_ubicaciones():
 
 
 @router.post("/inventario-fisico")
-async def iniciar_inventario_fisico(ubicacion: Optional[str] = None):
+async def iniciar_inventario_fisico(
+    ubicacion: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
     """
     Inicia proceso de inventario físico (conteo manual)
     
@@ -220,27 +420,29 @@ async def iniciar_inventario_fisico(ubicacion: Optional[str] = None):
         Lista de productos a contar
     """
     
-    # TODO: Obtener productos de la ubicación
+    query = select(
+        Producto.codigo, Producto.nombre, Producto.stock_actual, Producto.ubicacion_bodega
+    ).where(Producto.activo == True)
+    if ubicacion:
+        query = query.where(Producto.ubicacion_bodega == ubicacion)
+    
+    filas = await db.execute(query.order_by(Producto.ubicacion_bodega, Producto.codigo))
     productos_a_contar = [
         {
-            'codigo': 'PROD001',
-            'nombre': 'Tornillo M8x20',
-            'stock_sistema': 150,
+            'codigo': f.codigo,
+            'nombre': f.nombre,
+            'stock_sistema': f.stock_actual,
             'stock_fisico': None,  # Se llenará con el conteo
-            'ubicacion': 'A-01'
-        },
-        {
-            'codigo': 'PROD002',
-            'nombre': 'Tuerca M8',
-            'stock_sistema': 200,
-            'stock_fisico': None,
-            'ubicacion': 'A-02'
+            'ubicacion': f.ubicacion_bodega
         }
+        for f in filas
     ]
     
+    inicio = datetime.now()
+    
     return {
-        'sesion_id': 'INV-2025-001',
-        'fecha_inicio': '2025-12-08T15:30:00',
+        'sesion_id': f"INV-{inicio.strftime('%Y%m%d-%H%M%S')}",
+        'fecha_inicio': inicio.isoformat(timespec='seconds'),
         'ubicacion': ubicacion or 'TODAS',
         'productos': productos_a_contar,
         'total_productos': len(productos_a_contar),
@@ -254,7 +456,12 @@ async def iniciar_inventario_fisico(ubicacion: Optional[str] = None):
 
 
 @router.post("/inventario-fisico/registrar-conteo")
-async def registrar_conteo(codigo: str, cantidad_fisica: int, sesion_id: str):
+async def registrar_conteo(
+    codigo: str,
+    cantidad_fisica: int,
+    sesion_id: str,
+    db: AsyncSession = Depends(get_async_db)
+):
     """
     Registra el conteo físico de un producto
     
@@ -267,8 +474,12 @@ async def registrar_conteo(codigo: str, cantidad_fisica: int, sesion_id: str):
         Diferencia calculada
     """
     
-    # TODO: Obtener stock del sistema
-    stock_sistema = 150
+    stock_sistema = await db.scalar(
+        select(Producto.stock_actual).where(Producto.codigo == codigo, Producto.activo == True)
+    )
+    if stock_sistema is None:
+        raise HTTPException(status_code=404, detail=f'Producto no encontrado: {codigo}')
+    
     diferencia = cantidad_fisica - stock_sistema
     
     # TODO: Guardar en base de datos
@@ -285,7 +496,11 @@ async def registrar_conteo(codigo: str, cantidad_fisica: int, sesion_id: str):
 
 
 @router.get("/historial-movimientos/{codigo_producto}")
-async def obtener_historial_movimientos(codigo_producto: str, limite: int = 10):
+async def obtener_historial_movimientos(
+    codigo_producto: str,
+    limite: int = 10,
+    db: AsyncSession = Depends(get_async_db)
+):
     """
     Obtiene historial de movimientos de un producto para mostrar en móvil
     
@@ -297,30 +512,30 @@ async def obtener_historial_movimientos(codigo_producto: str, limite: int = 10):
         Historial de movimientos
     """
     
-    # TODO: Obtener de base de datos
+    producto = (await db.execute(
+        select(Producto.id, Producto.stock_actual).where(Producto.codigo == codigo_producto)
+    )).first()
+    if producto is None:
+        raise HTTPException(status_code=404, detail=f'Producto no encontrado: {codigo_producto}')
+    
+    # Seek sobre idx_producto_fecha; el saldo viene guardado en cada movimiento
+    filas = await db.execute(consulta_ultimos_con_saldo(producto.id, limite))
     movimientos = [
         {
-            'id': 1,
-            'tipo': 'ENTRADA',
-            'cantidad': 100,
-            'fecha': '2025-12-01T09:00:00',
-            'usuario': 'Juan Pérez',
-            'referencia': 'PO-2025-001'
-        },
-        {
-            'id': 2,
-            'tipo': 'SALIDA',
-            'cantidad': 50,
-            'fecha': '2025-12-03T14:30:00',
-            'usuario': 'María García',
-            'referencia': 'SO-2025-001'
+            'id': m.id,
+            'tipo': m.tipo_movimiento,
+            'cantidad': m.cantidad,
+            'stock_resultante': m.stock_resultante,
+            'fecha': m.fecha_movimiento,
+            'referencia': m.referencia
         }
+        for m in filas.scalars()
     ]
     
     return {
         'producto_codigo': codigo_producto,
         'total_movimientos': len(movimientos),
         'movimientos': movimientos,
-        'stock_actual': 150,
+        'stock_actual': producto.stock_actual,
         'ultimo_movimiento': movimientos[0] if movimientos else None
     }
@@ -0,0 +1,211 @@
+"""
+Almacenes de intentos de login fallidos para LoginAttemptTracker
+
+Los intentos se cuentan en una ventana deslizante de ranuras fijas (p. ej.
+1 hora = 12 ranuras de 5 minutos): registrar y contar cuesta lo mismo sin
+importar cuántos intentos haya, y cada usuario ocupa memoria constante.
+
+- AlmacenMemoria: por proceso (un solo worker o pruebas)
+- AlmacenSQLite: archivo SQLite compartido por todos los workers del mismo
+  host (o volumen compartido), así el límite de intentos es global y no
+  "max_intentos x workers"
+"""
+import abc
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class AlmacenIntentos(abc.ABC):
+    """Interfaz: contadores por ventana deslizante y bloqueos con vencimiento"""
+
+    def __init__(self, ventana_segundos: int = 3600, ranuras: int = 12, intervalo_purga: float = 300):
+        self.ventana_segundos = ventana_segundos
+        self.ranuras = ranuras
+        self.segundos_por_ranura = ventana_segundos / ranuras
+        self.intervalo_purga = intervalo_purga
+        self._ultima_purga = time.time()
+
+    def _ranura(self, ahora: float) -> int:
+        return int(ahora // self.segundos_por_ranura)
+
+    def _purgar_si_corresponde(self, ahora: float):
+        if ahora - self._ultima_purga >= self.intervalo_purga:
+            self._ultima_purga = ahora
+            self.purgar(ahora)
+
+    @abc.abstractmethod
+    def registrar_fallo(self, username: str, ahora: float) -> int:
+        """Suma un intento y retorna los intentos dentro de la ventana"""
+
+    @abc.abstractmethod
+    def limpiar(self, username: str):
+        """Borra intentos y bloqueo del usuario"""
+
+    @abc.abstractmethod
+    def bloquear(self, username: str, hasta: float):
+        """Bloquea al usuario hasta el instante `hasta` (epoch)"""
+
+    @abc.abstractmethod
+    def bloqueado_hasta(self, username: str) -> Optional[float]:
+        """Fin del bloqueo del usuario o None"""
+
+    @abc.abstractmethod
+    def purgar(self, ahora: float) -> int:
+        """Elimina usuarios sin intentos en la ventana y bloqueos vencidos"""
+
+
+class AlmacenMemoria(AlmacenIntentos):
+    """
+    Nunca descarta usuarios bloqueados ni con intentos dentro de la ventana:
+    si pudiera, un atacante que falla con muchos usernames distintos borraría
+    el contador de su víctima. Al superar `max_usuarios` solo se purgan los
+    vencidos; lo demás se conserva (y se avisa) hasta que salga de la ventana.
+    """
+
+    def __init__(self, max_usuarios: int = 100000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_usuarios = max_usuarios
+        self._aviso_capacidad = False
+        # username -> [última ranura tocada, conteos del anillo]
+        self._intentos: "OrderedDict[str, list]" = OrderedDict()
+        self._bloqueos: dict = {}
+        self._lock = threading.Lock()
+
+    def _avanzar(self, entrada: list, ranura: int):
+        """Pone en cero las ranuras que quedaron fuera de la ventana"""
+        ultima, conteos = entrada
+        if ranura - ultima >= self.ranuras:
+            for i in range(self.ranuras):
+                conteos[i] = 0
+        else:
+            for r in range(ultima + 1, ranura + 1):
+                conteos[r % self.ranuras] = 0
+        entrada[0] = max(ultima, ranura)
+
+    def registrar_fallo(self, username: str, ahora: float) -> int:
+        ranura = self._ranura(ahora)
+        with self._lock:
+            entrada = self._intentos.get(username)
+            if entrada is None:
+                entrada = [ranura, [0] * self.ranuras]
+                self._intentos[username] = entrada
+            else:
+                self._avanzar(entrada, ranura)
+                self._intentos.move_to_end(username)
+            entrada[1][ranura % self.ranuras] += 1
+            total = sum(entrada[1])
+            excedido = len(self._intentos) > self.max_usuarios
+
+        if excedido and ahora - self._ultima_purga >= self.segundos_por_ranura:
+            # Solo se liberan usuarios fuera de la ventana (nunca uno con intentos
+            # recientes); como mucho una purga por ranura, que es cuando alguno vence
+            self._ultima_purga = ahora
+            self.purgar(ahora)
+            if len(self._intentos) > self.max_usuarios and not self._aviso_capacidad:
+                self._aviso_capacidad = True
+                print(f"⚠️ Más de {self.max_usuarios} usuarios con intentos fallidos recientes en memoria; "
+                      f"considerar LOGIN_TRACKER_BACKEND=sqlite")
+        else:
+            self._purgar_si_corresponde(ahora)
+        return total
+
+    def limpiar(self, username: str):
+        with self._lock:
+            self._intentos.pop(username, None)
+            self._bloqueos.pop(username, None)
+
+    def bloquear(self, username: str, hasta: float):
+        with self._lock:
+            self._bloqueos[username] = hasta
+
+    def bloqueado_hasta(self, username: str) -> Optional[float]:
+        return self._bloqueos.get(username)
+
+    def purgar(self, ahora: float) -> int:
+        limite = self._ranura(ahora) - self.ranuras
+        with self._lock:
+            vencidos = [u for u, entrada in self._intentos.items() if entrada[0] <= limite]
+            for username in vencidos:
+                del self._intentos[username]
+            desbloqueados = [u for u, hasta in self._bloqueos.items() if hasta <= ahora]
+            for username in desbloqueados:
+                del self._bloqueos[username]
+        return len(vencidos) + len(desbloqueados)
+
+
+class AlmacenSQLite(AlmacenIntentos):
+    def __init__(self, ruta: str, **kwargs):
+        super().__init__(**kwargs)
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        # isolation_level=None: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+        self._conexion = sqlite3.connect(ruta, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.executescript("""
+            CREATE TABLE IF NOT EXISTS intentos_login (
+                username TEXT NOT NULL,
+                ranura INTEGER NOT NULL,
+                conteo INTEGER NOT NULL,
+                PRIMARY KEY (username, ranura)
+            );
+            CREATE INDEX IF NOT EXISTS idx_intentos_ranura ON intentos_login (ranura);
+            CREATE TABLE IF NOT EXISTS bloqueos_login (
+                username TEXT PRIMARY KEY,
+                hasta REAL NOT NULL
+            );
+        """)
+
+    def registrar_fallo(self, username: str, ahora: float) -> int:
+        ranura = self._ranura(ahora)
+        with self._lock:
+            cursor = self._conexion.cursor()
+            # BEGIN IMMEDIATE toma el lock de escritura: incremento y conteo son atómicos entre procesos
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("""
+                    INSERT INTO intentos_login (username, ranura, conteo) VALUES (?, ?, 1)
+                    ON CONFLICT (username, ranura) DO UPDATE SET conteo = conteo + 1
+                """, (username, ranura))
+                total = cursor.execute(
+                    "SELECT SUM(conteo) FROM intentos_login WHERE username = ? AND ranura > ?",
+                    (username, ranura - self.ranuras)
+                ).fetchone()[0]
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+        self._purgar_si_corresponde(ahora)
+        return total
+
+    def limpiar(self, username: str):
+        with self._lock:
+            self._conexion.execute("DELETE FROM intentos_login WHERE username = ?", (username,))
+            self._conexion.execute("DELETE FROM bloqueos_login WHERE username = ?", (username,))
+
+    def bloquear(self, username: str, hasta: float):
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO bloqueos_login (username, hasta) VALUES (?, ?)", (username, hasta)
+            )
+
+    def bloqueado_hasta(self, username: str) -> Optional[float]:
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT hasta FROM bloqueos_login WHERE username = ?", (username,)
+            ).fetchone()
+        return fila[0] if fila else None
+
+    def purgar(self, ahora: float) -> int:
+        with self._lock:
+            borrados = self._conexion.execute(
+                "DELETE FROM intentos_login WHERE ranura <= ?", (self._ranura(ahora) - self.ranuras,)
+            ).rowcount
+            borrados += self._conexion.execute(
+                "DELETE FROM bloqueos_login WHERE hasta <= ?", (ahora,)
+            ).rowcount
+        return borrados
@@ -0,0 +1,372 @@
+"""
+Archivo mensual de la auditoría: tabla caliente + archivos fríos
+
+auditoria_movimientos conserva solo los últimos `meses_calientes` meses, así
+sus índices caben en memoria. Los meses anteriores se exportan, uno por
+archivo, a JSONL comprimido con gzip (una fila por línea, todas las columnas)
+y se borran de la tabla en lotes.
+
+Cada mes archivado queda registrado en auditoria_archivos con su rango de
+ids, su hash de entrada y su cabeza de cadena, y además en un .meta.json junto
+al archivo. La cadena de la tabla caliente continúa desde la última cabeza
+archivada (ver cabeza_archivada en security/auditoria.py). Antes de exportar
+un mes se verifica su cadena: un mes con registros alterados no se archiva.
+
+AUDITORIA_DIRECTORIO_ARCHIVO es obligatoria y debe ser una ruta absoluta en
+almacenamiento persistente (en Railway, un volumen montado): el disco del
+contenedor se pierde en cada deploy y las filas archivadas ya no están en la
+BD. Archivo y directorio se sincronizan a disco (fsync) antes de borrar.
+
+Las consultas de historial de ServicioAuditoria buscan en
+auditoria_indice_archivo (una fila por registro archivado) y abren solo los
+archivos que contienen lo pedido. Un archivo que no está en este host se
+informa y se omite.
+
+Uso mensual (desde backend/):
+    python -m security.archivo_auditoria
+    python -m security.archivo_auditoria --verificar
+    python -m security.archivo_auditoria --indexar   # meses archivados antes del índice
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from sqlalchemy import delete, exists, insert, literal, select
+
+from security.auditoria import (
+    AuditoriaArchivo, AuditoriaIndiceArchivo, AuditoriaMovimiento, FILAS_POR_LECTURA,
+    TramoCadena, cabeza_archivada
+)
+
+COLUMNAS_ARCHIVO = [columna.name for columna in AuditoriaMovimiento.__table__.columns]
+COLUMNAS_FECHA = {"fecha_hora"}
+COLUMNAS_INDICE = ["registro_id", "archivo_id", "fecha_hora", "usuario_id", "tipo_entidad", "entidad_id"]
+FILAS_POR_BORRADO = 5000
+FILAS_POR_INDEXADO = 5000
+
+
+def inicio_de_mes(fecha: datetime) -> datetime:
+    return datetime(fecha.year, fecha.month, 1)
+
+
+def mes_siguiente(fecha: datetime) -> datetime:
+    return datetime(fecha.year + fecha.month // 12, fecha.month % 12 + 1, 1)
+
+
+def meses_atras(fecha: datetime, meses: int) -> datetime:
+    indice = fecha.year * 12 + fecha.month - 1 - meses
+    return datetime(indice // 12, indice % 12 + 1, 1)
+
+
+def _sincronizar(ruta: str):
+    """fsync de un archivo o directorio: lo escrito sobrevive a un corte de energía"""
+    fd = os.open(ruta, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _sha256_archivo(ruta: str) -> str:
+    digest = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+class ArchivoAuditoria:
+    def __init__(self, directorio: Optional[str] = None, meses_calientes: Optional[int] = None):
+        self.directorio = directorio or os.getenv("AUDITORIA_DIRECTORIO_ARCHIVO")
+        self.meses_calientes = (
+            meses_calientes if meses_calientes is not None
+            else int(os.getenv("AUDITORIA_MESES_CALIENTES", "3"))
+        )
+
+    # ---------------------------------------------
+    # Exportación
+    # ---------------------------------------------
+    def archivar_pendientes(self, db, hoy: Optional[datetime] = None) -> List[AuditoriaArchivo]:
+        """Exporta y borra de la tabla caliente cada mes anterior a la ventana caliente"""
+        self._verificar_directorio()
+        limite = meses_atras(hoy or datetime.now(), self.meses_calientes - 1)
+        archivados = []
+
+        while True:
+            archivado_hasta, hash_cabeza = cabeza_archivada(db)
+            # Termina los borrados de una corrida anterior interrumpida
+            self._borrar_archivados(db, archivado_hasta)
+
+            primera = db.execute(
+                select(AuditoriaMovimiento.fecha_hora)
+                .where(AuditoriaMovimiento.id > archivado_hasta)
+                .order_by(AuditoriaMovimiento.id)
+                .limit(1)
+            ).scalar()
+            if primera is None or mes_siguiente(primera) > limite:
+                return archivados
+
+            archivo = self._archivar_mes(db, archivado_hasta, hash_cabeza, inicio_de_mes(primera))
+            self._borrar_archivados(db, archivo.hasta_id)
+            archivados.append(archivo)
+
+    def _verificar_directorio(self):
+        """Sin directorio persistente no se archiva: las filas se borran de la BD después"""
+        if not self.directorio:
+            raise ValueError("AUDITORIA_DIRECTORIO_ARCHIVO no está configurada")
+        if not os.path.isabs(self.directorio):
+            raise ValueError(
+                f"AUDITORIA_DIRECTORIO_ARCHIVO debe ser una ruta absoluta en almacenamiento "
+                f"persistente: {self.directorio}"
+            )
+
+    def _archivar_mes(self, db, archivado_hasta: int, hash_cabeza: str, mes: datetime) -> AuditoriaArchivo:
+        """
+        Exporta los registros consecutivos (por id) desde archivado_hasta cuya
+        fecha cae antes del mes siguiente, verificando la cadena mientras escribe
+        """
+        fin = mes_siguiente(mes)
+        nombre = f"auditoria_{mes:%Y_%m}"
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta = os.path.join(self.directorio, f"{nombre}.jsonl.gz")
+        ruta_parcial = ruta + ".parcial"
+
+        tramo = TramoCadena(hash_cabeza)
+        alterados = []
+        fecha_desde = fecha_hasta = None
+
+        filas = db.execute(
+            select(AuditoriaMovimiento.__table__)
+            .where(AuditoriaMovimiento.id > archivado_hasta)
+            .order_by(AuditoriaMovimiento.id)
+            .execution_options(yield_per=FILAS_POR_LECTURA)
+        )
+        try:
+            with gzip.open(ruta_parcial, "wt", encoding="utf-8") as salida:
+                for fila in filas:
+                    if fila.fecha_hora >= fin:
+                        break
+                    alterado = tramo.verificar(fila)
+                    if alterado:
+                        alterados.append(alterado["id"])
+                    fecha_desde = fecha_desde or fila.fecha_hora
+                    fecha_hasta = fila.fecha_hora
+                    salida.write(json.dumps({
+                        columna: (valor.isoformat() if columna in COLUMNAS_FECHA and valor else valor)
+                        for columna, valor in zip(COLUMNAS_ARCHIVO, fila)
+                    }, ensure_ascii=False) + "\n")
+        finally:
+            filas.close()
+
+        if alterados:
+            os.remove(ruta_parcial)
+            raise ValueError(f"No se archiva {mes:%Y-%m}: registros alterados {alterados[:20]}")
+
+        # Archivo y renombre en disco antes de que la BD lo dé por archivado
+        _sincronizar(ruta_parcial)
+        os.replace(ruta_parcial, ruta)
+        _sincronizar(self.directorio)
+
+        archivo = AuditoriaArchivo(
+            mes=f"{mes:%Y-%m}",
+            desde_id=tramo.primer_id,
+            hasta_id=tramo.ultimo_id,
+            registros=tramo.filas,
+            fecha_desde=fecha_desde,
+            fecha_hasta=fecha_hasta,
+            hash_entrada=tramo.hash_entrada,
+            hash_cabeza=tramo.hash_salida,
+            ruta=ruta,
+            sha256_archivo=_sha256_archivo(ruta)
+        )
+        db.add(archivo)
+        db.flush()
+        # Índice de consultas desde las filas que siguen en la tabla caliente (en el servidor)
+        db.execute(insert(AuditoriaIndiceArchivo).from_select(
+            COLUMNAS_INDICE,
+            select(
+                AuditoriaMovimiento.id, literal(archivo.id), AuditoriaMovimiento.fecha_hora,
+                AuditoriaMovimiento.usuario_id, AuditoriaMovimiento.tipo_entidad,
+                AuditoriaMovimiento.entidad_id
+            ).where(AuditoriaMovimiento.id.between(archivo.desde_id, archivo.hasta_id))
+        ))
+
+        # Copia de los metadatos junto al archivo: sigue siendo verificable sin la BD
+        ruta_meta = os.path.join(self.directorio, f"{nombre}.meta.json")
+        with open(ruta_meta, "w", encoding="utf-8") as meta:
+            json.dump({
+                columna.name: (
+                    getattr(archivo, columna.name).isoformat()
+                    if isinstance(getattr(archivo, columna.name), datetime)
+                    else getattr(archivo, columna.name)
+                )
+                for columna in AuditoriaArchivo.__table__.columns
+            }, meta, ensure_ascii=False, indent=2)
+        _sincronizar(ruta_meta)
+        _sincronizar(self.directorio)
+
+        db.commit()
+        print(f"📦 Auditoría {archivo.mes}: {archivo.registros} registros -> {ruta}")
+        return archivo
+
+    def _borrar_archivados(self, db, hasta_id: int):
+        """Borra de la tabla caliente los ids ya archivados, en lotes cortos"""
+        while hasta_id:
+            borradas = db.execute(
+                delete(AuditoriaMovimiento).where(
+                    AuditoriaMovimiento.id.in_(
+                        select(AuditoriaMovimiento.id)
+                        .where(AuditoriaMovimiento.id <= hasta_id)
+                        .order_by(AuditoriaMovimiento.id)
+                        .limit(FILAS_POR_BORRADO)
+                    )
+                ).execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+            if borradas < FILAS_POR_BORRADO:
+                return
+
+    # ---------------------------------------------
+    # Lectura (capa de consulta)
+    # ---------------------------------------------
+    def archivos_en_rango(
+        self,
+        db,
+        fecha_inicio: Optional[datetime] = None,
+        fecha_fin: Optional[datetime] = None
+    ) -> List[AuditoriaArchivo]:
+        """Meses archivados que se solapan con el rango, del más reciente al más antiguo"""
+        consulta = select(AuditoriaArchivo).order_by(AuditoriaArchivo.hasta_id.desc())
+        if fecha_inicio:
+            consulta = consulta.where(AuditoriaArchivo.fecha_hasta >= fecha_inicio)
+        if fecha_fin:
+            consulta = consulta.where(AuditoriaArchivo.fecha_desde <= fecha_fin)
+        return list(db.scalars(consulta))
+
+    def leer(
+        self,
+        archivo: AuditoriaArchivo,
+        filtro: Optional[Callable[[dict], bool]] = None
+    ) -> Iterator[AuditoriaMovimiento]:
+        """Registros del archivo (en orden de id) como objetos AuditoriaMovimiento sin sesión"""
+        with gzip.open(archivo.ruta, "rt", encoding="utf-8") as entrada:
+            for linea in entrada:
+                datos = json.loads(linea)
+                for columna in COLUMNAS_FECHA:
+                    if datos.get(columna):
+                        datos[columna] = datetime.fromisoformat(datos[columna])
+                if filtro is None or filtro(datos):
+                    yield AuditoriaMovimiento(**datos)
+
+    def leer_ids(self, archivo: AuditoriaArchivo, ids: Set[int]) -> List[AuditoriaMovimiento]:
+        """
+        Registros con esos ids; deja de leer al pasar el mayor. Un archivo que
+        no está en este host se informa y se omite (la consulta sigue con el resto)
+        """
+        encontrados = []
+        ultimo = max(ids)
+        try:
+            for registro in self.leer(archivo):
+                if registro.id in ids:
+                    encontrados.append(registro)
+                if registro.id >= ultimo:
+                    break
+        except FileNotFoundError:
+            print(f"⚠️ Archivo de auditoría {archivo.mes} no disponible en este host: {archivo.ruta}")
+        return encontrados
+
+    def buscar(self, db, condiciones: Iterable, limite: Optional[int] = None) -> List[AuditoriaMovimiento]:
+        """
+        Registros archivados que cumplen las condiciones sobre
+        AuditoriaIndiceArchivo, del más reciente al más antiguo. Solo se abren
+        los archivos que tienen alguno.
+        """
+        consulta = (
+            select(AuditoriaIndiceArchivo.archivo_id, AuditoriaIndiceArchivo.registro_id)
+            .where(*condiciones)
+            .order_by(AuditoriaIndiceArchivo.fecha_hora.desc(), AuditoriaIndiceArchivo.registro_id.desc())
+        )
+        if limite is not None:
+            consulta = consulta.limit(limite)
+
+        ids_por_archivo: Dict[int, Set[int]] = defaultdict(set)
+        orden = []
+        for fila in db.execute(consulta):
+            ids_por_archivo[fila.archivo_id].add(fila.registro_id)
+            orden.append(fila.registro_id)
+        if not orden:
+            return []
+
+        registros = {}
+        for archivo in db.scalars(select(AuditoriaArchivo).where(AuditoriaArchivo.id.in_(ids_por_archivo))):
+            for registro in self.leer_ids(archivo, ids_por_archivo[archivo.id]):
+                registros[registro.id] = registro
+        return [registros[registro_id] for registro_id in orden if registro_id in registros]
+
+    def indexar(self, db, archivo: AuditoriaArchivo) -> int:
+        """Carga en auditoria_indice_archivo un mes archivado antes de que existiera el índice"""
+        if db.scalar(select(exists().where(AuditoriaIndiceArchivo.archivo_id == archivo.id))):
+            return 0
+        lote, total = [], 0
+        for registro in self.leer(archivo):
+            lote.append({
+                "registro_id": registro.id, "archivo_id": archivo.id, "fecha_hora": registro.fecha_hora,
+                "usuario_id": registro.usuario_id, "tipo_entidad": registro.tipo_entidad,
+                "entidad_id": registro.entidad_id
+            })
+            if len(lote) >= FILAS_POR_INDEXADO:
+                db.execute(insert(AuditoriaIndiceArchivo), lote)
+                total += len(lote)
+                lote = []
+        if lote:
+            db.execute(insert(AuditoriaIndiceArchivo), lote)
+            total += len(lote)
+        db.commit()
+        return total
+
+    def verificar_archivo(self, archivo: AuditoriaArchivo) -> bool:
+        """Comprueba el SHA-256 del archivo y su cadena desde hash_entrada hasta hash_cabeza"""
+        if not os.path.exists(archivo.ruta):
+            print(f"⚠️ Archivo de auditoría {archivo.mes} no disponible en este host: {archivo.ruta}")
+            return False
+        if _sha256_archivo(archivo.ruta) != archivo.sha256_archivo:
+            return False
+        tramo = TramoCadena(archivo.hash_entrada)
+        for registro in self.leer(archivo):
+            if tramo.verificar(registro):
+                return False
+        return tramo.filas == archivo.registros and tramo.hash_salida == archivo.hash_cabeza
+
+
+# Instancia global
+archivo_auditoria = ArchivoAuditoria()
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Archiva los meses fríos de la auditoría")
+    parser.add_argument("--verificar", action="store_true", help="Solo verificar los archivos existentes")
+    parser.add_argument("--indexar", action="store_true", help="Indexar meses archivados sin índice")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.verificar:
+            for archivo in reversed(archivo_auditoria.archivos_en_rango(db)):
+                integro = archivo_auditoria.verificar_archivo(archivo)
+                print(f"{'✅' if integro else '❌'} {archivo.mes} ({archivo.registros} registros)")
+        elif args.indexar:
+            for archivo in reversed(archivo_auditoria.archivos_en_rango(db)):
+                print(f"🗂️ {archivo.mes}: {archivo_auditoria.indexar(db, archivo)} registros indexados")
+        else:
+            archivados = archivo_auditoria.archivar_pendientes(db)
+            print(f"✅ {len(archivados)} meses archivados; en caliente quedan los últimos "
+                  f"{archivo_auditoria.meses_calientes} meses")
+    finally:
+        db.close()
@@ -1,21 +1,79 @@
 """
 Sistema de Auditoría y Trazabilidad
 """
-from datetime import datetime
-from typing import Optional, Dict, Any
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Iterator, List
 import hashlib
 import json
-from sqlalchemy import Column, Integer, String, DateTime, Text
+import struct
+import threading
+from sqlalchemy import Column, Integer, SmallInteger, String, DateTime, Text, select, text
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+HASH_GENESIS = "0" * 64
+
+# Versiones del hash de integridad (columna version_hash; NULL = 1)
+VERSION_HASH_JSON = 1  # json.dumps(sort_keys=True) de los campos
+VERSION_HASH_BINARIO = 2  # codificación binaria canónica (ver _hash_binario)
+VERSION_HASH_ACTUAL = VERSION_HASH_BINARIO
+
+def fecha_auditoria(fecha: datetime) -> datetime:
+    """
+    Trunca a milisegundos, la precisión de fecha_hora (DATETIME2(3)): el hash
+    se calcula sobre el mismo valor que luego se lee de la columna
+    """
+    return fecha.replace(microsecond=fecha.microsecond - fecha.microsecond % 1000)
+
+# Último eslabón de la cadena con bloqueo de actualización: serializa los
+# lotes de distintos workers sin releer la tabla (seek sobre la PK)
+SQL_CABEZA_BLOQUEADA = text("""
+SELECT TOP 1 id, hash_integridad
+FROM auditoria_movimientos WITH (UPDLOCK, HOLDLOCK)
+ORDER BY id DESC
+""")
+
+# Umbral de movimientos grandes (configuracion_seguridad.cantidad_requiere_aprobacion)
+CANTIDAD_REQUIERE_APROBACION = 100
+CLAVE_MARCA_SOSPECHOSOS = "auditoria_sospechosos_ultimo_id"
+
+# Una sola pasada por los registros nuevos con todas las reglas evaluadas en SQL
+# (seek sobre la PK; solo vuelven las filas que disparan alguna regla)
+SQL_SOSPECHOSOS = text("""
+SELECT id, fecha_hora, usuario_nombre, accion, cantidad_movida, nocturno, grande_sin_aprobacion
+FROM (
+    SELECT
+        id, fecha_hora, usuario_nombre, accion, cantidad_movida,
+        CASE WHEN accion IN ('ENTRADA', 'SALIDA')
+              AND (DATEPART(HOUR, fecha_hora) >= 22 OR DATEPART(HOUR, fecha_hora) < 6)
+             THEN 1 ELSE 0 END AS nocturno,
+        CASE WHEN cantidad_movida > :cantidad AND aprobado_por IS NULL
+             THEN 1 ELSE 0 END AS grande_sin_aprobacion
+    FROM auditoria_movimientos
+    WHERE id > :marca AND id <= :hasta_id
+) AS m
+WHERE nocturno = 1 OR grande_sin_aprobacion = 1
+ORDER BY id
+""")
+
+SQL_LEER_CONFIGURACION = text("SELECT valor FROM configuracion_seguridad WHERE clave = :clave")
+
+SQL_GUARDAR_CONFIGURACION = text("""
+UPDATE configuracion_seguridad
+SET valor = :valor, fecha_modificacion = GETDATE()
+WHERE clave = :clave;
+IF @@ROWCOUNT = 0
+    INSERT INTO configuracion_seguridad (clave, valor, tipo, descripcion)
+    VALUES (:clave, :valor, :tipo, :descripcion);
+""")
+
 class AuditoriaMovimiento(Base):
     """Modelo de auditoría para rastrear todos los movimientos"""
     __tablename__ = "auditoria_movimientos"
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    fecha_hora = Column(DateTime, nullable=False, default=datetime.utcnow)
+    fecha_hora = Column(DateTime, nullable=False, default=lambda: fecha_auditoria(datetime.utcnow()))  # DATETIME2(3)
     usuario_id = Column(Integer, nullable=False)
     usuario_nombre = Column(String(200))
     accion = Column(String(50), nullable=False)  # ENTRADA, SALIDA, MODIFICACION, ELIMINACION
@@ -33,37 +91,324 @@ class AuditoriaMovimiento(Base):
     aprobado_por = Column(Integer)  # ID del usuario que aprobó
     hash_integridad = Column(String(64), nullable=False)
     hash_anterior = Column(String(64))  # Hash del registro anterior (blockchain-like)
+    version_hash = Column(SmallInteger)  # NULL/1 = JSON, 2 = binario canónico
+
+class AuditoriaCheckpoint(Base):
+    """Checkpoint firmado: cabeza de la cadena y raíz Merkle de un bloque de registros"""
+    __tablename__ = "auditoria_checkpoints"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    desde_id = Column(Integer, nullable=False)
+    hasta_id = Column(Integer, nullable=False, unique=True)
+    registros = Column(Integer, nullable=False)
+    hash_entrada = Column(String(64), nullable=False)  # hash_anterior del primer registro
+    hash_cabeza = Column(String(64), nullable=False)  # hash_integridad del último registro
+    raiz_merkle = Column(String(64), nullable=False)
+    firma = Column(String(64), nullable=False)  # HMAC-SHA256
+    fecha_creacion = Column(DateTime, nullable=False, default=datetime.now)
+
+class AuditoriaNodoMerkle(Base):
+    """Nodo del árbol Merkle de un checkpoint (nivel 0 = hoja de un registro)"""
+    __tablename__ = "auditoria_merkle_nodos"
+    
+    checkpoint_id = Column(Integer, primary_key=True)
+    nivel = Column(SmallInteger, primary_key=True)
+    posicion = Column(Integer, primary_key=True)
+    hash = Column(String(64), nullable=False)
+    registro_id = Column(Integer, index=True)
+
+class AuditoriaArchivo(Base):
+    """Mes de auditoría exportado a archivo (JSONL comprimido) y quitado de la tabla caliente"""
+    __tablename__ = "auditoria_archivos"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    mes = Column(String(7), nullable=False, unique=True)  # YYYY-MM
+    desde_id = Column(Integer, nullable=False)
+    hasta_id = Column(Integer, nullable=False)
+    registros = Column(Integer, nullable=False)
+    fecha_desde = Column(DateTime, nullable=False)
+    fecha_hasta = Column(DateTime, nullable=False)
+    hash_entrada = Column(String(64), nullable=False)  # hash_anterior del primer registro
+    hash_cabeza = Column(String(64), nullable=False)  # hash_integridad del último registro
+    ruta = Column(String(500), nullable=False)
+    sha256_archivo = Column(String(64), nullable=False)
+    fecha_creacion = Column(DateTime, nullable=False, default=datetime.now)
+
+class AuditoriaIndiceArchivo(Base):
+    """
+    Registro archivado visto desde las consultas de historial: con este índice
+    solo se abren los archivos que tienen filas de la entidad o del usuario
+    """
+    __tablename__ = "auditoria_indice_archivo"
+    
+    registro_id = Column(Integer, primary_key=True, autoincrement=False)  # id en auditoria_movimientos
+    archivo_id = Column(Integer, nullable=False)
+    fecha_hora = Column(DateTime, nullable=False)
+    usuario_id = Column(Integer, nullable=False)
+    tipo_entidad = Column(String(50), nullable=False)
+    entidad_id = Column(String(100))
+
+def cabeza_archivada(db) -> tuple[int, str]:
+    """
+    (hasta_id, hash_cabeza) del último mes archivado; (0, génesis) si no hay
+    archivos. Es el punto de partida de la cadena que queda en la tabla caliente.
+    """
+    archivo = db.execute(
+        select(AuditoriaArchivo.hasta_id, AuditoriaArchivo.hash_cabeza)
+        .order_by(AuditoriaArchivo.hasta_id.desc())
+        .limit(1)
+    ).first()
+    return (archivo.hasta_id, archivo.hash_cabeza) if archivo else (0, HASH_GENESIS)
+
+_EPOCA = datetime(1970, 1, 1)
+_MICROSEGUNDO = timedelta(microseconds=1)
+# Partes de tamaño fijo: "AUD" + versión, fecha (µs desde 1970), usuario_id, hash_anterior (32 bytes)
+_CABECERA_BINARIA = struct.Struct(">3sBqq32s")
+_LONGITUD = struct.Struct(">I")
+_NULO = _LONGITUD.pack(0xFFFFFFFF)
+
+
+def _campo_binario(valor: Optional[str]) -> bytes:
+    """Texto con prefijo de longitud (0xFFFFFFFF = NULL, distinto de cadena vacía)"""
+    if valor is None:
+        return _NULO
+    codificado = valor.encode()
+    return _LONGITUD.pack(len(codificado)) + codificado
+
+
+def _hash_binario(fecha_hora: datetime, usuario_id: Optional[int], accion: Optional[str],
+                  entidad_id: Optional[str], datos_nuevos: Optional[str], hash_anterior: str) -> str:
+    """
+    Versión 2: mismos campos que la versión JSON en orden fijo, enteros de
+    tamaño fijo y textos con prefijo de longitud. Sin dict ni json.dumps.
+    """
+    return hashlib.sha256(b"".join((
+        _CABECERA_BINARIA.pack(
+            b"AUD", VERSION_HASH_BINARIO,
+            (fecha_hora - _EPOCA) // _MICROSEGUNDO,
+            usuario_id if usuario_id is not None else -1,
+            bytes.fromhex(hash_anterior)
+        ),
+        _campo_binario(accion),
+        _campo_binario(entidad_id),
+        _campo_binario(datos_nuevos)
+    ))).hexdigest()
+
+
+def calcular_hash(datos: Dict[str, Any], hash_anterior: str, version: int = VERSION_HASH_JSON) -> str:
+    """
+    Calcula el hash de integridad del registro
+    Incluye datos del movimiento + hash anterior (como blockchain)
+    """
+    if version == VERSION_HASH_BINARIO:
+        return _hash_binario(
+            datos.get("fecha_hora") or datetime.utcnow(),
+            datos.get("usuario_id"),
+            datos.get("accion"),
+            datos.get("entidad_id"),
+            datos.get("datos_nuevos"),
+            hash_anterior
+        )
+    
+    datos_para_hash = {
+        "fecha_hora": datos.get("fecha_hora", datetime.utcnow()).isoformat(),
+        "usuario_id": datos.get("usuario_id"),
+        "accion": datos.get("accion"),
+        "entidad_id": datos.get("entidad_id"),
+        "datos": datos.get("datos_nuevos"),
+        "hash_anterior": hash_anterior
+    }
+    
+    cadena = json.dumps(datos_para_hash, sort_keys=True)
+    return hashlib.sha256(cadena.encode()).hexdigest()
+
+
+def calcular_hash_fila(fila, hash_anterior: str) -> str:
+    """Hash de una fila leída de la tabla (o del archivo) según su version_hash"""
+    if fila.version_hash == VERSION_HASH_BINARIO:
+        return _hash_binario(
+            fila.fecha_hora, fila.usuario_id, fila.accion,
+            fila.entidad_id, fila.datos_nuevos, hash_anterior
+        )
+    return calcular_hash({
+        "fecha_hora": fila.fecha_hora,
+        "usuario_id": fila.usuario_id,
+        "accion": fila.accion,
+        "entidad_id": fila.entidad_id,
+        "datos_nuevos": fila.datos_nuevos
+    }, hash_anterior)
+
+
+def preparar_registro(
+    usuario_id: int,
+    usuario_nombre: str,
+    accion: str,
+    tipo_entidad: str,
+    entidad_id: str,
+    datos_anteriores: Optional[Dict] = None,
+    datos_nuevos: Optional[Dict] = None,
+    ip_address: Optional[str] = None,
+    dispositivo: Optional[str] = None,
+    ubicacion_gps: Optional[str] = None,
+    stock_antes: Optional[int] = None,
+    stock_despues: Optional[int] = None,
+    cantidad_movida: Optional[int] = None,
+    motivo: Optional[str] = None,
+    aprobado_por: Optional[int] = None
+) -> Dict[str, Any]:
+    """Columnas de un registro de auditoría, todavía sin encadenar"""
+    return {
+        "fecha_hora": fecha_auditoria(datetime.utcnow()),
+        "usuario_id": usuario_id,
+        "usuario_nombre": usuario_nombre,
+        "accion": accion,
+        "tipo_entidad": tipo_entidad,
+        # Como texto, igual que vuelve de la columna al verificar
+        "entidad_id": str(entidad_id) if entidad_id is not None else None,
+        "datos_anteriores": json.dumps(datos_anteriores) if datos_anteriores else None,
+        "datos_nuevos": json.dumps(datos_nuevos) if datos_nuevos else None,
+        "ip_address": ip_address,
+        "dispositivo": dispositivo,
+        "ubicacion_gps": ubicacion_gps,
+        "stock_antes": stock_antes,
+        "stock_despues": stock_despues,
+        "cantidad_movida": cantidad_movida,
+        "motivo": motivo,
+        "aprobado_por": aprobado_por,
+        "version_hash": VERSION_HASH_ACTUAL
+    }
+
+
+class TramoCadena:
+    """
+    Verifica filas consecutivas de la cadena (en orden de id) sin retenerlas
+    
+    Con hash_entrada=None el tramo arranca desde el hash_anterior de su primera
+    fila; quien une tramos compara luego ese hash_entrada con el hash_salida
+    del tramo previo.
+    """
+    
+    def __init__(self, hash_entrada: Optional[str] = None):
+        self.hash_entrada = hash_entrada
+        self.hash_salida = hash_entrada
+        self.primer_id: Optional[int] = None
+        self.ultimo_id: Optional[int] = None
+        self.filas = 0
+    
+    def verificar(self, fila) -> Optional[Dict[str, Any]]:
+        """Retorna el detalle si la fila fue alterada, None si es íntegra"""
+        if self.filas == 0:
+            self.primer_id = fila.id
+            if self.hash_entrada is None:
+                self.hash_entrada = self.hash_salida = fila.hash_anterior
+        self.filas += 1
+        self.ultimo_id = fila.id
+        
+        hash_esperado = self.hash_salida
+        hash_calculado = calcular_hash_fila(fila, hash_esperado)
+        self.hash_salida = fila.hash_integridad
+        
+        if hash_calculado != fila.hash_integridad or fila.hash_anterior != hash_esperado:
+            return {
+                "id": fila.id,
+                "fecha": fila.fecha_hora,
+                "hash_esperado": hash_calculado,
+                "hash_almacenado": fila.hash_integridad
+            }
+        return None
+
+
+# Columnas que necesita TramoCadena (sin cargar objetos ORM completos)
+COLUMNAS_VERIFICACION = (
+    AuditoriaMovimiento.id,
+    AuditoriaMovimiento.fecha_hora,
+    AuditoriaMovimiento.usuario_id,
+    AuditoriaMovimiento.accion,
+    AuditoriaMovimiento.entidad_id,
+    AuditoriaMovimiento.datos_nuevos,
+    AuditoriaMovimiento.hash_integridad,
+    AuditoriaMovimiento.hash_anterior,
+    AuditoriaMovimiento.version_hash
+)
+
+FILAS_POR_LECTURA = 5000
+
+
+class CabezaCadena:
+    """
+    Último eslabón de la cadena de auditoría, compartido por todo el proceso
+    
+    Encadenar y confirmar un lote ocurre con el lock tomado, así dos lotes del
+    mismo proceso nunca parten del mismo hash_anterior. Entre workers el orden
+    lo da el UPDLOCK sobre la última fila (SQL_CABEZA_BLOQUEADA).
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.id: Optional[int] = None
+        self.hash: Optional[str] = None
+    
+    def escribir_lote(self, db, registros: List[Dict[str, Any]]) -> List[AuditoriaMovimiento]:
+        """
+        Encadena los registros (en orden) y los confirma en una sola transacción
+        
+        Args:
+            db: Sesión síncrona; se hace commit al final
+            registros: Diccionarios de preparar_registro
+        
+        Returns:
+            Las filas insertadas, con id y hash_integridad
+        """
+        with self.lock:
+            try:
+                ultima = db.execute(SQL_CABEZA_BLOQUEADA).first()
+                # Tabla caliente vacía: la cadena sigue desde el último mes archivado
+                hash_anterior = ultima.hash_integridad if ultima else cabeza_archivada(db)[1]
+                
+                filas = []
+                for datos in registros:
+                    # El hash se calcula sobre el valor que quedará en la columna
+                    datos["fecha_hora"] = fecha_auditoria(datos.get("fecha_hora") or datetime.utcnow())
+                    hash_integridad = calcular_hash(datos, hash_anterior, datos["version_hash"])
+                    filas.append(AuditoriaMovimiento(
+                        **datos,
+                        hash_integridad=hash_integridad,
+                        hash_anterior=hash_anterior
+                    ))
+                    hash_anterior = hash_integridad
+                
+                db.add_all(filas)
+                db.flush()
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            
+            if filas:
+                self.id = filas[-1].id
+                self.hash = hash_anterior
+            return filas
+
+
+# Instancia global (una cadena por proceso)
+cabeza_cadena = CabezaCadena()
+
 
 class ServicioAuditoria:
     """Servicio para registrar y verificar auditorías"""
     
     def __init__(self, db_session):
+        # Sin consulta al construir: la cabeza de la cadena vive en cabeza_cadena
         self.db = db_session
-        self.ultimo_hash = self._obtener_ultimo_hash()
     
-    def _obtener_ultimo_hash(self) -> str:
-        """Obtiene el hash del último registro de auditoría"""
-        ultimo = self.db.query(AuditoriaMovimiento).order_by(
-            AuditoriaMovimiento.id.desc()
-        ).first()
-        return ultimo.hash_integridad if ultimo else "0" * 64
+    @property
+    def ultimo_hash(self) -> str:
+        """Hash del último registro escrito por este proceso"""
+        return cabeza_cadena.hash or HASH_GENESIS
     
-    def _calcular_hash(self, datos: Dict[str, Any], hash_anterior: str) -> str:
-        """
-        Calcula el hash de integridad del registro
-        Incluye datos del movimiento + hash anterior (como blockchain)
-        """
-        datos_para_hash = {
-            "fecha_hora": datos.get("fecha_hora", datetime.utcnow()).isoformat(),
-            "usuario_id": datos.get("usuario_id"),
-            "accion": datos.get("accion"),
-            "entidad_id": datos.get("entidad_id"),
-            "datos": datos.get("datos_nuevos"),
-            "hash_anterior": hash_anterior
-        }
-        
-        cadena = json.dumps(datos_para_hash, sort_keys=True)
-        return hashlib.sha256(cadena.encode()).hexdigest()
+    def _calcular_hash(self, datos: Dict[str, Any], hash_anterior: str,
+                       version: int = VERSION_HASH_JSON) -> str:
+        return calcular_hash(datos, hash_anterior, version)
     
     def registrar_movimiento(
         self,
@@ -85,77 +430,46 @@ class ServicioAuditoria:
     ) -> AuditoriaMovimiento:
         """
         Registra un movimiento en la auditoría con hash de integridad
+        Para muchos movimientos concurrentes usar cola_auditoria (un commit por lote)
         """
-        datos_log = {
-            "fecha_hora": datetime.utcnow(),
-            "usuario_id": usuario_id,
-            "usuario_nombre": usuario_nombre,
-            "accion": accion,
-            "tipo_entidad": tipo_entidad,
-            "entidad_id": entidad_id,
-            "datos_anteriores": json.dumps(datos_anteriores) if datos_anteriores else None,
-            "datos_nuevos": json.dumps(datos_nuevos) if datos_nuevos else None,
-            "ip_address": ip_address,
-            "dispositivo": dispositivo,
-            "ubicacion_gps": ubicacion_gps,
-            "stock_antes": stock_antes,
-            "stock_despues": stock_despues,
-            "cantidad_movida": cantidad_movida,
-            "motivo": motivo,
-            "aprobado_por": aprobado_por
-        }
-        
-        # Calcular hash de integridad
-        hash_integridad = self._calcular_hash(datos_log, self.ultimo_hash)
-        datos_log["hash_integridad"] = hash_integridad
-        datos_log["hash_anterior"] = self.ultimo_hash
-        
-        # Crear registro
-        auditoria = AuditoriaMovimiento(**datos_log)
-        self.db.add(auditoria)
-        self.db.commit()
-        
-        # Actualizar último hash
-        self.ultimo_hash = hash_integridad
-        
-        return auditoria
+        datos_log = preparar_registro(
+            usuario_id, usuario_nombre, accion, tipo_entidad, entidad_id,
+            datos_anteriores, datos_nuevos, ip_address, dispositivo, ubicacion_gps,
+            stock_antes, stock_despues, cantidad_movida, motivo, aprobado_por
+        )
+        return cabeza_cadena.escribir_lote(self.db, [datos_log])[0]
     
     def verificar_integridad(self, desde_id: Optional[int] = None) -> tuple[bool, list]:
         """
         Verifica la integridad de la cadena de auditoría
         Retorna (es_integro, registros_alterados)
-        """
-        query = self.db.query(AuditoriaMovimiento).order_by(AuditoriaMovimiento.id)
         
+        Las filas se leen en streaming (yield_per), así la memoria no crece con
+        la tabla. Con desde_id la cadena parte de la cabeza del último
+        checkpoint firmado anterior a ese id (security/checkpoints_auditoria.py)
+        y solo se recorren los registros posteriores (ValueError si
+        AUDITORIA_CLAVE_CHECKPOINTS no está configurada). Para tablas grandes
+        ver security/verificador_auditoria.py (por segmentos en paralelo).
+        """
         if desde_id:
-            query = query.filter(AuditoriaMovimiento.id >= desde_id)
+            from security.checkpoints_auditoria import checkpoints_auditoria
+            return checkpoints_auditoria.verificar_desde_checkpoint(self.db, desde_id)
         
-        registros = query.all()
+        # Los meses archivados se verifican al exportarlos; se parte de su cabeza
+        archivado_hasta, hash_archivado = cabeza_archivada(self.db)
+        query = (
+            select(*COLUMNAS_VERIFICACION)
+            .where(AuditoriaMovimiento.id > archivado_hasta)
+            .order_by(AuditoriaMovimiento.id)
+        )
+        tramo = TramoCadena(hash_archivado)
         registros_alterados = []
-        hash_esperado = "0" * 64
-        
-        for registro in registros:
-            # Recalcular hash
-            datos = {
-                "fecha_hora": registro.fecha_hora,
-                "usuario_id": registro.usuario_id,
-                "accion": registro.accion,
-                "entidad_id": registro.entidad_id,
-                "datos_nuevos": registro.datos_nuevos
-            }
-            
-            hash_calculado = self._calcular_hash(datos, hash_esperado)
-            
-            # Verificar si coincide
-            if hash_calculado != registro.hash_integridad:
-                registros_alterados.append({
-                    "id": registro.id,
-                    "fecha": registro.fecha_hora,
-                    "hash_esperado": hash_calculado,
-                    "hash_almacenado": registro.hash_integridad
-                })
-            
-            hash_esperado = registro.hash_integridad
+        
+        filas = self.db.execute(query.execution_options(yield_per=FILAS_POR_LECTURA))
+        for fila in filas:
+            alterado = tramo.verificar(fila)
+            if alterado:
+                registros_alterados.append(alterado)
         
         return len(registros_alterados) == 0, registros_alterados
     
@@ -163,21 +477,39 @@ class ServicioAuditoria:
         self,
         tipo_entidad: str,
         entidad_id: str,
-        limite: int = 50
+        limite: int = 50,
+        incluir_archivo: bool = True
     ) -> list[AuditoriaMovimiento]:
-        """Obtiene el historial completo de una entidad"""
-        return self.db.query(AuditoriaMovimiento).filter(
+        """
+        Obtiene el historial completo de una entidad
+        Si la tabla caliente no alcanza para `limite`, sigue por los registros
+        archivados (auditoria_indice_archivo dice qué archivos abrir)
+        """
+        historial = self.db.query(AuditoriaMovimiento).filter(
             AuditoriaMovimiento.tipo_entidad == tipo_entidad,
             AuditoriaMovimiento.entidad_id == entidad_id
         ).order_by(AuditoriaMovimiento.fecha_hora.desc()).limit(limite).all()
+        
+        if incluir_archivo and len(historial) < limite:
+            from security.archivo_auditoria import archivo_auditoria
+            historial.extend(archivo_auditoria.buscar(self.db, (
+                AuditoriaIndiceArchivo.tipo_entidad == tipo_entidad,
+                AuditoriaIndiceArchivo.entidad_id == entidad_id
+            ), limite=limite - len(historial)))
+        
+        return historial
     
     def obtener_movimientos_usuario(
         self,
         usuario_id: int,
         fecha_inicio: Optional[datetime] = None,
-        fecha_fin: Optional[datetime] = None
+        fecha_fin: Optional[datetime] = None,
+        incluir_archivo: bool = True
     ) -> list[AuditoriaMovimiento]:
-        """Obtiene todos los movimientos de un usuario en un rango de fechas"""
+        """
+        Obtiene todos los movimientos de un usuario en un rango de fechas
+        Incluye los registros archivados del rango (solo se abren sus archivos)
+        """
         query = self.db.query(AuditoriaMovimiento).filter(
             AuditoriaMovimiento.usuario_id == usuario_id
         )
@@ -187,48 +519,97 @@ class ServicioAuditoria:
         if fecha_fin:
             query = query.filter(AuditoriaMovimiento.fecha_hora <= fecha_fin)
         
-        return query.order_by(AuditoriaMovimiento.fecha_hora.desc()).all()
+        movimientos = query.order_by(AuditoriaMovimiento.fecha_hora.desc()).all()
+        
+        if incluir_archivo:
+            from security.archivo_auditoria import archivo_auditoria
+            condiciones = [AuditoriaIndiceArchivo.usuario_id == usuario_id]
+            if fecha_inicio:
+                condiciones.append(AuditoriaIndiceArchivo.fecha_hora >= fecha_inicio)
+            if fecha_fin:
+                condiciones.append(AuditoriaIndiceArchivo.fecha_hora <= fecha_fin)
+            movimientos.extend(archivo_auditoria.buscar(self.db, condiciones))
+        
+        return movimientos
     
-    def detectar_movimientos_sospechosos(self) -> list[Dict]:
-        """
-        Detecta patrones sospechosos en los movimientos
+    def escanear_movimientos_sospechosos(
+        self,
+        desde_id: Optional[int] = None,
+        cantidad_sin_aprobacion: int = CANTIDAD_REQUIERE_APROBACION,
+        limite: Optional[int] = None
+    ) -> Iterator[Dict]:
         """
-        alertas = []
+        Recorre una sola vez los registros nuevos y produce las alertas a medida
+        que aparecen. Los filtros (hora nocturna, cantidad sin aprobación) se
+        evalúan en SQL Server y la lectura es un seek por id > marca de agua,
+        así el costo depende de los registros agregados desde la última pasada.
         
-        # 1. Movimientos fuera de horario (10pm - 6am)
-        movimientos_nocturnos = self.db.query(AuditoriaMovimiento).filter(
-            AuditoriaMovimiento.accion.in_(["ENTRADA", "SALIDA"])
-        ).all()
+        Sin desde_id parte de la marca persistida en configuracion_seguridad y
+        la avanza al terminar (o hasta el último registro entregado si se cortó
+        por `limite`, para que la siguiente página siga desde ahí).
+        """
+        usa_marca = desde_id is None
+        marca = self._leer_marca_sospechosos() if usa_marca else desde_id - 1
+        hasta_id = self.db.execute(text("SELECT ISNULL(MAX(id), 0) FROM auditoria_movimientos")).scalar()
         
-        for mov in movimientos_nocturnos:
-            hora = mov.fecha_hora.hour
-            if hora >= 22 or hora < 6:
-                alertas.append({
+        filas = self.db.execute(
+            SQL_SOSPECHOSOS.execution_options(yield_per=FILAS_POR_LECTURA),
+            {"marca": marca, "hasta_id": hasta_id, "cantidad": cantidad_sin_aprobacion}
+        )
+        entregadas = 0
+        ultimo_id = hasta_id
+        marca_pagina = marca
+        for mov in filas:
+            if limite is not None and entregadas >= limite:
+                ultimo_id = marca_pagina
+                break
+            if mov.nocturno:
+                yield {
                     "tipo": "MOVIMIENTO_NOCTURNO",
                     "gravedad": "ALTA",
                     "movimiento_id": mov.id,
                     "usuario": mov.usuario_nombre,
                     "fecha": mov.fecha_hora,
                     "descripcion": f"Movimiento fuera de horario: {mov.accion} a las {mov.fecha_hora}"
-                })
-        
-        # 2. Múltiples movimientos del mismo producto en poco tiempo
-        # (Implementar lógica de detección de patrones)
-        
-        # 3. Movimientos grandes sin aprobación
-        movimientos_grandes = self.db.query(AuditoriaMovimiento).filter(
-            AuditoriaMovimiento.cantidad_movida > 100,
-            AuditoriaMovimiento.aprobado_por.is_(None)
-        ).all()
-        
-        for mov in movimientos_grandes:
-            alertas.append({
-                "tipo": "MOVIMIENTO_GRANDE_SIN_APROBACION",
-                "gravedad": "CRITICA",
-                "movimiento_id": mov.id,
-                "usuario": mov.usuario_nombre,
-                "cantidad": mov.cantidad_movida,
-                "descripcion": f"Movimiento de {mov.cantidad_movida} unidades sin aprobación"
-            })
-        
-        return alertas
+                }
+            if mov.grande_sin_aprobacion:
+                yield {
+                    "tipo": "MOVIMIENTO_GRANDE_SIN_APROBACION",
+                    "gravedad": "CRITICA",
+                    "movimiento_id": mov.id,
+                    "usuario": mov.usuario_nombre,
+                    "cantidad": mov.cantidad_movida,
+                    "descripcion": f"Movimiento de {mov.cantidad_movida} unidades sin aprobación"
+                }
+            entregadas += 1
+            marca_pagina = mov.id
+        filas.close()
+        
+        if usa_marca and ultimo_id > marca:
+            self._guardar_marca_sospechosos(ultimo_id)
+    
+    def _leer_marca_sospechosos(self) -> int:
+        valor = self.db.execute(SQL_LEER_CONFIGURACION, {"clave": CLAVE_MARCA_SOSPECHOSOS}).scalar()
+        return int(valor) if valor else 0
+    
+    def _guardar_marca_sospechosos(self, ultimo_id: int):
+        self.db.execute(SQL_GUARDAR_CONFIGURACION, {
+            "clave": CLAVE_MARCA_SOSPECHOSOS,
+            "valor": str(ultimo_id),
+            "tipo": "int",
+            "descripcion": "Último id de auditoría revisado por el detector de movimientos sospechosos"
+        })
+        self.db.commit()
+    
+    def detectar_movimientos_sospechosos(
+        self,
+        desde_id: Optional[int] = None,
+        limite: Optional[int] = None
+    ) -> list[Dict]:
+        """
+        Detecta patrones sospechosos en los movimientos nuevos
+        (ver escanear_movimientos_sospechosos; `limite` = movimientos por página)
+        
+        Pendiente: múltiples movimientos del mismo producto en poco tiempo
+        """
+        return list(self.escanear_movimientos_sospechosos(desde_id=desde_id, limite=limite))
@@ -3,21 +3,51 @@ Sistema de Autenticación y Autorización
 """
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
+import os
+import secrets
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 
+from security.cache_tokens import CacheTokens
+from security.cache_usuarios import CacheUsuarios
+from security.tokens_jwt import AnilloClaves, TokenInvalido, crear_backend
+from security.permisos import ModeloPermisos
+from security.hash_passwords import PoolHashing
+from security.sesiones import registro_sesiones
+
 # Configuración de seguridad
 SECRET_KEY = "TU_CLAVE_SECRETA_SUPER_SEGURA_CAMBIAR_EN_PRODUCCION"  # CAMBIAR EN .env
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 15
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
-# Configuración de hashing de contraseñas
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Caché de tokens verificados (por proceso)
+TOKEN_CACHE_MAX_ENTRADAS = 10000
+TOKEN_CACHE_TTL_SEGUNDOS = 300
+USUARIO_CACHE_MAX_ENTRADAS = 5000
+USUARIO_CACHE_TTL_SEGUNDOS = 60
+
+# Backend de firma JWT y claves por kid (ver security/tokens_jwt.py)
+anillo_claves = AnilloClaves.desde_entorno(SECRET_KEY)
+backend_jwt = crear_backend(os.getenv("JWT_BACKEND", "hmac"), anillo_claves)
+
+# Configuración de hashing de contraseñas. Al subir BCRYPT_ROUNDS los hashes
+# existentes se recalculan en el siguiente login exitoso.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+# Hash contra el que se verifica cuando el usuario no existe: el login tarda
+# lo mismo y no revela qué usernames son válidos
+HASH_PASSWORD_FICTICIO = pwd_context.hash(secrets.token_urlsafe(32))
+pool_hashing = PoolHashing(
+    pwd_context,
+    max_hilos=int(os.getenv("BCRYPT_HILOS", "2")),
+    max_pendientes=int(os.getenv("BCRYPT_MAX_PENDIENTES", "64"))
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+cache_tokens = CacheTokens(TOKEN_CACHE_MAX_ENTRADAS, TOKEN_CACHE_TTL_SEGUNDOS)
+cache_usuarios = CacheUsuarios(USUARIO_CACHE_MAX_ENTRADAS, USUARIO_CACHE_TTL_SEGUNDOS)
 
 # Roles y permisos
 class Rol:
@@ -66,6 +96,27 @@ PERMISOS_POR_ROL = {
     ]
 }
 
+# Modelo compilado a bits (recargable desde roles_permisos, ver security/permisos.py).
+# Solo se agregan permisos al final del catálogo: cambiar el orden invalida el
+# claim "perm" de los tokens emitidos.
+modelo_permisos = ModeloPermisos(
+    catalogo=[
+        Permiso.VER_TODO,
+        Permiso.CREAR_PRODUCTO,
+        Permiso.MODIFICAR_PRODUCTO,
+        Permiso.ELIMINAR_PRODUCTO,
+        Permiso.REGISTRAR_MOVIMIENTO,
+        Permiso.APROBAR_MOVIMIENTO,
+        Permiso.VER_AUDITORIA,
+        Permiso.GESTIONAR_USUARIOS
+    ],
+    permisos_por_rol=PERMISOS_POR_ROL
+)
+
+def mascara_permisos(rol: Optional[str]) -> int:
+    """Máscara de bits con los permisos de un rol (para el claim "perm")"""
+    return modelo_permisos.mascara_token(rol)
+
 # Modelos
 class Token(BaseModel):
     access_token: str
@@ -75,6 +126,9 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
     rol: Optional[str] = None
+    permisos: Optional[int] = None  # Máscara del claim "perm"
+    tipo: Optional[str] = None  # "access" o "refresh"
+    sid: Optional[str] = None  # Sesión en sesiones_activas
 
 class Usuario(BaseModel):
     id: int
@@ -98,11 +152,17 @@ class UsuarioDB(Usuario):
 
 # Funciones de utilidad
 def verificar_password(password_plano: str, hashed_password: str) -> bool:
-    """Verifica que la contraseña coincida con el hash"""
+    """
+    Verifica que la contraseña coincida con el hash
+    Bloqueante: desde endpoints async usar pool_hashing.verificar
+    """
     return pwd_context.verify(password_plano, hashed_password)
 
 def obtener_hash_password(password: str) -> str:
-    """Genera el hash de una contraseña"""
+    """
+    Genera el hash de una contraseña
+    Bloqueante: desde endpoints async usar pool_hashing.hash
+    """
     return pwd_context.hash(password)
 
 def crear_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -114,7 +174,10 @@ def crear_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + timedelta(minutes=15)
     
     to_encode.update({"exp": expire, "type": "access"})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    if "rol" in to_encode and "perm" not in to_encode:
+        # Los permisos viajan en el token: autorizar no requiere consultar al usuario
+        to_encode["perm"] = mascara_permisos(to_encode["rol"])
+    encoded_jwt = backend_jwt.codificar(to_encode)
     return encoded_jwt
 
 def crear_refresh_token(data: dict):
@@ -122,34 +185,71 @@ def crear_refresh_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     to_encode.update({"exp": expire, "type": "refresh"})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = backend_jwt.codificar(to_encode)
     return encoded_jwt
 
-def verificar_token(token: str) -> TokenData:
-    """Verifica y decodifica un token JWT"""
+def verificar_token(token: str, tipo: str = "access") -> TokenData:
+    """
+    Verifica y decodifica un token JWT del tipo indicado ("access" o "refresh")
+    Los tokens ya verificados se resuelven desde cache_tokens sin validar la firma
+    otra vez; la revocación de la sesión se consulta en memoria en cada llamada
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudieron validar las credenciales",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    token_data = cache_tokens.obtener(token)
+    if token_data is None:
+        token_data = _decodificar_token(token, credentials_exception)
+    
+    if token_data.tipo != tipo:
+        raise credentials_exception
+    if token_data.sid is not None and registro_sesiones.esta_revocada(token_data.sid):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="La sesión fue cerrada",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    return token_data
+
+def _decodificar_token(token: str, credentials_exception: HTTPException) -> TokenData:
+    """Valida la firma y arma el TokenData (se guarda en cache_tokens)"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = backend_jwt.decodificar(token)
         username: str = payload.get("sub")
         rol: str = payload.get("rol")
         
         if username is None:
             raise credentials_exception
         
-        token_data = TokenData(username=username, rol=rol)
+        token_data = TokenData(
+            username=username,
+            rol=rol,
+            permisos=payload.get("perm"),
+            tipo=payload.get("type"),
+            sid=payload.get("sid")
+        )
+        cache_tokens.guardar(token, token_data, payload.get("exp"))
         return token_data
-    except JWTError:
+    except TokenInvalido:
         raise credentials_exception
 
 def usuario_tiene_permiso(usuario: Usuario, permiso: str) -> bool:
     """Verifica si un usuario tiene un permiso específico"""
-    permisos = PERMISOS_POR_ROL.get(usuario.rol, [])
-    return permiso in permisos
+    return modelo_permisos.rol_tiene_permiso(usuario.rol, permiso)
+
+def token_tiene_permiso(token_data: TokenData, permiso: str) -> bool:
+    """
+    Verifica un permiso con la máscara del token
+    Tokens sin "perm" o permisos fuera del catálogo fijo se resuelven por el rol
+    """
+    bit = modelo_permisos.bit(permiso)
+    if token_data.permisos is None or not bit & modelo_permisos.mascara_catalogo:
+        return modelo_permisos.rol_tiene_permiso(token_data.rol, permiso)
+    return bool(token_data.permisos & bit)
 
 def requiere_permiso(permiso: str):
     """Decorador para requerir un permiso específico"""
@@ -0,0 +1,136 @@
+"""
+Caché de tokens JWT ya verificados
+
+Evita repetir la verificación de firma (jwt.decode) en cada petición de la
+misma sesión; solo guarda el TokenData (el perfil del usuario vive en
+security/cache_usuarios.py, con su propio TTL e invalidación). Las entradas se indexan por un
+digest SHA-256 del token (el token no se guarda en claro), expiran con el
+`exp` del propio token o con el TTL de la caché, lo que ocurra antes, y se
+pueden invalidar por token (logout) o por usuario (desactivación, cambio de
+contraseña).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+# Posiciones de cada entrada: [token_data, expira, username]
+_TOKEN_DATA, _EXPIRA, _USERNAME = range(3)
+
+
+def digest_token(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+class CacheTokens:
+    """LRU acotada con expiración por entrada"""
+
+    def __init__(self, max_entradas: int = 10000, ttl_segundos: float = 300):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+
+        self._entradas: "OrderedDict[bytes, list]" = OrderedDict()
+        self._por_usuario: Dict[str, Set[bytes]] = {}
+        self._lock = threading.Lock()
+
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.invalidaciones = 0
+
+    # ---------------------------------------------
+    # Lectura / escritura
+    # ---------------------------------------------
+    def _entrada_vigente(self, clave: bytes) -> Optional[list]:
+        """Entrada no expirada, marcada como usada recientemente (con el lock tomado)"""
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        if entrada[_EXPIRA] <= time.time():
+            self._quitar(clave)
+            return None
+        self._entradas.move_to_end(clave)
+        return entrada
+
+    def obtener(self, token: str) -> Optional[Any]:
+        """TokenData del token si ya fue verificado y sigue vigente"""
+        clave = digest_token(token)
+        with self._lock:
+            entrada = self._entrada_vigente(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+            return entrada[_TOKEN_DATA]
+
+    def guardar(self, token: str, token_data: Any, exp: Optional[float]):
+        """
+        Registra un token recién verificado
+
+        Args:
+            token: Token JWT tal como llegó
+            token_data: Resultado de la verificación
+            exp: Claim `exp` del token (timestamp Unix)
+        """
+        expira = time.time() + self.ttl_segundos
+        if exp is not None:
+            expira = min(expira, float(exp))
+
+        clave = digest_token(token)
+        username = getattr(token_data, "username", None)
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = [token_data, expira, username]
+            if username is not None:
+                self._por_usuario.setdefault(username, set()).add(clave)
+
+            while len(self._entradas) > self.max_entradas:
+                self._quitar(next(iter(self._entradas)))
+                self.expulsiones += 1
+
+    # ---------------------------------------------
+    # Invalidación
+    # ---------------------------------------------
+    def _quitar(self, clave: bytes):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is None or entrada[_USERNAME] is None:
+            return
+        claves = self._por_usuario.get(entrada[_USERNAME])
+        if claves is not None:
+            claves.discard(clave)
+            if not claves:
+                del self._por_usuario[entrada[_USERNAME]]
+
+    def invalidar_token(self, token: str):
+        with self._lock:
+            clave = digest_token(token)
+            if clave in self._entradas:
+                self._quitar(clave)
+                self.invalidaciones += 1
+
+    def invalidar_usuario(self, username: str):
+        """Quita todos los tokens en caché de un usuario"""
+        with self._lock:
+            for clave in list(self._por_usuario.get(username, ())):
+                self._quitar(clave)
+                self.invalidaciones += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._por_usuario.clear()
+
+    def obtener_estadisticas(self) -> dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'max_entradas': self.max_entradas,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': round(self.aciertos / consultas, 4) if consultas else 0.0,
+                'expulsiones': self.expulsiones,
+                'invalidaciones': self.invalidaciones
+            }
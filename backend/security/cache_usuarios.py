@@ -0,0 +1,156 @@
+"""
+Caché de perfiles de usuario (fila de `usuarios`) por username
+
+get_current_user necesita saber si el usuario sigue activo y cuál es su rol.
+Consultar `usuarios` en cada petición duplicaría la carga sobre SQL Server,
+así que el perfil se guarda aquí con un TTL corto:
+
+- Escritura directa: las rutas que modifican un usuario (activar, cambiar
+  contraseña, registrar, login) guardan el perfil nuevo en cuanto hacen commit.
+- Anti-estampida: si muchas peticiones fallan a la vez sobre el mismo usuario,
+  solo la primera consulta la BD; las demás esperan ese mismo resultado. La
+  consulta corre en una tarea propia: si la petición que la inició se cancela
+  (cliente desconectado), las demás siguen esperando la misma carga.
+- Una carga que empezó antes de una escritura no pisa el perfil más nuevo.
+
+Cada worker tiene su propia caché: en otros workers un cambio se ve al vencer
+el TTL (la desactivación además revoca las sesiones, ver security/sesiones.py).
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def _recuperar_excepcion(tarea: asyncio.Task):
+    """Evita el aviso de excepción no recuperada si todos los que esperaban se cancelaron"""
+    if not tarea.cancelled():
+        tarea.exception()
+
+
+class CacheUsuarios:
+    """LRU acotada con TTL y una sola carga en vuelo por username"""
+
+    def __init__(self, max_entradas: int = 5000, ttl_segundos: float = 60):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+
+        # username -> (usuario, expira)
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()
+        # username -> tarea de la carga en curso
+        self._en_vuelo: Dict[str, asyncio.Task] = {}
+        # username -> versión, solo mientras hay una carga en curso; cada
+        # escritura o invalidación la incrementa
+        self._versiones: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.aciertos = 0
+        self.fallos = 0
+        self.esperas = 0
+        self.invalidaciones = 0
+
+    # ---------------------------------------------
+    # Lectura
+    # ---------------------------------------------
+    def obtener_vigente(self, username: str) -> Optional[Any]:
+        """Perfil en caché si no venció (sin ir a la BD)"""
+        with self._lock:
+            entrada = self._entradas.get(username)
+            if entrada is None:
+                return None
+            if entrada[1] <= time.monotonic():
+                del self._entradas[username]
+                return None
+            self._entradas.move_to_end(username)
+            return entrada[0]
+
+    async def obtener(self, username: str, cargar: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """
+        Perfil del usuario; en un fallo lo carga con `cargar()` una sola vez
+        aunque lleguen muchas peticiones simultáneas
+
+        Args:
+            username: Usuario del token
+            cargar: Corrutina que consulta la BD con su propia sesión (None si
+                el usuario no existe); corre fuera de la petición que la inició
+        """
+        usuario = self.obtener_vigente(username)
+        if usuario is not None:
+            self.aciertos += 1
+            return usuario
+
+        tarea = self._en_vuelo.get(username)
+        if tarea is not None:
+            # Otra petición ya está consultando: esperar su resultado
+            self.esperas += 1
+        else:
+            self.fallos += 1
+            with self._lock:
+                version = self._versiones.setdefault(username, 0)
+            tarea = asyncio.get_running_loop().create_task(self._cargar(username, cargar, version))
+            tarea.add_done_callback(_recuperar_excepcion)
+            self._en_vuelo[username] = tarea
+
+        # shield: cancelar esta petición no cancela la carga que esperan las demás
+        return await asyncio.shield(tarea)
+
+    async def _cargar(self, username: str, cargar: Callable[[], Awaitable[Optional[Any]]], version: int):
+        try:
+            usuario = await cargar()
+            if usuario is not None:
+                self._guardar(username, usuario, version)
+            return usuario
+        finally:
+            self._en_vuelo.pop(username, None)
+            with self._lock:
+                self._versiones.pop(username, None)
+
+    # ---------------------------------------------
+    # Escritura / invalidación
+    # ---------------------------------------------
+    def _guardar(self, username: str, usuario: Any, version: Optional[int] = None):
+        with self._lock:
+            if version is not None and self._versiones.get(username) != version:
+                # Hubo una escritura mientras se cargaba: el dato leído es viejo
+                return
+            self._entradas[username] = (usuario, time.monotonic() + self.ttl_segundos)
+            self._entradas.move_to_end(username)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def _nueva_version(self, username: str):
+        """Marca como vieja la carga en curso del usuario, si hay una (con el lock tomado)"""
+        if username in self._versiones:
+            self._versiones[username] += 1
+
+    def guardar(self, usuario: Any):
+        """Escritura directa tras un commit que modificó al usuario"""
+        with self._lock:
+            self._nueva_version(usuario.username)
+        self._guardar(usuario.username, usuario)
+
+    def invalidar(self, username: str):
+        with self._lock:
+            self._nueva_version(username)
+            if self._entradas.pop(username, None) is not None:
+                self.invalidaciones += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def obtener_estadisticas(self) -> dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos + self.esperas
+            return {
+                'entradas': len(self._entradas),
+                'max_entradas': self.max_entradas,
+                'ttl_segundos': self.ttl_segundos,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'esperas': self.esperas,
+                'tasa_aciertos': round((self.aciertos + self.esperas) / consultas, 4) if consultas else 0.0,
+                'invalidaciones': self.invalidaciones,
+                'cargas_en_vuelo': len(self._en_vuelo)
+            }
@@ -0,0 +1,347 @@
+"""
+Checkpoints firmados de la cadena de auditoría con árboles Merkle
+
+Cada `registros_por_bloque` registros se guarda un checkpoint con:
+    - hash_entrada / hash_cabeza: primer hash_anterior y último hash_integridad del bloque
+    - raiz_merkle: raíz del árbol cuyas hojas son los hash_integridad del bloque
+    - firma: HMAC-SHA256 de lo anterior con AUDITORIA_CLAVE_CHECKPOINTS
+
+Un checkpoint solo se genera después de verificar su bloque encadenado al
+checkpoint previo, así que la verificación nocturna arranca desde la última
+cabeza firmada y recorre únicamente los registros nuevos.
+
+Los nodos del árbol se guardan en auditoria_merkle_nodos: comprobar un
+registro puntual lee su hoja y un hermano por nivel, O(log n).
+
+Uso nocturno (desde backend/):
+    python -m security.checkpoints_auditoria
+    python -m security.checkpoints_auditoria --registro 123456
+"""
+import argparse
+import hashlib
+import hmac
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, insert, or_, select
+
+from security.auditoria import (
+    AuditoriaCheckpoint, AuditoriaMovimiento, AuditoriaNodoMerkle,
+    COLUMNAS_VERIFICACION, FILAS_POR_LECTURA, TramoCadena, calcular_hash_fila, cabeza_archivada
+)
+
+REGISTROS_POR_BLOQUE = 10000
+
+
+class CheckpointInvalido(Exception):
+    """El último checkpoint no tiene firma válida (alterado o firmado con otra clave)"""
+
+    def __init__(self, checkpoint_id: int):
+        super().__init__(
+            f"Checkpoint de auditoría {checkpoint_id} con firma inválida: revisar antes de generar más checkpoints"
+        )
+        self.checkpoint_id = checkpoint_id
+
+
+# ---------------------------------------------
+# Árbol Merkle (hojas y nodos con prefijo para separar dominios)
+# ---------------------------------------------
+def hoja_merkle(hash_integridad: str) -> bytes:
+    return hashlib.sha256(b"\x00" + bytes.fromhex(hash_integridad)).digest()
+
+
+def nodo_merkle(izquierda: bytes, derecha: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + izquierda + derecha).digest()
+
+
+def niveles_merkle(hojas: List[bytes]) -> List[List[bytes]]:
+    """Todos los niveles del árbol; un nodo sin hermano sube tal cual"""
+    niveles = [hojas]
+    while len(niveles[-1]) > 1:
+        actual = niveles[-1]
+        niveles.append([
+            nodo_merkle(actual[i], actual[i + 1]) if i + 1 < len(actual) else actual[i]
+            for i in range(0, len(actual), 2)
+        ])
+    return niveles
+
+
+def tamanos_niveles(hojas: int) -> List[int]:
+    """Cantidad de nodos de cada nivel (sin la raíz) para un bloque de `hojas` registros"""
+    tamanos = []
+    while hojas > 1:
+        tamanos.append(hojas)
+        hojas = (hojas + 1) // 2
+    return tamanos
+
+
+def raiz_desde_prueba(hoja: bytes, posicion: int, hermanos: List[Optional[bytes]]) -> bytes:
+    """Recalcula la raíz subiendo desde la hoja con un hermano (o None) por nivel"""
+    nodo = hoja
+    for hermano in hermanos:
+        if hermano is not None:
+            nodo = nodo_merkle(nodo, hermano) if posicion % 2 == 0 else nodo_merkle(hermano, nodo)
+        posicion //= 2
+    return nodo
+
+
+class CheckpointsAuditoria:
+    def __init__(self, clave: Optional[str] = None, registros_por_bloque: int = REGISTROS_POR_BLOQUE):
+        clave = clave if clave is not None else os.getenv("AUDITORIA_CLAVE_CHECKPOINTS", "")
+        self.clave = clave.encode()
+        self.registros_por_bloque = registros_por_bloque
+
+    # ---------------------------------------------
+    # Firma
+    # ---------------------------------------------
+    def _firmar(self, desde_id: int, hasta_id: int, registros: int,
+                hash_entrada: str, hash_cabeza: str, raiz_merkle: str) -> str:
+        self._exigir_clave()
+        mensaje = f"{desde_id}|{hasta_id}|{registros}|{hash_entrada}|{hash_cabeza}|{raiz_merkle}"
+        return hmac.new(self.clave, mensaje.encode(), hashlib.sha256).hexdigest()
+
+    def _exigir_clave(self):
+        if not self.clave:
+            raise ValueError("AUDITORIA_CLAVE_CHECKPOINTS no está configurada")
+
+    def firma_valida(self, checkpoint: AuditoriaCheckpoint) -> bool:
+        if not self.clave:
+            return False
+        esperada = self._firmar(
+            checkpoint.desde_id, checkpoint.hasta_id, checkpoint.registros,
+            checkpoint.hash_entrada, checkpoint.hash_cabeza, checkpoint.raiz_merkle
+        )
+        return hmac.compare_digest(esperada, checkpoint.firma)
+
+    # ---------------------------------------------
+    # Consultas
+    # ---------------------------------------------
+    def ultimo_confiable(self, db, antes_de_id: Optional[int] = None) -> Optional[AuditoriaCheckpoint]:
+        """
+        Último checkpoint con firma válida (y hasta_id < antes_de_id si se indica)
+        Un checkpoint con firma inválida se ignora y se prueba con el anterior
+        """
+        consulta = select(AuditoriaCheckpoint).order_by(AuditoriaCheckpoint.hasta_id.desc())
+        if antes_de_id is not None:
+            consulta = consulta.where(AuditoriaCheckpoint.hasta_id < antes_de_id)
+        for checkpoint in db.scalars(consulta.limit(10)):
+            if self.firma_valida(checkpoint):
+                return checkpoint
+            print(f"⚠️ Checkpoint de auditoría {checkpoint.id} con firma inválida")
+        return None
+
+    def punto_de_partida(self, db, checkpoint: Optional[AuditoriaCheckpoint]) -> tuple[int, str]:
+        """(hasta_id, hash) del checkpoint o del último mes archivado, el más reciente"""
+        archivado = cabeza_archivada(db)
+        if checkpoint is not None and checkpoint.hasta_id >= archivado[0]:
+            return checkpoint.hasta_id, checkpoint.hash_cabeza
+        return archivado
+
+    # ---------------------------------------------
+    # Generación
+    # ---------------------------------------------
+    def generar_pendientes(self, db) -> Dict[str, Any]:
+        """
+        Verifica los registros posteriores al último checkpoint y firma un
+        checkpoint por cada bloque completo. Se detiene en el primer bloque con
+        registros alterados (no se firma nada que no cuadre).
+
+        Lanza CheckpointInvalido si el último checkpoint no tiene firma válida:
+        partir del anterior volvería a firmar bloques ya cubiertos (y chocaría
+        con IDX_checkpoints_hasta).
+
+        Returns:
+            {"checkpoints": creados, "alterados": [...], "ultimo_hasta_id": id}
+        """
+        self._exigir_clave()
+        ultimo = db.scalars(
+            select(AuditoriaCheckpoint).order_by(AuditoriaCheckpoint.hasta_id.desc()).limit(1)
+        ).first()
+        if ultimo is not None and not self.firma_valida(ultimo):
+            raise CheckpointInvalido(ultimo.id)
+        hasta_id, hash_cabeza = self.punto_de_partida(db, ultimo)
+        creados = 0
+
+        while True:
+            tramo = TramoCadena(hash_cabeza)
+            hojas: List[bytes] = []
+            ids: List[int] = []
+            alterados = []
+
+            filas = db.execute(
+                select(*COLUMNAS_VERIFICACION)
+                .where(AuditoriaMovimiento.id > hasta_id)
+                .order_by(AuditoriaMovimiento.id)
+                .limit(self.registros_por_bloque)
+                .execution_options(yield_per=FILAS_POR_LECTURA)
+            )
+            for fila in filas:
+                alterado = tramo.verificar(fila)
+                if alterado:
+                    alterados.append(alterado)
+                hojas.append(hoja_merkle(fila.hash_integridad))
+                ids.append(fila.id)
+
+            if alterados or len(hojas) < self.registros_por_bloque:
+                return {"checkpoints": creados, "alterados": alterados, "ultimo_hasta_id": hasta_id}
+
+            self._guardar(db, ids, hojas, hash_cabeza, tramo.hash_salida)
+            creados += 1
+            hasta_id, hash_cabeza = ids[-1], tramo.hash_salida
+
+    def _guardar(self, db, ids: List[int], hojas: List[bytes], hash_entrada: str, hash_cabeza: str):
+        niveles = niveles_merkle(hojas)
+        raiz = niveles[-1][0].hex()
+        checkpoint = AuditoriaCheckpoint(
+            desde_id=ids[0],
+            hasta_id=ids[-1],
+            registros=len(ids),
+            hash_entrada=hash_entrada,
+            hash_cabeza=hash_cabeza,
+            raiz_merkle=raiz,
+            firma=self._firmar(ids[0], ids[-1], len(ids), hash_entrada, hash_cabeza, raiz)
+        )
+        db.add(checkpoint)
+        db.flush()
+
+        # Todos los niveles salvo la raíz (que va firmada en el checkpoint)
+        nodos = [
+            {
+                "checkpoint_id": checkpoint.id,
+                "nivel": nivel,
+                "posicion": posicion,
+                "hash": valor.hex(),
+                "registro_id": ids[posicion] if nivel == 0 else None
+            }
+            for nivel, valores in enumerate(niveles[:-1])
+            for posicion, valor in enumerate(valores)
+        ]
+        if nodos:
+            db.execute(insert(AuditoriaNodoMerkle), nodos)
+        db.commit()
+
+    # ---------------------------------------------
+    # Verificación
+    # ---------------------------------------------
+    def verificar_desde_checkpoint(self, db, desde_id: Optional[int] = None) -> tuple[bool, list]:
+        """
+        Verifica la cadena a partir del último checkpoint confiable anterior a
+        desde_id (o del último, sin desde_id). Sin checkpoints parte del último
+        mes archivado (o del génesis).
+
+        Sin AUDITORIA_CLAVE_CHECKPOINTS lanza ValueError: ningún checkpoint
+        sería confiable y la verificación recorrería toda la tabla en silencio.
+        """
+        self._exigir_clave()
+        hasta_id, hash_cabeza = self.punto_de_partida(db, self.ultimo_confiable(db, antes_de_id=desde_id))
+        tramo = TramoCadena(hash_cabeza)
+
+        alterados = []
+        filas = db.execute(
+            select(*COLUMNAS_VERIFICACION)
+            .where(AuditoriaMovimiento.id > hasta_id)
+            .order_by(AuditoriaMovimiento.id)
+            .execution_options(yield_per=FILAS_POR_LECTURA)
+        )
+        for fila in filas:
+            alterado = tramo.verificar(fila)
+            if alterado:
+                alterados.append(alterado)
+        return len(alterados) == 0, alterados
+
+    def comprobar_registro(self, db, registro_id: int) -> Dict[str, Any]:
+        """
+        Prueba la integridad de un registro en O(log n): su hash propio, su
+        camino Merkle hasta la raíz y la firma del checkpoint que lo contiene
+        """
+        fila = db.execute(
+            select(*COLUMNAS_VERIFICACION).where(AuditoriaMovimiento.id == registro_id)
+        ).first()
+        if fila is None:
+            return {"id": registro_id, "integro": False, "motivo": "registro inexistente"}
+
+        hoja = db.execute(
+            select(AuditoriaNodoMerkle.checkpoint_id, AuditoriaNodoMerkle.posicion)
+            .where(AuditoriaNodoMerkle.registro_id == registro_id, AuditoriaNodoMerkle.nivel == 0)
+        ).first()
+        if hoja is None:
+            return {"id": registro_id, "integro": None, "motivo": "todavía no cubierto por un checkpoint"}
+
+        checkpoint = db.get(AuditoriaCheckpoint, hoja.checkpoint_id)
+        if not self.firma_valida(checkpoint):
+            return {"id": registro_id, "integro": False, "motivo": "firma del checkpoint inválida",
+                    "checkpoint_id": checkpoint.id}
+
+        hash_calculado = calcular_hash_fila(fila, fila.hash_anterior)
+        if hash_calculado != fila.hash_integridad:
+            return {"id": registro_id, "integro": False, "motivo": "datos alterados",
+                    "checkpoint_id": checkpoint.id}
+
+        # Un hermano por nivel, en una sola consulta
+        tamanos = tamanos_niveles(checkpoint.registros)
+        claves = {}
+        posicion = hoja.posicion
+        for nivel, tamano in enumerate(tamanos):
+            hermano = posicion ^ 1
+            if hermano < tamano:
+                claves[nivel] = hermano
+            posicion //= 2
+
+        valores = {}
+        if claves:
+            for nodo in db.execute(
+                select(AuditoriaNodoMerkle.nivel, AuditoriaNodoMerkle.hash)
+                .where(AuditoriaNodoMerkle.checkpoint_id == checkpoint.id, or_(*(
+                    and_(AuditoriaNodoMerkle.nivel == nivel, AuditoriaNodoMerkle.posicion == hermano)
+                    for nivel, hermano in claves.items()
+                )))
+            ):
+                valores[nodo.nivel] = bytes.fromhex(nodo.hash)
+        hermanos = [valores.get(nivel) if nivel in claves else None for nivel in range(len(tamanos))]
+        if len(valores) != len(claves):
+            return {"id": registro_id, "integro": False, "motivo": "nodos Merkle faltantes",
+                    "checkpoint_id": checkpoint.id}
+
+        raiz = raiz_desde_prueba(hoja_merkle(fila.hash_integridad), hoja.posicion, hermanos)
+        integro = hmac.compare_digest(raiz.hex(), checkpoint.raiz_merkle)
+        return {
+            "id": registro_id,
+            "integro": integro,
+            "motivo": None if integro else "no coincide con la raíz Merkle firmada",
+            "checkpoint_id": checkpoint.id,
+            "niveles": len(tamanos)
+        }
+
+
+# Instancia global
+checkpoints_auditoria = CheckpointsAuditoria()
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Checkpoints y verificación incremental de la auditoría")
+    parser.add_argument("--registro", type=int, default=None, help="Comprobar solo este registro (O(log n))")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.registro is not None:
+            resultado = checkpoints_auditoria.comprobar_registro(db, args.registro)
+            icono = {True: "✅", False: "❌", None: "⏳"}[resultado["integro"]]
+            print(f"{icono} Registro {args.registro}: {resultado.get('motivo') or 'íntegro'}")
+        else:
+            print("🔗 Generando checkpoints pendientes...")
+            try:
+                resultado = checkpoints_auditoria.generar_pendientes(db)
+            except (CheckpointInvalido, ValueError) as e:
+                print(f"❌ {e}")
+                sys.exit(1)
+            print(f"   {resultado['checkpoints']} checkpoints nuevos (hasta id {resultado['ultimo_hasta_id']})")
+            integro, alterados = checkpoints_auditoria.verificar_desde_checkpoint(db)
+            for alterado in alterados:
+                print(f"   ❌ id {alterado['id']} ({alterado['fecha']})")
+            print(f"{'✅' if integro else '❌'} Registros posteriores al último checkpoint verificados")
+    finally:
+        db.close()
@@ -0,0 +1,270 @@
+"""
+Cola de group commit para los registros de auditoría
+
+Un registro que no se pudo escribir (BD caída, lote fallido) se guarda en un
+archivo JSONL de pendientes (AUDITORIA_PENDIENTES) con su fecha original y se
+reintenta periódicamente hasta que entra en la cadena.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from security.auditoria import (
+    AuditoriaMovimiento, CabezaCadena, cabeza_cadena, fecha_auditoria, preparar_registro
+)
+
+MAX_REGISTROS_POR_LOTE = 500
+INTERVALO_REINTENTO_SEGUNDOS = 60
+
+SQL_ID_USUARIO = text("SELECT id FROM usuarios WHERE username = :username")
+
+
+class ColaAuditoria:
+    """
+    Acumula los registros de auditoría que llegan dentro de una ventana de
+    pocos milisegundos, los encadena (hash_anterior -> hash_integridad) en el
+    orden de llegada y los confirma en una sola transacción.
+
+    `registrar` retorna recién cuando el lote de su registro quedó confirmado,
+    así la API solo responde un movimiento con su auditoría ya durable. El
+    costo del commit y de leer la cabeza de la cadena se reparte entre todos
+    los registros del lote.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable] = None,
+        cabeza: CabezaCadena = cabeza_cadena,
+        ventana_ms: float = 2.0,
+        max_lote: int = MAX_REGISTROS_POR_LOTE,
+        archivo_pendientes: Optional[str] = None
+    ):
+        self.session_factory = session_factory
+        self.cabeza = cabeza
+        self.ventana = ventana_ms / 1000
+        self.max_lote = max_lote
+        self.archivo_pendientes = archivo_pendientes or os.getenv(
+            "AUDITORIA_PENDIENTES", "auditoria_pendientes.jsonl"
+        )
+        self._lock_pendientes = threading.Lock()
+        self._tarea_reintentos: Optional[asyncio.Task] = None
+
+        self._pendientes: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._hay_pendientes: Optional[asyncio.Event] = None
+        self._lote_lleno: Optional[asyncio.Event] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._cerrando = False
+
+        # Métricas
+        self.lotes_escritos = 0
+        self.registros_escritos = 0
+        self.tiempo_escritura_total = 0.0
+        self.pendientes_guardados = 0
+        self.pendientes_reintentados = 0
+
+    async def registrar(self, usuario_id: int, usuario_nombre: str, accion: str,
+                        tipo_entidad: str, entidad_id: str, **kwargs) -> AuditoriaMovimiento:
+        """
+        Encola el registro y espera a que su lote quede confirmado
+
+        Acepta los mismos parámetros que ServicioAuditoria.registrar_movimiento
+        """
+        if self._tarea is None or self._cerrando:
+            raise RuntimeError("La cola de auditoría no está iniciada")
+
+        datos = preparar_registro(usuario_id, usuario_nombre, accion, tipo_entidad, entidad_id, **kwargs)
+        future = asyncio.get_running_loop().create_future()
+        self._pendientes.append((datos, future))
+
+        self._hay_pendientes.set()
+        if len(self._pendientes) >= self.max_lote:
+            self._lote_lleno.set()
+
+        return await future
+
+    def obtener_estadisticas(self) -> dict:
+        return {
+            "lotes_escritos": self.lotes_escritos,
+            "registros_escritos": self.registros_escritos,
+            "promedio_por_lote": (
+                self.registros_escritos / self.lotes_escritos if self.lotes_escritos else 0
+            ),
+            "ms_promedio_por_registro": (
+                self.tiempo_escritura_total * 1000 / self.registros_escritos if self.registros_escritos else 0
+            ),
+            "pendientes": len(self._pendientes),
+            "pendientes_guardados": self.pendientes_guardados,
+            "pendientes_reintentados": self.pendientes_reintentados,
+            "ultimo_id": self.cabeza.id
+        }
+
+    # ---------------------------------------------
+    # Registros pendientes (no se pudieron escribir)
+    # ---------------------------------------------
+    def _anexar_pendientes(self, lineas: List[str]):
+        with self._lock_pendientes:
+            with open(self.archivo_pendientes, "a", encoding="utf-8") as f:
+                f.writelines(lineas)
+                f.flush()
+                os.fsync(f.fileno())
+
+    async def guardar_pendiente(self, usuario_id: Optional[int], usuario_nombre: str, accion: str,
+                                tipo_entidad: str, entidad_id: str, **kwargs):
+        """
+        Guarda (con fsync) un registro que no se pudo auditar para reintentarlo
+        Sin usuario_id se resuelve por usuario_nombre al reintentar
+        """
+        pendiente = {
+            "fecha_hora": datetime.utcnow().isoformat(),
+            "usuario_id": usuario_id,
+            "usuario_nombre": usuario_nombre,
+            "accion": accion,
+            "tipo_entidad": tipo_entidad,
+            "entidad_id": entidad_id,
+            **kwargs
+        }
+        linea = json.dumps(pendiente, default=str) + "\n"
+        await asyncio.get_running_loop().run_in_executor(None, self._anexar_pendientes, [linea])
+        self.pendientes_guardados += 1
+
+    def _reintentar(self) -> int:
+        """Escribe los registros pendientes en un solo lote; si falla vuelven al archivo"""
+        # El renombrado reclama el archivo: con varios workers solo uno lo procesa
+        en_proceso = f"{self.archivo_pendientes}.{os.getpid()}"
+        with self._lock_pendientes:
+            try:
+                os.replace(self.archivo_pendientes, en_proceso)
+            except FileNotFoundError:
+                return 0
+        with open(en_proceso, encoding="utf-8") as f:
+            lineas = [linea for linea in f if linea.strip()]
+
+        db = self.session_factory(expire_on_commit=False)
+        try:
+            registros = []
+            for linea in lineas:
+                pendiente = json.loads(linea)
+                fecha = datetime.fromisoformat(pendiente.pop("fecha_hora"))
+                if pendiente["usuario_id"] is None:
+                    pendiente["usuario_id"] = db.execute(
+                        SQL_ID_USUARIO, {"username": pendiente["usuario_nombre"]}
+                    ).scalar_one()
+                datos = preparar_registro(**pendiente)
+                datos["fecha_hora"] = fecha_auditoria(fecha)
+                registros.append(datos)
+            self.cabeza.escribir_lote(db, registros)
+        except Exception:
+            db.rollback()
+            self._anexar_pendientes(lineas)
+            os.remove(en_proceso)
+            raise
+        finally:
+            db.close()
+
+        os.remove(en_proceso)
+        self.pendientes_reintentados += len(lineas)
+        return len(lineas)
+
+    async def _bucle_reintentos(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                reintentados = await loop.run_in_executor(None, self._reintentar)
+                if reintentados:
+                    print(f"✅ {reintentados} registros de auditoría pendientes escritos")
+            except Exception as e:
+                print(f"Error reintentando auditoría pendiente ({self.archivo_pendientes}): {e}")
+            await asyncio.sleep(INTERVALO_REINTENTO_SEGUNDOS)
+
+    # ---------------------------------------------
+    # Ciclo de vida (startup/shutdown de FastAPI)
+    # ---------------------------------------------
+    async def iniciar(self, session_factory: Optional[Callable] = None):
+        if session_factory is not None:
+            self.session_factory = session_factory
+        self._hay_pendientes = asyncio.Event()
+        self._lote_lleno = asyncio.Event()
+        self._cerrando = False
+        self._tarea = asyncio.create_task(self._bucle_escritura())
+        self._tarea_reintentos = asyncio.create_task(self._bucle_reintentos())
+
+    async def detener(self):
+        """Detiene la cola después de escribir lo que quede pendiente"""
+        if self._tarea_reintentos is not None:
+            self._tarea_reintentos.cancel()
+            try:
+                await self._tarea_reintentos
+            except asyncio.CancelledError:
+                pass
+            self._tarea_reintentos = None
+        if self._tarea is None:
+            return
+        self._cerrando = True
+        self._hay_pendientes.set()
+        self._lote_lleno.set()
+        await self._tarea
+        self._tarea = None
+
+    async def _bucle_escritura(self):
+        while True:
+            await self._hay_pendientes.wait()
+            if self._cerrando and not self._pendientes:
+                return
+
+            # Ventana de agrupación: esperar más registros o hasta llenar el lote
+            if len(self._pendientes) < self.max_lote:
+                try:
+                    await asyncio.wait_for(self._lote_lleno.wait(), timeout=self.ventana)
+                except asyncio.TimeoutError:
+                    pass
+
+            await self._escribir_lote()
+
+            if not self._pendientes and not self._cerrando:
+                self._hay_pendientes.clear()
+            if len(self._pendientes) < self.max_lote and not self._cerrando:
+                self._lote_lleno.clear()
+
+    def _escribir(self, registros: List[Dict[str, Any]]) -> List[AuditoriaMovimiento]:
+        # expire_on_commit=False: las filas se entregan a los llamadores ya cerrada la sesión
+        db = self.session_factory(expire_on_commit=False)
+        try:
+            return self.cabeza.escribir_lote(db, registros)
+        finally:
+            db.close()
+
+    async def _escribir_lote(self):
+        lote = self._pendientes[:self.max_lote]
+        self._pendientes = self._pendientes[self.max_lote:]
+        if not lote:
+            return
+
+        loop = asyncio.get_running_loop()
+        inicio = time.perf_counter()
+        try:
+            filas = await loop.run_in_executor(None, self._escribir, [datos for datos, _ in lote])
+        except Exception as e:
+            # Falló la transacción completa: ningún registro del lote quedó escrito
+            print(f"Error escribiendo lote de auditoría: {e}")
+            for _, future in lote:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.lotes_escritos += 1
+        self.registros_escritos += len(lote)
+        self.tiempo_escritura_total += time.perf_counter() - inicio
+
+        for (_, future), fila in zip(lote, filas):
+            if not future.done():
+                future.set_result(fila)
+
+
+# Instancia global
+cola_auditoria = ColaAuditoria()
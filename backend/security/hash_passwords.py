@@ -0,0 +1,99 @@
+"""
+Hashing de contraseñas fuera del event loop
+
+bcrypt cuesta cientos de milisegundos de CPU por llamada. Ejecutarlo dentro
+de un endpoint async congela todo el worker, así que las llamadas se mandan a
+un pool de hilos dedicado (la librería bcrypt libera el GIL mientras calcula,
+así que los hilos sí corren en paralelo) con un límite de peticiones en
+espera: si se supera se rechaza con PoolHashingSaturado en lugar de acumular
+logins que igual van a expirar.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+
+class PoolHashingSaturado(Exception):
+    """Demasiadas operaciones de hashing en espera"""
+    pass
+
+
+class PoolHashing:
+    def __init__(self, contexto: CryptContext, max_hilos: int = 2, max_pendientes: int = 64):
+        self.contexto = contexto
+        self.max_hilos = max_hilos
+        self.max_pendientes = max_pendientes
+        self._executor = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="bcrypt")
+
+        # Contadores (solo se modifican desde el event loop)
+        self.pendientes = 0
+        self.max_pendientes_observado = 0
+        self.completadas = 0
+        self.rechazadas = 0
+        self.rehashes = 0
+        self.espera_total = 0.0
+        self.calculo_total = 0.0
+
+    async def _ejecutar(self, funcion, *args):
+        if self.pendientes >= self.max_pendientes:
+            self.rechazadas += 1
+            raise PoolHashingSaturado(
+                f"Hay {self.pendientes} operaciones de contraseña en espera"
+            )
+
+        self.pendientes += 1
+        self.max_pendientes_observado = max(self.max_pendientes_observado, self.pendientes)
+        encolado = time.perf_counter()
+
+        def medir():
+            inicio = time.perf_counter()
+            resultado = funcion(*args)
+            return resultado, inicio, time.perf_counter()
+
+        try:
+            loop = asyncio.get_running_loop()
+            resultado, inicio, fin = await loop.run_in_executor(self._executor, medir)
+        finally:
+            self.pendientes -= 1
+
+        self.completadas += 1
+        self.espera_total += inicio - encolado
+        self.calculo_total += fin - inicio
+        return resultado
+
+    async def verificar(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verifica la contraseña y, si el hash usa un costo o esquema obsoleto,
+        retorna también el hash recalculado con la configuración vigente
+
+        Returns:
+            (es_valida, nuevo_hash o None)
+        """
+        valida, nuevo_hash = await self._ejecutar(
+            self.contexto.verify_and_update, password, hashed_password
+        )
+        if valida and nuevo_hash:
+            self.rehashes += 1
+        return valida, nuevo_hash
+
+    async def hash(self, password: str) -> str:
+        return await self._ejecutar(self.contexto.hash, password)
+
+    def obtener_estadisticas(self) -> dict:
+        return {
+            'hilos': self.max_hilos,
+            'pendientes': self.pendientes,
+            'max_pendientes': self.max_pendientes,
+            'max_pendientes_observado': self.max_pendientes_observado,
+            'completadas': self.completadas,
+            'rechazadas': self.rechazadas,
+            'rehashes': self.rehashes,
+            'espera_media_ms': round(self.espera_total / self.completadas * 1000, 2) if self.completadas else 0.0,
+            'calculo_medio_ms': round(self.calculo_total / self.completadas * 1000, 2) if self.completadas else 0.0
+        }
+
+    def cerrar(self):
+        self._executor.shutdown(wait=True)
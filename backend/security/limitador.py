@@ -0,0 +1,148 @@
+"""
+Rate limiting por IP con token bucket
+
+Cada cliente (IP + grupo de ruta) tiene un balde de `por_minuto` fichas que
+se rellena de forma continua. Consumir una ficha es O(1) en tiempo y cada
+cliente ocupa memoria constante (fichas + último acceso). Los baldes quedan
+ordenados por último uso, así que expulsar clientes inactivos solo recorre
+los que efectivamente se expulsan.
+
+Los límites por ruta se resuelven por prefijo más largo, p. ej.:
+    /api/scanner/escanear -> 600/min sin bloqueo
+    /api/auth/login       -> 10/min con bloqueo de 15 minutos
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+class LimiteRuta:
+    __slots__ = ("prefijo", "por_minuto", "bloqueo_segundos", "tasa")
+
+    def __init__(self, prefijo: str, por_minuto: int, bloqueo_segundos: float = 0):
+        self.prefijo = prefijo
+        self.por_minuto = por_minuto
+        self.bloqueo_segundos = bloqueo_segundos
+        self.tasa = por_minuto / 60.0  # fichas por segundo
+
+
+class LimitadorTokens:
+    def __init__(
+        self,
+        por_minuto: int = 100,
+        bloqueo_segundos: float = 900,
+        limites_ruta: Optional[List[LimiteRuta]] = None,
+        max_clientes: int = 200000,
+        intervalo_limpieza: float = 30
+    ):
+        self.limite_defecto = LimiteRuta("", por_minuto, bloqueo_segundos)
+        # Prefijos más largos primero
+        self.limites_ruta = sorted(limites_ruta or [], key=lambda l: len(l.prefijo), reverse=True)
+        self._por_ruta: Dict[str, LimiteRuta] = {}
+        self.max_clientes = max_clientes
+        self.intervalo_limpieza = intervalo_limpieza
+
+        # (grupo, ip) -> [fichas, último acceso, bloqueado hasta, límite]
+        self._baldes: "OrderedDict[Tuple[str, str], list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ultima_limpieza = time.monotonic()
+
+        self.permitidas = 0
+        self.rechazadas = 0
+        self.expulsados = 0
+
+    def limite_para(self, ruta: str) -> LimiteRuta:
+        """Límite aplicable a una ruta (memorizado por ruta exacta)"""
+        limite = self._por_ruta.get(ruta)
+        if limite is None:
+            limite = next((l for l in self.limites_ruta if ruta.startswith(l.prefijo)), self.limite_defecto)
+            if len(self._por_ruta) < 10000:
+                self._por_ruta[ruta] = limite
+        return limite
+
+    def consumir(self, ip: str, ruta: str) -> Tuple[bool, float]:
+        """
+        Consume una ficha del cliente para la ruta
+
+        Returns:
+            (permitida, segundos sugeridos para reintentar si fue rechazada)
+        """
+        limite = self.limite_para(ruta)
+        ahora = time.monotonic()
+        clave = (limite.prefijo, ip)
+
+        with self._lock:
+            balde = self._baldes.get(clave)
+            if balde is None:
+                balde = [float(limite.por_minuto), ahora, 0.0, limite]
+                self._baldes[clave] = balde
+            else:
+                self._baldes.move_to_end(clave)
+                if balde[2] > ahora:
+                    self.rechazadas += 1
+                    return False, balde[2] - ahora
+                balde[0] = min(limite.por_minuto, balde[0] + (ahora - balde[1]) * limite.tasa)
+                balde[1] = ahora
+
+            if balde[0] >= 1:
+                balde[0] -= 1
+                self.permitidas += 1
+                permitida, reintentar = True, 0.0
+            else:
+                self.rechazadas += 1
+                permitida = False
+                if limite.bloqueo_segundos:
+                    balde[2] = ahora + limite.bloqueo_segundos
+                    reintentar = limite.bloqueo_segundos
+                else:
+                    reintentar = (1 - balde[0]) / limite.tasa if limite.tasa else 60.0
+
+            if len(self._baldes) > self.max_clientes or ahora - self._ultima_limpieza >= self.intervalo_limpieza:
+                self._limpiar(ahora)
+
+        return permitida, reintentar
+
+    def _limpiar(self, ahora: float):
+        """
+        Expulsa clientes inactivos (con el lock tomado). Un balde que ya se
+        habría rellenado por completo y no está bloqueado equivale a no tenerlo.
+        """
+        self._ultima_limpieza = ahora
+        for _ in range(len(self._baldes)):
+            clave, (fichas, ultimo, bloqueado_hasta, limite) = next(iter(self._baldes.items()))
+            if len(self._baldes) > self.max_clientes:
+                self._baldes.popitem(last=False)
+                self.expulsados += 1
+            elif bloqueado_hasta > ahora:
+                # Sigue bloqueado: se conserva sin frenar la limpieza de los que vienen detrás
+                self._baldes.move_to_end(clave)
+            elif limite.por_minuto == 0 or ahora - ultimo >= 60.0 * (1 - fichas / limite.por_minuto):
+                self._baldes.popitem(last=False)
+                self.expulsados += 1
+            else:
+                break
+
+    def obtener_estadisticas(self) -> dict:
+        return {
+            'clientes': len(self._baldes),
+            'permitidas': self.permitidas,
+            'rechazadas': self.rechazadas,
+            'expulsados': self.expulsados,
+            'limites': {l.prefijo or '*': l.por_minuto for l in self.limites_ruta + [self.limite_defecto]}
+        }
+
+
+def limites_desde_entorno() -> List[LimiteRuta]:
+    """
+    RATE_LIMITS_RUTAS=/api/scanner/escanear=600:0,/api/auth/login=10:900
+    (prefijo=peticiones_por_minuto[:segundos_de_bloqueo])
+    """
+    configurados = os.getenv("RATE_LIMITS_RUTAS", "")
+    limites = []
+    for entrada in filter(None, (e.strip() for e in configurados.split(","))):
+        prefijo, _, valor = entrada.partition("=")
+        por_minuto, _, bloqueo = valor.partition(":")
+        limites.append(LimiteRuta(prefijo, int(por_minuto), float(bloqueo or 0)))
+    return limites
@@ -1,106 +1,125 @@
 """
 Middleware de Seguridad y Rate Limiting
 """
-from fastapi import Request, HTTPException, status
+from fastapi import status
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from datetime import datetime, timedelta
-from collections import defaultdict
-from typing import Dict, Tuple
+from typing import List, Optional, Tuple
+import os
 import time
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
+from security.almacen_intentos import AlmacenIntentos, AlmacenMemoria, AlmacenSQLite
+from security.limitador import LimitadorTokens, LimiteRuta, limites_desde_entorno
+
+class RateLimitMiddleware:
     """
     Middleware para limitar requests por IP
     Previene ataques de fuerza bruta y DDoS
+    
+    Token bucket O(1) por IP y grupo de ruta (ver security/limitador.py);
+    límites por ruta con RATE_LIMITS_RUTAS o el parámetro limites_ruta.
+    
+    Middleware ASGI puro: una petición rechazada se responde antes de llegar
+    a la aplicación y una aceptada pasa sin tareas ni buffers intermedios.
     """
     
-    def __init__(self, app, requests_per_minute: int = 100):
-        super().__init__(app)
+    def __init__(
+        self,
+        app,
+        requests_per_minute: int = 100,
+        limites_ruta: Optional[List[LimiteRuta]] = None,
+        bloqueo_segundos: float = 900
+    ):
+        self.app = app
         self.requests_per_minute = requests_per_minute
-        self.requests: Dict[str, list] = defaultdict(list)
-        self.blocked_ips: Dict[str, datetime] = {}
+        self.limitador = LimitadorTokens(
+            por_minuto=requests_per_minute,
+            bloqueo_segundos=bloqueo_segundos,
+            limites_ruta=limites_ruta if limites_ruta is not None else limites_desde_entorno()
+        )
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
         # Obtener IP del cliente
-        client_ip = request.client.host
-        
-        # Verificar si la IP está bloqueada
-        if client_ip in self.blocked_ips:
-            tiempo_bloqueo = self.blocked_ips[client_ip]
-            if datetime.now() < tiempo_bloqueo:
-                return JSONResponse(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    content={
-                        "detail": "IP bloqueada temporalmente por exceso de peticiones",
-                        "retry_after": (tiempo_bloqueo - datetime.now()).seconds
-                    }
-                )
-            else:
-                # Desbloquear IP
-                del self.blocked_ips[client_ip]
-        
-        # Obtener timestamp actual
-        now = time.time()
-        minute_ago = now - 60
-        
-        # Limpiar requests antiguos
-        self.requests[client_ip] = [
-            req_time for req_time in self.requests[client_ip]
-            if req_time > minute_ago
-        ]
-        
-        # Verificar límite
-        if len(self.requests[client_ip]) >= self.requests_per_minute:
-            # Bloquear IP por 15 minutos
-            self.blocked_ips[client_ip] = datetime.now() + timedelta(minutes=15)
-            
-            return JSONResponse(
+        cliente = scope.get("client")
+        client_ip = cliente[0] if cliente else "desconocida"
+        ruta = scope["path"]
+        
+        permitida, reintentar = self.limitador.consumir(client_ip, ruta)
+        if not permitida:
+            limite = self.limitador.limite_para(ruta)
+            respuesta = JSONResponse(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 content={
-                    "detail": f"Límite de {self.requests_per_minute} requests por minuto excedido",
-                    "retry_after": 900  # 15 minutos
-                }
+                    "detail": f"Límite de {limite.por_minuto} requests por minuto excedido",
+                    "retry_after": int(reintentar) + 1
+                },
+                headers={"Retry-After": str(int(reintentar) + 1)}
             )
-        
-        # Registrar request
-        self.requests[client_ip].append(now)
+            await respuesta(scope, receive, send)
+            return
         
         # Continuar con la petición
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
+
+
+# Headers de seguridad recomendados (codificados una sola vez)
+SECURITY_HEADERS = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+    (b"referrer-policy", b"strict-origin-when-cross-origin"),
+    (b"permissions-policy", b"geolocation=(), microphone=(), camera=()"),
+]
 
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
+class SecurityHeadersMiddleware:
     """
     Middleware para agregar headers de seguridad
+    
+    Middleware ASGI puro: agrega los headers en el mensaje http.response.start
+    y deja pasar el cuerpo tal cual, así las respuestas en streaming siguen
+    saliendo por partes.
     """
     
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
+    def __init__(self, app, headers: Optional[List[Tuple[bytes, bytes]]] = None):
+        self.app = app
+        self.headers = list(headers or SECURITY_HEADERS)
+        self._nombres = {nombre for nombre, _ in self.headers}
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # Headers de seguridad recomendados
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
+        async def send_con_headers(message):
+            if message["type"] == "http.response.start":
+                # Los headers de seguridad reemplazan a los que haya puesto la aplicación
+                headers = [h for h in message.get("headers", []) if h[0].lower() not in self._nombres]
+                headers.extend(self.headers)
+                message["headers"] = headers
+            await send(message)
         
-        return response
+        await self.app(scope, receive, send_con_headers)
 
 
 class LoginAttemptTracker:
     """
     Rastrea intentos de login fallidos
     Bloquea cuentas después de múltiples intentos
+    
+    El estado vive en un AlmacenIntentos (ver security/almacen_intentos.py):
+    en memoria por proceso, o SQLite compartido entre workers con
+    LOGIN_TRACKER_BACKEND=sqlite.
     """
     
-    def __init__(self):
-        self.intentos: Dict[str, list] = defaultdict(list)
-        self.cuentas_bloqueadas: Dict[str, datetime] = {}
-        self.max_intentos = 5
-        self.tiempo_bloqueo_minutos = 30
+    def __init__(self, almacen: Optional[AlmacenIntentos] = None):
+        self.almacen = almacen or AlmacenMemoria()
+        self.max_intentos = int(os.getenv("MAX_LOGIN_ATTEMPTS", "5"))
+        self.tiempo_bloqueo_minutos = int(os.getenv("LOCKOUT_DURATION_MINUTES", "30"))
     
     def registrar_intento_fallido(self, username: str) -> Tuple[bool, int, int]:
         """
@@ -108,33 +127,18 @@ class LoginAttemptTracker:
         Retorna (esta_bloqueado, intentos_restantes, minutos_bloqueo)
         """
         # Verificar si ya está bloqueado
-        if username in self.cuentas_bloqueadas:
-            tiempo_desbloqueo = self.cuentas_bloqueadas[username]
-            if datetime.now() < tiempo_desbloqueo:
-                minutos_restantes = int((tiempo_desbloqueo - datetime.now()).seconds / 60)
-                return True, 0, minutos_restantes
-            else:
-                # Desbloquear cuenta
-                del self.cuentas_bloqueadas[username]
-                self.intentos[username] = []
-        
-        # Registrar intento
-        now = datetime.now()
-        self.intentos[username].append(now)
-        
-        # Limpiar intentos antiguos (mayores a 1 hora)
-        hora_atras = now - timedelta(hours=1)
-        self.intentos[username] = [
-            intento for intento in self.intentos[username]
-            if intento > hora_atras
-        ]
+        bloqueado, minutos_restantes = self.esta_bloqueado(username)
+        if bloqueado:
+            return True, 0, minutos_restantes
+        
+        # Registrar intento y contar los de la última hora
+        ahora = time.time()
+        intentos_recientes = self.almacen.registrar_fallo(username, ahora)
         
         # Verificar si se alcanzó el límite
-        intentos_recientes = len(self.intentos[username])
         if intentos_recientes >= self.max_intentos:
             # Bloquear cuenta
-            tiempo_bloqueo = now + timedelta(minutes=self.tiempo_bloqueo_minutos)
-            self.cuentas_bloqueadas[username] = tiempo_bloqueo
+            self.almacen.bloquear(username, ahora + self.tiempo_bloqueo_minutos * 60)
             return True, 0, self.tiempo_bloqueo_minutos
         
         intentos_restantes = self.max_intentos - intentos_recientes
@@ -142,27 +146,39 @@ class LoginAttemptTracker:
     
     def registrar_intento_exitoso(self, username: str):
         """Limpia intentos fallidos después de login exitoso"""
-        if username in self.intentos:
-            del self.intentos[username]
-        if username in self.cuentas_bloqueadas:
-            del self.cuentas_bloqueadas[username]
+        self.almacen.limpiar(username)
     
     def esta_bloqueado(self, username: str) -> Tuple[bool, int]:
         """
         Verifica si una cuenta está bloqueada
         Retorna (esta_bloqueado, minutos_restantes)
         """
-        if username in self.cuentas_bloqueadas:
-            tiempo_desbloqueo = self.cuentas_bloqueadas[username]
-            if datetime.now() < tiempo_desbloqueo:
-                minutos_restantes = int((tiempo_desbloqueo - datetime.now()).seconds / 60)
-                return True, minutos_restantes
-            else:
-                del self.cuentas_bloqueadas[username]
+        hasta = self.almacen.bloqueado_hasta(username)
+        if hasta is not None:
+            ahora = time.time()
+            if ahora < hasta:
+                return True, int((hasta - ahora) / 60)
+            # Bloqueo vencido: la cuenta empieza de cero
+            self.almacen.limpiar(username)
         
         return False, 0
 
 
+def crear_almacen_intentos() -> AlmacenIntentos:
+    """
+    Almacén de intentos según LOGIN_TRACKER_BACKEND (memoria | sqlite)
+    Por defecto sqlite con varios workers (WEB_CONCURRENCY > 1): en memoria
+    cada worker contaría sus propios intentos
+    """
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    backend = os.getenv("LOGIN_TRACKER_BACKEND", "sqlite" if workers > 1 else "memoria")
+    if backend == "sqlite":
+        return AlmacenSQLite(os.getenv("LOGIN_TRACKER_SQLITE", "login_intentos.db"))
+    if backend != "memoria":
+        raise ValueError(f"LOGIN_TRACKER_BACKEND desconocido: {backend}")
+    return AlmacenMemoria()
+
+
 class InputValidator:
     """
     Validador de inputs para prevenir inyecciones SQL y XSS
@@ -240,5 +256,5 @@ class InputValidator:
 
 
 # Instancias globales
-login_tracker = LoginAttemptTracker()
+login_tracker = LoginAttemptTracker(crear_almacen_intentos())
 input_validator = InputValidator()
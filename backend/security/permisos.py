@@ -0,0 +1,116 @@
+"""
+Modelo de permisos compilado a máscaras de bits
+
+Cada permiso recibe un bit y cada rol se precalcula como la OR de los bits de
+sus permisos, así que verificar un permiso es un AND entre dos enteros en
+lugar de recorrer una lista.
+
+Los bits de los permisos del catálogo fijo (clase Permiso) no cambian nunca:
+son los que viajan en el claim "perm" de los access tokens. Los permisos
+adicionales que aparezcan en la tabla roles_permisos reciben bits a
+continuación, solo válidos dentro del proceso.
+"""
+import asyncio
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+SQL_ROLES_PERMISOS = text("SELECT rol, permiso FROM roles_permisos WHERE activo = 1")
+
+
+class ModeloPermisos:
+    def __init__(self, catalogo: List[str], permisos_por_rol: Dict[str, List[str]]):
+        self.catalogo = list(catalogo)
+        # (bits por permiso, máscara por rol): una sola referencia inmutable
+        # que compilar reemplaza entera; cada lector toma una copia local y
+        # nunca combina bits de un modelo con máscaras de otro (los bits de
+        # los permisos adicionales se reasignan al recompilar)
+        self._modelo: Tuple[Dict[str, int], Dict[str, int]] = ({}, {})
+        self.mascara_catalogo = (1 << len(self.catalogo)) - 1
+        self._tarea: Optional[asyncio.Task] = None
+        self.compilar((rol, permiso) for rol, permisos in permisos_por_rol.items() for permiso in permisos)
+
+    def compilar(self, pares: Iterable[Tuple[str, str]]) -> bool:
+        """
+        Recalcula bits y máscaras desde pares (rol, permiso)
+        Retorna True si el resultado cambió respecto al modelo vigente
+        """
+        pares = list(pares)
+        bits = {permiso: 1 << i for i, permiso in enumerate(self.catalogo)}
+        for permiso in sorted({p for _, p in pares} - set(bits)):
+            bits[permiso] = 1 << len(bits)
+
+        mascaras: Dict[str, int] = {}
+        for rol, permiso in pares:
+            mascaras[rol] = mascaras.get(rol, 0) | bits[permiso]
+
+        cambio = (bits, mascaras) != self._modelo
+        # Una sola asignación: los lectores ven el modelo viejo o el nuevo completo
+        self._modelo = (bits, mascaras)
+        return cambio
+
+    # ---------------------------------------------
+    # Verificaciones
+    # ---------------------------------------------
+    def bit(self, permiso: str) -> int:
+        bits, _ = self._modelo
+        return bits.get(permiso, 0)
+
+    def mascara_rol(self, rol: Optional[str]) -> int:
+        _, mascaras = self._modelo
+        return mascaras.get(rol, 0)
+
+    def mascara_token(self, rol: Optional[str]) -> int:
+        """Máscara del rol restringida al catálogo fijo (bits estables entre procesos)"""
+        return self.mascara_rol(rol) & self.mascara_catalogo
+
+    def rol_tiene_permiso(self, rol: Optional[str], permiso: str) -> bool:
+        bits, mascaras = self._modelo
+        return bool(mascaras.get(rol, 0) & bits.get(permiso, 0))
+
+    def permisos_de_rol(self, rol: Optional[str]) -> List[str]:
+        bits, mascaras = self._modelo
+        mascara = mascaras.get(rol, 0)
+        return [permiso for permiso, bit in bits.items() if mascara & bit]
+
+    # ---------------------------------------------
+    # Carga desde roles_permisos con recarga en caliente
+    # ---------------------------------------------
+    def cargar_desde_bd(self, session_factory: Callable) -> bool:
+        """Compila el modelo desde roles_permisos; si la tabla está vacía se conserva el vigente"""
+        db = session_factory()
+        try:
+            pares = [(f.rol, f.permiso) for f in db.execute(SQL_ROLES_PERMISOS)]
+        finally:
+            db.close()
+
+        if not pares:
+            return False
+        return self.compilar(pares)
+
+    async def iniciar(self, session_factory: Callable, intervalo_recarga: float = 60.0):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.cargar_desde_bd, session_factory)
+        except Exception as e:
+            print(f"Error cargando roles_permisos, se usan los permisos por defecto: {e}")
+        self._tarea = asyncio.create_task(self._bucle_recarga(session_factory, intervalo_recarga))
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    async def _bucle_recarga(self, session_factory: Callable, intervalo: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                if await loop.run_in_executor(None, self.cargar_desde_bd, session_factory):
+                    print("🔑 Permisos por rol recargados desde roles_permisos")
+            except Exception as e:
+                print(f"Error recargando roles_permisos: {e}")
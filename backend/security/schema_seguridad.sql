@@ -74,7 +74,7 @@ IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'auditoria_movimientos')
 BEGIN
     CREATE TABLE auditoria_movimientos (
         id INT PRIMARY KEY IDENTITY(1,1),
-        fecha_hora DATETIME NOT NULL DEFAULT GETDATE(),
+        fecha_hora DATETIME2(3) NOT NULL DEFAULT SYSDATETIME(),
         usuario_id INT NOT NULL,
         usuario_nombre NVARCHAR(200),
         accion NVARCHAR(50) NOT NULL CHECK (accion IN ('ENTRADA', 'SALIDA', 'MODIFICACION', 'ELIMINACION', 'CONSULTA', 'LOGIN', 'LOGOUT')),
@@ -92,6 +92,7 @@ BEGIN
         aprobado_por INT NULL,
         hash_integridad NVARCHAR(64) NOT NULL, -- SHA256
         hash_anterior NVARCHAR(64) NOT NULL, -- Hash del registro anterior (blockchain-like)
+        version_hash SMALLINT NULL, -- NULL/1 = JSON, 2 = binario canónico
         FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
         FOREIGN KEY (aprobado_por) REFERENCES usuarios(id)
     );
@@ -110,6 +111,46 @@ BEGIN
 END
 GO
 
+-- Versión del hash de integridad (tablas creadas antes de la codificación binaria)
+IF COL_LENGTH('auditoria_movimientos', 'version_hash') IS NULL
+BEGIN
+    ALTER TABLE auditoria_movimientos ADD version_hash SMALLINT NULL;
+    PRINT 'Columna auditoria_movimientos.version_hash agregada';
+END
+GO
+
+-- fecha_hora en milisegundos exactos (tablas creadas con DATETIME, que redondea
+-- a 1/300 s): el hash se calcula sobre la fecha truncada a milisegundos y al
+-- releerla de la columna tiene que dar el mismo valor
+IF EXISTS (
+    SELECT * FROM sys.columns
+    WHERE object_id = OBJECT_ID('auditoria_movimientos')
+      AND name = 'fecha_hora' AND system_type_id = TYPE_ID('datetime')
+)
+BEGIN
+    -- El índice y el DEFAULT (sin nombre fijo) impiden cambiar el tipo
+    DECLARE @default_fecha SYSNAME = (
+        SELECT dc.name
+        FROM sys.default_constraints dc
+        JOIN sys.columns c ON c.object_id = dc.parent_object_id AND c.column_id = dc.parent_column_id
+        WHERE dc.parent_object_id = OBJECT_ID('auditoria_movimientos') AND c.name = 'fecha_hora'
+    );
+    IF @default_fecha IS NOT NULL
+    BEGIN
+        DECLARE @sql_default NVARCHAR(400) =
+            N'ALTER TABLE auditoria_movimientos DROP CONSTRAINT ' + QUOTENAME(@default_fecha);
+        EXEC sp_executesql @sql_default;
+    END
+    DROP INDEX IDX_auditoria_fecha ON auditoria_movimientos;
+    
+    ALTER TABLE auditoria_movimientos ALTER COLUMN fecha_hora DATETIME2(3) NOT NULL;
+    
+    ALTER TABLE auditoria_movimientos ADD DEFAULT SYSDATETIME() FOR fecha_hora;
+    CREATE INDEX IDX_auditoria_fecha ON auditoria_movimientos(fecha_hora DESC);
+    PRINT 'Columna auditoria_movimientos.fecha_hora migrada a DATETIME2(3)';
+END
+GO
+
 -- ==============================================
 -- TABLA: alertas_fraude
 -- Registra alertas de detección de fraudes
@@ -148,6 +189,124 @@ BEGIN
 END
 GO
 
+-- ==============================================
+-- TABLA: auditoria_checkpoints
+-- Checkpoints firmados de la cadena de auditoría (cabeza + raíz Merkle por bloque)
+-- ==============================================
+IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'auditoria_checkpoints')
+BEGIN
+    CREATE TABLE auditoria_checkpoints (
+        id INT PRIMARY KEY IDENTITY(1,1),
+        desde_id INT NOT NULL,
+        hasta_id INT NOT NULL,
+        registros INT NOT NULL,
+        hash_entrada NVARCHAR(64) NOT NULL, -- hash_anterior del primer registro del bloque
+        hash_cabeza NVARCHAR(64) NOT NULL, -- hash_integridad del último registro del bloque
+        raiz_merkle NVARCHAR(64) NOT NULL,
+        firma NVARCHAR(64) NOT NULL, -- HMAC-SHA256 de los campos anteriores
+        fecha_creacion DATETIME2 NOT NULL DEFAULT SYSDATETIME()
+    );
+    
+    CREATE UNIQUE INDEX IDX_checkpoints_hasta ON auditoria_checkpoints(hasta_id);
+    
+    PRINT 'Tabla auditoria_checkpoints creada exitosamente';
+END
+ELSE
+BEGIN
+    PRINT 'Tabla auditoria_checkpoints ya existe';
+END
+GO
+
+-- ==============================================
+-- TABLA: auditoria_merkle_nodos
+-- Nodos del árbol Merkle de cada checkpoint (nivel 0 = hojas, una por registro)
+-- ==============================================
+IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'auditoria_merkle_nodos')
+BEGIN
+    CREATE TABLE auditoria_merkle_nodos (
+        checkpoint_id INT NOT NULL,
+        nivel SMALLINT NOT NULL,
+        posicion INT NOT NULL,
+        hash NVARCHAR(64) NOT NULL,
+        registro_id INT NULL, -- solo en las hojas
+        PRIMARY KEY (checkpoint_id, nivel, posicion),
+        FOREIGN KEY (checkpoint_id) REFERENCES auditoria_checkpoints(id)
+    );
+    
+    -- Hoja de un registro para la comprobación puntual
+    CREATE INDEX IDX_merkle_registro ON auditoria_merkle_nodos(registro_id)
+        INCLUDE (checkpoint_id, posicion)
+        WHERE registro_id IS NOT NULL;
+    
+    PRINT 'Tabla auditoria_merkle_nodos creada exitosamente';
+END
+ELSE
+BEGIN
+    PRINT 'Tabla auditoria_merkle_nodos ya existe';
+END
+GO
+
+-- ==============================================
+-- TABLA: auditoria_archivos
+-- Meses de auditoría exportados a JSONL comprimido y quitados de la tabla caliente
+-- ==============================================
+IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'auditoria_archivos')
+BEGIN
+    CREATE TABLE auditoria_archivos (
+        id INT PRIMARY KEY IDENTITY(1,1),
+        mes NVARCHAR(7) NOT NULL UNIQUE, -- YYYY-MM
+        desde_id INT NOT NULL,
+        hasta_id INT NOT NULL,
+        registros INT NOT NULL,
+        fecha_desde DATETIME NOT NULL,
+        fecha_hasta DATETIME NOT NULL,
+        hash_entrada NVARCHAR(64) NOT NULL, -- hash_anterior del primer registro archivado
+        hash_cabeza NVARCHAR(64) NOT NULL, -- la tabla caliente continúa desde este hash
+        ruta NVARCHAR(500) NOT NULL,
+        sha256_archivo NVARCHAR(64) NOT NULL,
+        fecha_creacion DATETIME2 NOT NULL DEFAULT SYSDATETIME()
+    );
+    
+    CREATE UNIQUE INDEX IDX_archivos_hasta ON auditoria_archivos(hasta_id);
+    
+    PRINT 'Tabla auditoria_archivos creada exitosamente';
+END
+ELSE
+BEGIN
+    PRINT 'Tabla auditoria_archivos ya existe';
+END
+GO
+
+-- ==============================================
+-- TABLA: auditoria_indice_archivo
+-- Una fila por registro archivado: las consultas de historial abren solo
+-- los archivos que contienen la entidad o el usuario buscado
+-- ==============================================
+IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'auditoria_indice_archivo')
+BEGIN
+    CREATE TABLE auditoria_indice_archivo (
+        registro_id INT PRIMARY KEY, -- id original en auditoria_movimientos
+        archivo_id INT NOT NULL,
+        fecha_hora DATETIME2(3) NOT NULL,
+        usuario_id INT NOT NULL,
+        tipo_entidad NVARCHAR(50) NOT NULL,
+        entidad_id NVARCHAR(100),
+        FOREIGN KEY (archivo_id) REFERENCES auditoria_archivos(id)
+    );
+    
+    CREATE INDEX IDX_indice_archivo_entidad
+        ON auditoria_indice_archivo(tipo_entidad, entidad_id, fecha_hora DESC) INCLUDE (archivo_id);
+    CREATE INDEX IDX_indice_archivo_usuario
+        ON auditoria_indice_archivo(usuario_id, fecha_hora DESC) INCLUDE (archivo_id);
+    
+    PRINT 'Tabla auditoria_indice_archivo creada exitosamente';
+END
+ELSE
+BEGIN
+    PRINT 'Tabla auditoria_indice_archivo ya existe';
+END
+GO
+
 -- ==============================================
 -- TABLA: sesiones_activas
 -- Rastrea sesiones activas para control
@@ -180,6 +339,23 @@ BEGIN
 END
 GO
 
+-- Marca de revocación: los workers leen las sesiones revocadas desde su última
+-- marca de agua (ver security/sesiones.py)
+IF COL_LENGTH('sesiones_activas', 'fecha_revocacion') IS NULL
+BEGIN
+    ALTER TABLE sesiones_activas ADD fecha_revocacion DATETIME2 NULL;
+    PRINT 'Columna sesiones_activas.fecha_revocacion agregada';
+END
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IDX_sesiones_revocacion')
+BEGIN
+    CREATE INDEX IDX_sesiones_revocacion ON sesiones_activas(fecha_revocacion)
+        INCLUDE (token_sesion, fecha_expiracion)
+        WHERE fecha_revocacion IS NOT NULL;
+END
+GO
+
 -- ==============================================
 -- TABLA: configuracion_seguridad
 -- Configuraciones del sistema de seguridad
@@ -264,6 +440,14 @@ BEGIN
 END
 GO
 
+-- Marca de agua del detector de movimientos sospechosos (solo revisa ids posteriores)
+IF NOT EXISTS (SELECT * FROM configuracion_seguridad WHERE clave = 'auditoria_sospechosos_ultimo_id')
+BEGIN
+    INSERT INTO configuracion_seguridad (clave, valor, tipo, descripcion) VALUES
+    ('auditoria_sospechosos_ultimo_id', '0', 'int', 'Último id de auditoría revisado por el detector de movimientos sospechosos');
+END
+GO
+
 -- ==============================================
 -- CREAR USUARIO ADMINISTRADOR POR DEFECTO
 -- Password: Admin123!
@@ -279,6 +463,21 @@ BEGIN
 END
 GO
 
+-- ==============================================
+-- USUARIO DEL SISTEMA PARA MOVIMIENTOS SIN TOKEN
+-- Los movimientos de scanners sin sesión se auditan a su nombre (el
+-- usuario_movil que manda el cliente no está autenticado). Inactivo y con un
+-- hash que no corresponde a ninguna contraseña: no puede iniciar sesión
+-- ==============================================
+IF NOT EXISTS (SELECT * FROM usuarios WHERE username = 'dispositivo_no_verificado')
+BEGIN
+    INSERT INTO usuarios (username, email, hashed_password, nombre_completo, rol, activo) VALUES
+    ('dispositivo_no_verificado', 'dispositivo_no_verificado@inventarios.local', '$2b$12$rh2IdGa/03nOEvSSwkV8e.MuIMTRnLML4G27m2jMCYxTw5zDwTLz.', 'Dispositivo móvil no verificado', 'operador', 0);
+    
+    PRINT 'Usuario del sistema dispositivo_no_verificado creado';
+END
+GO
+
 -- ==============================================
 -- VISTAS ÚTILES
 -- ==============================================
@@ -0,0 +1,182 @@
+"""
+Registro de sesiones (sesiones_activas) con revocación cacheada en memoria
+
+Cada login crea una fila en sesiones_activas con un identificador de sesión
+aleatorio (sid) que viaja en el access token y en el refresh token. Verificar
+que una sesión no esté revocada es una búsqueda en un dict local: no hay
+consulta a la BD por request.
+
+Logout y desactivación marcan las filas con activa = 0 y fecha_revocacion.
+Cada worker consulta periódicamente las revocaciones posteriores a su marca
+de agua, así una revocación hecha en otro worker se aplica en segundos.
+"""
+import asyncio
+import secrets
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import func, text, update
+
+from models import SesionActiva
+
+# Las revocaciones se releen con este margen hacia atrás: una transacción que
+# tarda en confirmar puede quedar con fecha_revocacion anterior a la marca
+SOLAPE_MARCA = timedelta(seconds=5)
+
+SQL_REVOCADAS_VIGENTES = text("""
+SELECT token_sesion, fecha_expiracion, fecha_revocacion
+FROM sesiones_activas
+WHERE activa = 0 AND fecha_expiracion > SYSDATETIME()
+""")
+
+SQL_REVOCADAS_DESDE = text("""
+SELECT token_sesion, fecha_expiracion, fecha_revocacion
+FROM sesiones_activas
+WHERE fecha_revocacion > :marca
+""")
+
+
+class RegistroSesiones:
+    def __init__(self, session_factory: Optional[Callable] = None, intervalo_refresco: float = 2.0):
+        self.session_factory = session_factory
+        self.intervalo_refresco = intervalo_refresco
+
+        # sid -> fecha de expiración (para descartarlo cuando el token ya no sirva)
+        self.revocadas: Dict[str, datetime] = {}
+        self.marca_agua: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self._tarea: Optional[asyncio.Task] = None
+
+    # ---------------------------------------------
+    # Consultas (O(1), sin BD)
+    # ---------------------------------------------
+    def esta_revocada(self, sid: str) -> bool:
+        return sid in self.revocadas
+
+    # ---------------------------------------------
+    # Escrituras (AsyncSession de la petición)
+    # ---------------------------------------------
+    async def crear_sesion(
+        self,
+        db,
+        usuario_id: int,
+        expira: datetime,
+        ip_address: Optional[str] = None,
+        dispositivo: Optional[str] = None
+    ) -> str:
+        """Registra la sesión y retorna su sid (hace commit)"""
+        sid = secrets.token_urlsafe(24)
+        db.add(SesionActiva(
+            usuario_id=usuario_id,
+            token_sesion=sid,
+            fecha_expiracion=expira,
+            ip_address=ip_address,
+            dispositivo=(dispositivo or "")[:200] or None,
+            activa=True
+        ))
+        await db.commit()
+        return sid
+
+    async def _revocar_donde(self, db, *condiciones) -> int:
+        # fecha_revocacion con el reloj de la BD: es la referencia de las marcas de agua
+        filas = (await db.execute(
+            update(SesionActiva)
+            .where(SesionActiva.activa == True, *condiciones)
+            .values(activa=False, fecha_revocacion=func.sysdatetime())
+            .returning(SesionActiva.token_sesion, SesionActiva.fecha_expiracion)
+        )).all()
+        await db.commit()
+        # En este worker aplica de inmediato, sin esperar al refresco
+        with self._lock:
+            for fila in filas:
+                self.revocadas[fila.token_sesion] = fila.fecha_expiracion
+        return len(filas)
+
+    async def revocar(self, db, sid: str):
+        """Revoca una sesión (logout)"""
+        await self._revocar_donde(db, SesionActiva.token_sesion == sid)
+
+    async def revocar_usuario(self, db, usuario_id: int, excepto_sid: Optional[str] = None) -> int:
+        """Revoca las sesiones activas de un usuario (opcionalmente salvo la actual)"""
+        condiciones = [SesionActiva.usuario_id == usuario_id]
+        if excepto_sid:
+            condiciones.append(SesionActiva.token_sesion != excepto_sid)
+        return await self._revocar_donde(db, *condiciones)
+
+    # ---------------------------------------------
+    # Sincronización entre workers
+    # ---------------------------------------------
+    def cargar(self):
+        """Carga inicial: sesiones revocadas cuyo token todavía no expiró"""
+        db = self.session_factory()
+        try:
+            ahora_bd = db.execute(text("SELECT SYSDATETIME()")).scalar()
+            filas = db.execute(SQL_REVOCADAS_VIGENTES).all()
+        finally:
+            db.close()
+        self._aplicar(filas, marca_inicial=ahora_bd)
+
+    def refrescar(self) -> int:
+        """Aplica las revocaciones nuevas desde la marca de agua"""
+        if self.marca_agua is None:
+            self.cargar()
+            return len(self.revocadas)
+
+        db = self.session_factory()
+        try:
+            filas = db.execute(SQL_REVOCADAS_DESDE, {"marca": self.marca_agua - SOLAPE_MARCA}).all()
+        finally:
+            db.close()
+        self._aplicar(filas)
+        return len(filas)
+
+    def _aplicar(self, filas, marca_inicial: Optional[datetime] = None):
+        """Incorpora filas revocadas; con marca_inicial reemplaza el conjunto completo"""
+        ahora = datetime.now()
+        with self._lock:
+            revocadas = {} if marca_inicial is not None else self.revocadas
+            marca = marca_inicial or self.marca_agua
+            for fila in filas:
+                revocadas[fila.token_sesion] = fila.fecha_expiracion
+                if fila.fecha_revocacion is not None and (marca is None or fila.fecha_revocacion > marca):
+                    marca = fila.fecha_revocacion
+
+            # Un sid cuyo refresh token ya expiró no necesita seguir en memoria
+            for sid in [s for s, expira in revocadas.items() if expira <= ahora]:
+                del revocadas[sid]
+
+            self.revocadas = revocadas
+            self.marca_agua = marca
+
+    async def iniciar(self, session_factory: Optional[Callable] = None):
+        if session_factory is not None:
+            self.session_factory = session_factory
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.cargar)
+        except Exception as e:
+            print(f"Error cargando sesiones revocadas: {e}")
+        self._tarea = asyncio.create_task(self._bucle_refresco())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    async def _bucle_refresco(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.intervalo_refresco)
+            try:
+                await loop.run_in_executor(None, self.refrescar)
+            except Exception as e:
+                print(f"Error refrescando sesiones revocadas: {e}")
+
+
+# Instancia global
+registro_sesiones = RegistroSesiones()
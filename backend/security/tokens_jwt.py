@@ -0,0 +1,227 @@
+"""
+Backends de firma/verificación JWT (HS256) con rotación de claves por `kid`
+
+- BackendHMAC: implementación directa con hmac/hashlib de la librería estándar
+  (sin la capa genérica de python-jose; ver benchmarks/bench_jwt.py)
+- BackendJose: python-jose, el comportamiento original
+
+Ambos producen tokens HS256 estándar e intercambiables. Cada token lleva en el
+header el `kid` de la clave con que se firmó; al verificar se elige la clave
+por ese `kid`, así que se puede activar una clave nueva y seguir aceptando los
+tokens firmados con la anterior hasta que expiren (sin logout masivo).
+
+Configuración por variables de entorno:
+    JWT_BACKEND=hmac|jose
+    JWT_CLAVES=2025a:clave_vieja,2025b:clave_nueva
+    JWT_KID_ACTIVO=2025b
+    JWT_KID_LEGADO=2025a
+Sin JWT_CLAVES se usa una sola clave (JWT_SECRET_KEY o la clave por defecto)
+con kid "principal".
+
+Los tokens sin kid y los firmados con kid "principal" (todos los emitidos con
+la configuración por defecto) se verifican con la clave de JWT_KID_LEGADO. Si
+no se indica, la clave anterior (JWT_SECRET_KEY o la clave por defecto) se
+conserva bajo "principal", así que pasar a JWT_CLAVES no invalida sesiones.
+
+Rotación desde la configuración por defecto:
+    1. JWT_CLAVES=2025b:CLAVE_NUEVA y JWT_KID_ACTIVO=2025b, sin tocar
+       JWT_SECRET_KEY: los tokens nuevos llevan kid 2025b y los viejos siguen
+       validándose con JWT_SECRET_KEY bajo "principal".
+    2. Pasados REFRESH_TOKEN_EXPIRE_DAYS ya no quedan tokens "principal"
+       vigentes: JWT_KID_LEGADO=2025b deja de aceptar la clave anterior.
+Rotaciones siguientes: agregar la clave nueva a JWT_CLAVES, moverle
+JWT_KID_ACTIVO y quitar la más vieja cuando expiren sus refresh tokens.
+"""
+import abc
+import base64
+import calendar
+import hashlib
+import hmac
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+ALGORITMO = "HS256"
+KID_PRINCIPAL = "principal"
+
+
+class TokenInvalido(Exception):
+    """Firma, formato, clave o expiración inválidos"""
+    pass
+
+
+def _b64url(datos: bytes) -> str:
+    return base64.urlsafe_b64encode(datos).rstrip(b"=").decode("ascii")
+
+
+def _b64url_decodificar(texto: str) -> bytes:
+    try:
+        return base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+    except (ValueError, TypeError):
+        raise TokenInvalido("Segmento base64 inválido")
+
+
+def _normalizar_claims(payload: dict) -> dict:
+    """Convierte datetime a timestamp Unix (igual que python-jose)"""
+    claims = dict(payload)
+    for claim in ("exp", "iat", "nbf"):
+        if isinstance(claims.get(claim), datetime):
+            claims[claim] = calendar.timegm(claims[claim].utctimetuple())
+    return claims
+
+
+class AnilloClaves:
+    """Claves HMAC activas indexadas por kid; una de ellas firma los tokens nuevos"""
+
+    def __init__(self, claves: Dict[str, str], kid_activo: str, kid_legado: str = KID_PRINCIPAL):
+        for rol, kid in (("activa", kid_activo), ("legada", kid_legado)):
+            if kid not in claves:
+                raise ValueError(f"La clave {rol} '{kid}' no está entre las claves configuradas")
+        self.claves = {kid: clave.encode() for kid, clave in claves.items()}
+        self.kid_activo = kid_activo
+        self.kid_legado = kid_legado
+
+    def clave_activa(self) -> bytes:
+        return self.claves[self.kid_activo]
+
+    def clave(self, kid: Optional[str]) -> bytes:
+        # Tokens sin kid o con "principal" (emitidos con la configuración por defecto): clave legada
+        if kid is None or kid == KID_PRINCIPAL:
+            kid = self.kid_legado
+        if not isinstance(kid, str):
+            raise TokenInvalido("kid inválido")
+        clave = self.claves.get(kid)
+        if clave is None:
+            raise TokenInvalido(f"Clave desconocida: {kid}")
+        return clave
+
+    @classmethod
+    def desde_entorno(cls, clave_por_defecto: str) -> "AnilloClaves":
+        clave_anterior = os.getenv("JWT_SECRET_KEY", clave_por_defecto)
+        configuradas = os.getenv("JWT_CLAVES")
+        if not configuradas:
+            return cls({KID_PRINCIPAL: clave_anterior}, KID_PRINCIPAL)
+
+        claves = {}
+        for par in configuradas.split(","):
+            kid, _, clave = par.strip().partition(":")
+            if not kid or not clave:
+                raise ValueError("JWT_CLAVES debe tener la forma kid:clave,kid:clave")
+            claves[kid] = clave
+
+        kid_legado = os.getenv("JWT_KID_LEGADO")
+        if not kid_legado:
+            # Sin legado explícito se conserva la clave anterior para los tokens ya emitidos
+            claves.setdefault(KID_PRINCIPAL, clave_anterior)
+            kid_legado = KID_PRINCIPAL
+        return cls(claves, os.getenv("JWT_KID_ACTIVO", next(iter(claves))), kid_legado)
+
+
+class BackendJWT(abc.ABC):
+    """Interfaz común: codificar firma con la clave activa, decodificar valida firma y exp"""
+
+    nombre = "base"
+
+    def __init__(self, anillo: AnilloClaves):
+        self.anillo = anillo
+
+    @abc.abstractmethod
+    def codificar(self, payload: dict) -> str:
+        ...
+
+    @abc.abstractmethod
+    def decodificar(self, token: str) -> dict:
+        """Payload del token; cualquier token malformado levanta TokenInvalido"""
+        ...
+
+
+class BackendHMAC(BackendJWT):
+    nombre = "hmac"
+
+    def __init__(self, anillo: AnilloClaves):
+        super().__init__(anillo)
+        # Los headers se serializan una vez por kid
+        self._headers = {
+            kid: _b64url(json.dumps(
+                {"alg": ALGORITMO, "typ": "JWT", "kid": kid}, separators=(",", ":")
+            ).encode())
+            for kid in anillo.claves
+        }
+
+    def codificar(self, payload: dict) -> str:
+        kid = self.anillo.kid_activo
+        cuerpo = _b64url(json.dumps(_normalizar_claims(payload), separators=(",", ":")).encode())
+        firmado = f"{self._headers[kid]}.{cuerpo}"
+        firma = hmac.new(self.anillo.clave_activa(), firmado.encode("ascii"), hashlib.sha256).digest()
+        return f"{firmado}.{_b64url(firma)}"
+
+    def decodificar(self, token: str) -> dict:
+        # Un JWT es ASCII: así el texto firmado se codifica sin errores más abajo
+        if not isinstance(token, str) or not token.isascii():
+            raise TokenInvalido("Formato de token inválido")
+        try:
+            header_b64, cuerpo_b64, firma_b64 = token.split(".")
+        except ValueError:
+            raise TokenInvalido("Formato de token inválido")
+
+        try:
+            header = json.loads(_b64url_decodificar(header_b64))
+        except ValueError:
+            raise TokenInvalido("Header inválido")
+        if not isinstance(header, dict) or header.get("alg") != ALGORITMO:
+            raise TokenInvalido("Algoritmo no permitido")
+
+        clave = self.anillo.clave(header.get("kid"))
+        esperada = hmac.new(clave, f"{header_b64}.{cuerpo_b64}".encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(esperada, _b64url_decodificar(firma_b64)):
+            raise TokenInvalido("Firma inválida")
+
+        try:
+            payload = json.loads(_b64url_decodificar(cuerpo_b64))
+        except ValueError:
+            raise TokenInvalido("Payload inválido")
+        if not isinstance(payload, dict):
+            raise TokenInvalido("Payload inválido")
+
+        exp = payload.get("exp")
+        if exp is not None:
+            if not isinstance(exp, (int, float)):
+                raise TokenInvalido("Claim exp inválido")
+            if exp <= time.time():
+                raise TokenInvalido("Token expirado")
+        return payload
+
+
+class BackendJose(BackendJWT):
+    nombre = "jose"
+
+    def codificar(self, payload: dict) -> str:
+        from jose import jwt
+
+        return jwt.encode(
+            payload, self.anillo.clave_activa(), algorithm=ALGORITMO,
+            headers={"kid": self.anillo.kid_activo}
+        )
+
+    def decodificar(self, token: str) -> dict:
+        from jose import JWTError, jwt
+
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            return jwt.decode(token, self.anillo.clave(kid), algorithms=[ALGORITMO])
+        except (JWTError, AttributeError, UnicodeError) as e:
+            raise TokenInvalido(str(e))
+
+
+BACKENDS = {
+    BackendHMAC.nombre: BackendHMAC,
+    BackendJose.nombre: BackendJose
+}
+
+
+def crear_backend(nombre: str, anillo: AnilloClaves) -> BackendJWT:
+    if nombre not in BACKENDS:
+        raise ValueError(f"Backend JWT desconocido: {nombre}. Opciones: {', '.join(BACKENDS)}")
+    return BACKENDS[nombre](anillo)
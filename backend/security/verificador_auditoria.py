@@ -0,0 +1,216 @@
+"""
+Verificación en paralelo de la cadena de auditoría
+
+Divide auditoria_movimientos en segmentos por rango de id y verifica cada
+segmento en un proceso distinto, leyendo las filas en streaming (cursor del
+lado del servidor + yield_per). Cada segmento arranca desde el hash_anterior
+de su primera fila; al unir los resultados se comprueba que ese hash coincida
+con el último hash_integridad del segmento anterior, así la cadena completa
+queda verificada sin que ningún proceso tenga que leerla entera.
+
+La memoria es constante: ni el coordinador ni los procesos retienen filas,
+y de cada segmento se devuelven como mucho MAX_ALTERADOS_POR_SEGMENTO
+registros alterados (más el total).
+
+Uso (desde backend/):
+    python -m security.verificador_auditoria --procesos 8
+    python -m security.verificador_auditoria --desde-id 25000000
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from security.auditoria import (
+    AuditoriaMovimiento, COLUMNAS_VERIFICACION, FILAS_POR_LECTURA, TramoCadena, cabeza_archivada
+)
+from security.checkpoints_auditoria import checkpoints_auditoria
+
+FILAS_POR_SEGMENTO = 1_000_000
+MAX_ALTERADOS_POR_SEGMENTO = 1000
+
+# Engine por proceso del pool (se crea en el primer segmento que procesa)
+_engine_proceso = None
+
+
+def _engine(url: str):
+    global _engine_proceso
+    if _engine_proceso is None:
+        _engine_proceso = create_engine(url, poolclass=NullPool)
+    return _engine_proceso
+
+
+def verificar_segmento(url: str, desde_id: int, hasta_id: int) -> Dict[str, Any]:
+    """
+    Verifica las filas con desde_id <= id <= hasta_id (se ejecuta en un proceso del pool)
+
+    Returns:
+        Resumen del segmento con sus hashes de borde y los registros alterados
+    """
+    tramo = TramoCadena()
+    alterados: List[Dict[str, Any]] = []
+    total_alterados = 0
+
+    consulta = (
+        select(*COLUMNAS_VERIFICACION)
+        .where(AuditoriaMovimiento.id.between(desde_id, hasta_id))
+        .order_by(AuditoriaMovimiento.id)
+    )
+    with _engine(url).connect() as conexion:
+        filas = conexion.execution_options(
+            stream_results=True, yield_per=FILAS_POR_LECTURA
+        ).execute(consulta)
+        for fila in filas:
+            alterado = tramo.verificar(fila)
+            if alterado:
+                total_alterados += 1
+                if len(alterados) < MAX_ALTERADOS_POR_SEGMENTO:
+                    alterados.append(alterado)
+
+    return {
+        "desde_id": desde_id,
+        "hasta_id": hasta_id,
+        "filas": tramo.filas,
+        "primer_id": tramo.primer_id,
+        "hash_entrada": tramo.hash_entrada,
+        "hash_salida": tramo.hash_salida,
+        "alterados": alterados,
+        "total_alterados": total_alterados
+    }
+
+
+def calcular_segmentos(desde_id: int, hasta_id: int, filas_por_segmento: int) -> List[Tuple[int, int]]:
+    """Rangos de id consecutivos (los huecos de id solo achican algún segmento)"""
+    return [
+        (inicio, min(inicio + filas_por_segmento - 1, hasta_id))
+        for inicio in range(desde_id, hasta_id + 1, filas_por_segmento)
+    ]
+
+
+def verificar_en_paralelo(
+    url: str,
+    desde_id: Optional[int] = None,
+    procesos: Optional[int] = None,
+    filas_por_segmento: int = FILAS_POR_SEGMENTO
+) -> Iterator[Dict[str, Any]]:
+    """
+    Verifica la cadena y produce eventos a medida que terminan los segmentos:
+
+        {"evento": "segmento", "desde_id", "hasta_id", "filas", "alterados", "progreso"}
+        {"evento": "fin", "integro", "filas", "total_alterados", "fronteras_rotas", "segundos"}
+
+    Sin desde_id la cadena debe arrancar en la cabeza del último mes archivado
+    (o en el hash génesis si no hay archivos). Con desde_id arranca en la
+    cabeza del último checkpoint firmado anterior a ese id (o del último mes
+    archivado, la más reciente), nunca en el hash_anterior almacenado de la
+    primera fila: una fila reescrita junto con su hash_anterior no pasaría.
+    Lanza ValueError si AUDITORIA_CLAVE_CHECKPOINTS no está configurada.
+    """
+    inicio = time.perf_counter()
+    engine = create_engine(url, poolclass=NullPool)
+    with Session(engine) as db:
+        if desde_id:
+            checkpoints_auditoria._exigir_clave()
+            ancla_id, hash_ancla = checkpoints_auditoria.punto_de_partida(
+                db, checkpoints_auditoria.ultimo_confiable(db, antes_de_id=desde_id)
+            )
+        else:
+            ancla_id, hash_ancla = cabeza_archivada(db)
+        minimo, maximo = db.execute(
+            select(func.min(AuditoriaMovimiento.id), func.max(AuditoriaMovimiento.id))
+            .where(AuditoriaMovimiento.id > ancla_id)
+        ).one()
+    engine.dispose()
+
+    if minimo is None:
+        yield {"evento": "fin", "integro": True, "filas": 0, "total_alterados": 0,
+               "fronteras_rotas": [], "segundos": time.perf_counter() - inicio}
+        return
+
+    segmentos = calcular_segmentos(minimo, maximo, filas_por_segmento)
+    # Solo los hashes de borde de cada segmento: memoria O(segmentos), no O(filas)
+    bordes: Dict[int, Tuple[Optional[int], Optional[str], Optional[str]]] = {}
+    ids_cubiertos = 0
+    filas_totales = 0
+    total_alterados = 0
+
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=procesos or os.cpu_count(), mp_context=contexto) as pool:
+        futuros = [pool.submit(verificar_segmento, url, d, h) for d, h in segmentos]
+        for futuro in as_completed(futuros):
+            resultado = futuro.result()
+            bordes[resultado["desde_id"]] = (
+                resultado["primer_id"], resultado["hash_entrada"], resultado["hash_salida"]
+            )
+            ids_cubiertos += resultado["hasta_id"] - resultado["desde_id"] + 1
+            filas_totales += resultado["filas"]
+            total_alterados += resultado["total_alterados"]
+            yield {
+                "evento": "segmento",
+                "desde_id": resultado["desde_id"],
+                "hasta_id": resultado["hasta_id"],
+                "filas": resultado["filas"],
+                "alterados": resultado["alterados"],
+                "progreso": round(ids_cubiertos / (maximo - minimo + 1), 4)
+            }
+
+    # Unir segmentos: cada uno debe partir del último hash del anterior con filas
+    fronteras_rotas = []
+    hash_previo = hash_ancla
+    for desde, _ in segmentos:
+        primer_id, hash_entrada, hash_salida = bordes[desde]
+        if primer_id is None:
+            continue
+        if hash_entrada != hash_previo:
+            fronteras_rotas.append({
+                "id": primer_id,
+                "hash_esperado": hash_previo,
+                "hash_anterior_almacenado": hash_entrada
+            })
+        hash_previo = hash_salida
+
+    yield {
+        "evento": "fin",
+        "integro": total_alterados == 0 and not fronteras_rotas,
+        "filas": filas_totales,
+        "total_alterados": total_alterados,
+        "fronteras_rotas": fronteras_rotas,
+        "segundos": time.perf_counter() - inicio
+    }
+
+
+if __name__ == "__main__":
+    from config import settings
+
+    parser = argparse.ArgumentParser(description="Verifica la cadena de auditoría en paralelo")
+    parser.add_argument("--desde-id", type=int, default=None)
+    parser.add_argument("--procesos", type=int, default=None)
+    parser.add_argument("--filas-por-segmento", type=int, default=FILAS_POR_SEGMENTO)
+    args = parser.parse_args()
+
+    print("🔗 Verificando cadena de auditoría...")
+    eventos = verificar_en_paralelo(settings.database_url, args.desde_id, args.procesos, args.filas_por_segmento)
+    try:
+        for evento in eventos:
+            if evento["evento"] == "segmento":
+                print(f"   [{evento['progreso']:6.1%}] ids {evento['desde_id']}-{evento['hasta_id']}: "
+                      f"{evento['filas']} filas, {len(evento['alterados'])} alteradas")
+                for alterado in evento["alterados"]:
+                    print(f"   ❌ id {alterado['id']} ({alterado['fecha']})")
+            else:
+                for frontera in evento["fronteras_rotas"]:
+                    print(f"   ❌ id {frontera['id']}: no continúa la cadena del segmento anterior")
+                icono = "✅" if evento["integro"] else "❌"
+                print(f"{icono} {evento['filas']} filas verificadas en {evento['segundos']:.1f} s, "
+                      f"{evento['total_alterados']} alteradas, {len(evento['fronteras_rotas'])} fronteras rotas")
+    except ValueError as e:
+        # Sin clave de checkpoints no hay ancla firmada para --desde-id
+        print(f"❌ {e}")
+        sys.exit(1)
@@ -0,0 +1,168 @@
+"""
+Cola de group commit para movimientos que llegan desde los scanners móviles
+"""
+import asyncio
+import time
+from typing import List, Optional, Tuple
+
+from services.movimientos_service import (
+    ServicioMovimientos, servicio_movimientos, MAX_MOVIMIENTOS_POR_LOTE
+)
+
+
+class ColaNoDisponible(Exception):
+    """La cola no acepta movimientos (aún no arrancó o el proceso se está apagando)"""
+    pass
+
+
+class ColaMovimientos:
+    """
+    Agrupa los movimientos que llegan dentro de una ventana de pocos
+    milisegundos y los escribe en una sola transacción (un solo flush del log
+    de SQL Server). Cada llamador recibe su propio movimiento_id y stock
+    resultante, o la excepción que rechazó su movimiento.
+
+    La latencia por request se mantiene (ventana + un commit), pero el costo
+    de commit se reparte entre todos los movimientos del lote.
+    """
+
+    def __init__(
+        self,
+        servicio: ServicioMovimientos = servicio_movimientos,
+        ventana_ms: float = 5.0,
+        max_lote: int = MAX_MOVIMIENTOS_POR_LOTE
+    ):
+        self.servicio = servicio
+        self.ventana = ventana_ms / 1000
+        self.max_lote = min(max_lote, MAX_MOVIMIENTOS_POR_LOTE)
+
+        self._pendientes: List[Tuple[dict, asyncio.Future]] = []
+        self._hay_pendientes: Optional[asyncio.Event] = None
+        self._lote_lleno: Optional[asyncio.Event] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._cerrando = False
+
+        # Métricas
+        self.lotes_escritos = 0
+        self.movimientos_escritos = 0
+        self.tiempo_escritura_total = 0.0
+
+    async def registrar(
+        self,
+        codigo_producto: str,
+        tipo_movimiento: str,
+        cantidad: int,
+        referencia: Optional[str] = None,
+        observaciones: Optional[str] = None
+    ) -> dict:
+        """
+        Encola el movimiento y espera a que su lote quede confirmado
+
+        Raises:
+            ColaNoDisponible: la cola no está iniciada o se está cerrando
+            Las mismas excepciones que ServicioMovimientos.registrar
+        """
+        if self._tarea is None or self._cerrando:
+            raise ColaNoDisponible("La cola de movimientos no está iniciada")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pendientes.append(({
+            "codigo_producto": codigo_producto,
+            "tipo_movimiento": tipo_movimiento,
+            "cantidad": cantidad,
+            "referencia": referencia,
+            "observaciones": observaciones
+        }, future))
+
+        self._hay_pendientes.set()
+        if len(self._pendientes) >= self.max_lote:
+            self._lote_lleno.set()
+
+        return await future
+
+    def obtener_estadisticas(self) -> dict:
+        return {
+            "lotes_escritos": self.lotes_escritos,
+            "movimientos_escritos": self.movimientos_escritos,
+            "promedio_por_lote": (
+                self.movimientos_escritos / self.lotes_escritos if self.lotes_escritos else 0
+            ),
+            "ms_promedio_escritura": (
+                self.tiempo_escritura_total * 1000 / self.lotes_escritos if self.lotes_escritos else 0
+            ),
+            "pendientes": len(self._pendientes)
+        }
+
+    # ---------------------------------------------
+    # Ciclo de vida (startup/shutdown de FastAPI)
+    # ---------------------------------------------
+    async def iniciar(self):
+        self._hay_pendientes = asyncio.Event()
+        self._lote_lleno = asyncio.Event()
+        self._cerrando = False
+        self._tarea = asyncio.create_task(self._bucle_escritura())
+
+    async def detener(self):
+        """Detiene la cola después de escribir lo que quede pendiente"""
+        if self._tarea is None:
+            return
+        self._cerrando = True
+        self._hay_pendientes.set()
+        self._lote_lleno.set()
+        await self._tarea
+        self._tarea = None
+
+    async def _bucle_escritura(self):
+        while True:
+            await self._hay_pendientes.wait()
+            if self._cerrando and not self._pendientes:
+                return
+
+            # Ventana de agrupación: esperar más movimientos o hasta llenar el lote
+            if len(self._pendientes) < self.max_lote:
+                try:
+                    await asyncio.wait_for(self._lote_lleno.wait(), timeout=self.ventana)
+                except asyncio.TimeoutError:
+                    pass
+
+            await self._escribir_lote()
+
+            if not self._pendientes and not self._cerrando:
+                self._hay_pendientes.clear()
+            if len(self._pendientes) < self.max_lote and not self._cerrando:
+                self._lote_lleno.clear()
+
+    async def _escribir_lote(self):
+        lote = self._pendientes[:self.max_lote]
+        self._pendientes = self._pendientes[self.max_lote:]
+        if not lote:
+            return
+
+        loop = asyncio.get_running_loop()
+        inicio = time.perf_counter()
+        try:
+            resultados = await loop.run_in_executor(
+                None, self.servicio.registrar_lote, [mov for mov, _ in lote]
+            )
+        except Exception as e:
+            # Falló la transacción completa: todos los del lote reciben el error
+            for _, future in lote:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.lotes_escritos += 1
+        self.movimientos_escritos += len(lote)
+        self.tiempo_escritura_total += time.perf_counter() - inicio
+
+        for (_, future), resultado in zip(lote, resultados):
+            if future.done():
+                continue
+            if isinstance(resultado, Exception):
+                future.set_exception(resultado)
+            else:
+                future.set_result(resultado)
+
+
+# Instancia global
+cola_movimientos = ColaMovimientos()
@@ -0,0 +1,279 @@
+"""
+Detector de stock crítico por cruce de bandas
+
+Clasifica cada producto en las mismas bandas que los reportes de Excel:
+    CRÍTICO  stock_actual <= stock_minimo
+    BAJO     stock_actual <= stock_minimo * 1.5
+    NORMAL   resto
+
+Solo evalúa los productos tocados por cada movimiento o cambio (lo notifican
+ServicioMovimientos e IndiceProductos) y emite un evento únicamente cuando un
+producto cambia de banda, no en cada escaneo. Los eventos quedan en un buffer
+con número de secuencia para consulta incremental y se entregan a los
+suscriptores desde una tarea en segundo plano, fuera del hilo del movimiento.
+
+Cada cambio lleva la versión de la fila (ver version_de_fila en
+indice_productos) y se ignora si no es más nueva que la ya aplicada. Como
+todos los workers detectan el mismo cruce, antes de entregarlo a los
+suscriptores se registra en la tabla bandas_stock: solo el worker cuyo upsert
+cambia la banda con una versión más nueva lo entrega (una alerta por cruce).
+"""
+import asyncio
+import itertools
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from database import SessionLocal
+from models import Producto
+from services.indice_productos import version_de_fila
+
+CRITICO = "CRÍTICO"
+BAJO = "BAJO"
+NORMAL = "NORMAL"
+
+FACTOR_BANDA_BAJO = 1.5
+
+# Gravedad de cada banda para saber si un cruce empeora o mejora
+NIVEL_BANDA = {NORMAL: 0, BAJO: 1, CRITICO: 2}
+
+# (version_fila, orden dentro de la misma versión)
+VersionProducto = Tuple[bytes, int]
+
+# Reclama la entrega de un cruce: devuelve fila solo si este worker cambió la
+# banda registrada con una versión más nueva que la guardada
+SQL_RECLAMAR_CRUCE = text("""
+MERGE bandas_stock WITH (HOLDLOCK) AS b
+USING (SELECT :producto_id AS producto_id) AS s
+    ON b.producto_id = s.producto_id
+WHEN MATCHED AND b.banda <> :banda
+    AND (b.version_fila < :version_fila OR (b.version_fila = :version_fila AND b.orden < :orden)) THEN
+    UPDATE SET banda = :banda, version_fila = :version_fila, orden = :orden, fecha_cruce = GETDATE()
+WHEN NOT MATCHED THEN
+    INSERT (producto_id, banda, version_fila, orden) VALUES (:producto_id, :banda, :version_fila, :orden)
+OUTPUT $action;
+""")
+
+
+def clasificar_stock(stock_actual: int, stock_minimo: int) -> str:
+    if stock_actual <= stock_minimo:
+        return CRITICO
+    if stock_actual <= stock_minimo * FACTOR_BANDA_BAJO:
+        return BAJO
+    return NORMAL
+
+
+class DetectorStock:
+    """Estado de banda por producto y emisión de eventos en los cruces"""
+
+    def __init__(self, session_factory: Callable = SessionLocal, max_eventos: int = 1000):
+        self.session_factory = session_factory
+
+        # producto_id -> [codigo, nombre, stock_minimo, banda, version]
+        self._productos: Dict[int, list] = {}
+        self._lock = threading.Lock()
+        self._secuencia = itertools.count(1)
+        self.eventos: Deque[dict] = deque(maxlen=max_eventos)
+
+        self.suscriptores: List[Callable[[dict], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pendientes: Optional[asyncio.Queue] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    def suscribir(self, callback: Callable[[dict], None]):
+        """Registra una función que recibe cada evento de cruce (se ejecuta en un hilo del executor)"""
+        self.suscriptores.append(callback)
+
+    # ---------------------------------------------
+    # Evaluación
+    # ---------------------------------------------
+    def _evaluar(self, producto_id: int, stock_actual: int) -> Optional[dict]:
+        """Actualiza la banda del producto; retorna el evento si la cruzó (con el lock tomado)"""
+        estado = self._productos.get(producto_id)
+        if estado is None:
+            return None
+
+        codigo, nombre, stock_minimo, banda_anterior, _ = estado
+        banda = clasificar_stock(stock_actual, stock_minimo)
+        if banda == banda_anterior:
+            return None
+
+        estado[3] = banda
+        evento = {
+            'secuencia': next(self._secuencia),
+            'producto_id': producto_id,
+            'codigo': codigo,
+            'nombre': nombre,
+            'stock_actual': stock_actual,
+            'stock_minimo': stock_minimo,
+            'banda_anterior': banda_anterior,
+            'banda': banda,
+            'empeora': NIVEL_BANDA[banda] > NIVEL_BANDA[banda_anterior],
+            'fecha': datetime.now()
+        }
+        self.eventos.append(evento)
+        return evento
+
+    def aplicar_stock(self, producto_id: int, stock_actual: int, version: VersionProducto):
+        """Nuevo stock de un producto tras un movimiento"""
+        with self._lock:
+            estado = self._productos.get(producto_id)
+            if estado is None or version <= estado[4]:
+                return
+            estado[4] = version
+            evento = self._evaluar(producto_id, stock_actual)
+        if evento:
+            self._publicar(evento, version)
+
+    def aplicar_producto(self, producto: Producto):
+        """Producto creado, modificado o desactivado (puede cambiar su stock mínimo)"""
+        evento = None
+        version = version_de_fila(producto)
+        with self._lock:
+            estado = self._productos.get(producto.id)
+            if estado is not None and version <= estado[4]:
+                # Fila más vieja que lo ya aplicado (p. ej. un movimiento propio posterior)
+                return
+            if not producto.activo:
+                self._productos.pop(producto.id, None)
+                return
+            stock_minimo = producto.stock_minimo or 0
+            if estado is None:
+                # Producto nuevo: se registra su banda sin emitir evento
+                self._productos[producto.id] = [
+                    producto.codigo, producto.nombre, stock_minimo,
+                    clasificar_stock(producto.stock_actual or 0, stock_minimo), version
+                ]
+            else:
+                estado[0], estado[1], estado[2], estado[4] = producto.codigo, producto.nombre, stock_minimo, version
+                evento = self._evaluar(producto.id, producto.stock_actual or 0)
+        if evento:
+            self._publicar(evento, version)
+
+    # ---------------------------------------------
+    # Consultas
+    # ---------------------------------------------
+    def eventos_desde(self, secuencia: int = 0, limite: int = 100) -> List[dict]:
+        """Eventos con secuencia mayor a la indicada (lo que un cliente aún no vio)"""
+        with self._lock:
+            return [e for e in self.eventos if e['secuencia'] > secuencia][:limite]
+
+    def resumen(self) -> dict:
+        with self._lock:
+            conteo = {CRITICO: 0, BAJO: 0, NORMAL: 0}
+            for estado in self._productos.values():
+                conteo[estado[3]] += 1
+        return conteo
+
+    # ---------------------------------------------
+    # Entrega de eventos
+    # ---------------------------------------------
+    def _publicar(self, evento: dict, version: VersionProducto):
+        """Encola el evento para los suscriptores sin bloquear a quien registró el movimiento"""
+        if self._loop is None or not self.suscriptores:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._pendientes.put_nowait, (evento, version))
+        except RuntimeError:
+            # Loop cerrado (apagado del proceso)
+            pass
+
+    def _reclamar(self, evento: dict, version: VersionProducto) -> bool:
+        """Registra el cruce en bandas_stock; True si este worker debe entregarlo"""
+        version_fila, orden = version
+        db = self.session_factory()
+        try:
+            accion = db.execute(SQL_RECLAMAR_CRUCE, {
+                'producto_id': evento['producto_id'],
+                'banda': evento['banda'],
+                'version_fila': version_fila,
+                'orden': orden
+            }).scalar()
+            db.commit()
+            return accion is not None
+        finally:
+            db.close()
+
+    async def _bucle_entrega(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            evento, version = await self._pendientes.get()
+            try:
+                if not await loop.run_in_executor(None, self._reclamar, evento, version):
+                    # Otro worker ya entregó este cruce (o uno más nuevo)
+                    continue
+            except Exception as e:
+                # Sin la BD se entrega igual: mejor una alerta repetida que una perdida
+                print(f"Error registrando cruce de stock {evento['codigo']}: {e}")
+            for callback in self.suscriptores:
+                try:
+                    await loop.run_in_executor(None, callback, evento)
+                except Exception as e:
+                    print(f"Error entregando evento de stock {evento['codigo']}: {e}")
+
+    # ---------------------------------------------
+    # Ciclo de vida (startup/shutdown de FastAPI)
+    # ---------------------------------------------
+    def cargar(self):
+        """Banda inicial de todos los productos activos (sin emitir eventos)"""
+        db = self.session_factory()
+        try:
+            productos = db.query(
+                Producto.id, Producto.codigo, Producto.nombre,
+                Producto.stock_actual, Producto.stock_minimo, Producto.version_fila
+            ).filter(Producto.activo == True).all()
+        finally:
+            db.close()
+
+        estados = {
+            p.id: [p.codigo, p.nombre, p.stock_minimo or 0,
+                   clasificar_stock(p.stock_actual or 0, p.stock_minimo or 0), version_de_fila(p)]
+            for p in productos
+        }
+        with self._lock:
+            self._productos = estados
+
+    async def iniciar(self):
+        self._loop = asyncio.get_running_loop()
+        self._pendientes = asyncio.Queue()
+        try:
+            await self._loop.run_in_executor(None, self.cargar)
+        except Exception as e:
+            print(f"Error cargando bandas de stock: {e}")
+        self._tarea = asyncio.create_task(self._bucle_entrega())
+
+    async def detener(self):
+        self._loop = None
+        if self._tarea:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+
+def notificar_por_whatsapp(telefono_destino: str) -> Callable[[dict], None]:
+    """Suscriptor que envía la alerta de WhatsApp cuando un producto entra en CRÍTICO"""
+    from services.whatsapp_service import WhatsAppService
+
+    whatsapp = WhatsAppService()
+
+    def notificar(evento: dict):
+        if evento['banda'] == CRITICO and evento['empeora']:
+            whatsapp.enviar_alerta_stock_critico(
+                telefono_destino=telefono_destino,
+                codigo_producto=evento['codigo'],
+                nombre_producto=evento['nombre'],
+                stock_actual=evento['stock_actual'],
+                stock_minimo=evento['stock_minimo']
+            )
+
+    return notificar
+
+
+# Instancia global
+detector_stock = DetectorStock()
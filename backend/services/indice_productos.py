@@ -0,0 +1,249 @@
+"""
+Índice de productos en memoria para resolución rápida de escaneos
+"""
+import asyncio
+import sys
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from database import SessionLocal
+from models import Producto
+
+# Menor rowversion que todavía puede confirmarse: todo lo que está por debajo
+# ya es visible, lo que está por encima lo trae el siguiente polling
+SQL_MIN_ROWVERSION = text("SELECT MIN_ACTIVE_ROWVERSION()")
+
+# Orden de una fila leída por polling entre las aplicaciones locales con el
+# mismo rowversion: la fila completa va después de todos los movimientos del
+# lote que la escribió (ver version_de_fila)
+ORDEN_FILA_COMPLETA = sys.maxsize
+
+
+def version_de_fila(producto) -> Tuple[bytes, int]:
+    """
+    Versión comparable de un producto leído de la BD: (version_fila, orden)
+    Los movimientos de este proceso usan (version_fila, posición en el lote),
+    así los consumidores descartan cualquier dato que no sea estrictamente
+    más nuevo que el último aplicado.
+    """
+    return (producto.version_fila or b"", ORDEN_FILA_COMPLETA)
+
+
+def producto_a_dict(producto: Producto) -> dict:
+    """Serializa un Producto a la forma que consumen los endpoints del scanner"""
+    return {
+        'id': producto.id,
+        'codigo': producto.codigo,
+        'nombre': producto.nombre,
+        'stock_actual': producto.stock_actual,
+        'stock_minimo': producto.stock_minimo,
+        'ubicacion_bodega': producto.ubicacion_bodega,
+        'categoria': producto.categoria,
+        'precio_venta': float(producto.precio_venta or 0),
+        'foto_url': None
+    }
+
+
+class IndiceProductos:
+    """
+    Índice local del proceso: productos por código y por ubicación de bodega.
+
+    Se carga completo al arrancar y luego se mantiene fresco con un polling
+    por marca de agua sobre productos.version_fila (ROWVERSION): a diferencia
+    de fecha_actualizacion no depende del reloj ni de su precisión, cubre
+    también las escrituras que no tocan las fechas y tiene valor aunque la
+    tabla esté vacía, así ningún polling es un recorrido completo. Los cambios
+    hechos por este mismo proceso se pueden aplicar al instante con
+    `aplicar_cambio` sin esperar al siguiente polling.
+
+    Otros componentes pueden recibir las filas que trae cada polling
+    registrándose con `suscribir` (p. ej. el agregador de KPIs). Una recarga
+    completa también les entrega cada fila cuya versión cambió desde la última
+    que vieron (lo escrito entre dos marcas de agua no se pierde); las filas
+    borradas no se notifican (los suscriptores las corrigen al reconciliar).
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable = SessionLocal,
+        intervalo_refresco: float = 5.0,
+        recarga_completa_cada: int = 120
+    ):
+        self.session_factory = session_factory
+        self.intervalo_refresco = intervalo_refresco
+        # Cada N refrescos se recarga todo para detectar filas borradas
+        self.recarga_completa_cada = recarga_completa_cada
+
+        self.por_codigo: Dict[str, dict] = {}
+        self.por_ubicacion: Dict[str, Dict[str, dict]] = {}
+        # ROWVERSION (8 bytes big-endian: se comparan como bytes)
+        self.marca_agua: Optional[bytes] = None
+        self.cargado = False
+        # producto_id -> última version_fila entregada a los suscriptores
+        self._versiones: Dict[int, bytes] = {}
+
+        self.suscriptores: List[Callable[[Producto], None]] = []
+
+        self._lock = threading.Lock()
+        self._tarea: Optional[asyncio.Task] = None
+        self._refrescos = 0
+
+    # ---------------------------------------------
+    # Consultas
+    # ---------------------------------------------
+    def buscar(self, codigo: str) -> Optional[dict]:
+        """Retorna el producto con ese código o None"""
+        return self.por_codigo.get(codigo)
+
+    def productos_en_ubicacion(self, ubicacion: str) -> List[dict]:
+        """Retorna los productos asignados a una ubicación de bodega"""
+        # Con el lock: aplicar_cambio modifica el diccionario desde el hilo del polling
+        with self._lock:
+            return list(self.por_ubicacion.get(ubicacion, {}).values())
+
+    def suscribir(self, callback: Callable[[Producto], None]):
+        """Registra una función que recibe cada producto modificado detectado por el polling"""
+        self.suscriptores.append(callback)
+
+    # ---------------------------------------------
+    # Mantenimiento
+    # ---------------------------------------------
+    def cargar(self):
+        """Carga completa del índice desde la tabla productos"""
+        db = self.session_factory()
+        try:
+            # Antes de leer: lo confirmado durante la carga se vuelve a traer en el siguiente polling
+            marca_agua = db.execute(SQL_MIN_ROWVERSION).scalar()
+            # También los inactivos: una desactivación se notifica a los suscriptores
+            productos = db.query(Producto).all()
+        finally:
+            db.close()
+
+        por_codigo: Dict[str, dict] = {}
+        por_ubicacion: Dict[str, Dict[str, dict]] = {}
+        versiones = {producto.id: producto.version_fila for producto in productos}
+
+        for producto in productos:
+            if not producto.activo:
+                continue
+            data = producto_a_dict(producto)
+            por_codigo[data['codigo']] = data
+            if data['ubicacion_bodega']:
+                por_ubicacion.setdefault(data['ubicacion_bodega'], {})[data['codigo']] = data
+
+        # Reemplazo atómico: los lectores ven el índice viejo o el nuevo, nunca uno a medias
+        with self._lock:
+            self.por_codigo = por_codigo
+            self.por_ubicacion = por_ubicacion
+            self.marca_agua = marca_agua
+            anteriores, self._versiones = self._versiones, versiones
+            recarga = self.cargado
+            self.cargado = True
+
+        if recarga:
+            # Los suscriptores cargaron su propio estado al arrancar; solo se
+            # les entrega lo que cambió desde la última fila que recibieron
+            for producto in productos:
+                if anteriores.get(producto.id) != producto.version_fila:
+                    self._notificar(producto)
+
+    def _notificar(self, producto: Producto):
+        for callback in self.suscriptores:
+            try:
+                callback(producto)
+            except Exception as e:
+                print(f"Error notificando cambio de producto {producto.codigo}: {e}")
+
+    def refrescar(self) -> int:
+        """
+        Aplica los productos escritos desde la última marca de agua
+        Retorna la cantidad de productos actualizados
+        """
+        if not self.cargado:
+            self.cargar()
+            return len(self.por_codigo)
+
+        db = self.session_factory()
+        try:
+            hasta = db.execute(SQL_MIN_ROWVERSION).scalar()
+            # Seek sobre idx_version_fila: solo las filas escritas entre las dos marcas
+            cambios = db.query(Producto).filter(
+                Producto.version_fila >= self.marca_agua,
+                Producto.version_fila < hasta
+            ).order_by(Producto.version_fila).all()
+        finally:
+            db.close()
+
+        for producto in cambios:
+            self.aplicar_cambio(producto_a_dict(producto), activo=bool(producto.activo))
+            self._versiones[producto.id] = producto.version_fila
+            self._notificar(producto)
+        self.marca_agua = hasta
+
+        return len(cambios)
+
+    def aplicar_cambio(self, data: dict, activo: bool = True):
+        """Inserta, actualiza o retira un producto del índice"""
+        codigo = data['codigo']
+        with self._lock:
+            anterior = self.por_codigo.get(codigo)
+            if anterior and anterior['ubicacion_bodega']:
+                en_ubicacion = self.por_ubicacion.get(anterior['ubicacion_bodega'])
+                if en_ubicacion is not None:
+                    en_ubicacion.pop(codigo, None)
+                    if not en_ubicacion:
+                        del self.por_ubicacion[anterior['ubicacion_bodega']]
+
+            if not activo:
+                self.por_codigo.pop(codigo, None)
+                return
+
+            self.por_codigo[codigo] = data
+            if data['ubicacion_bodega']:
+                self.por_ubicacion.setdefault(data['ubicacion_bodega'], {})[codigo] = data
+
+    def actualizar_stock(self, codigo: str, stock_actual: int):
+        """Actualiza solo el stock de un producto ya indexado"""
+        producto = self.por_codigo.get(codigo)
+        if producto is not None:
+            producto['stock_actual'] = stock_actual
+
+    # ---------------------------------------------
+    # Ciclo de vida (startup/shutdown de FastAPI)
+    # ---------------------------------------------
+    async def iniciar(self):
+        """Carga inicial y arranque del polling en segundo plano"""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.cargar)
+        except Exception as e:
+            print(f"Error cargando índice de productos: {e}")
+        self._tarea = asyncio.create_task(self._bucle_refresco())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    async def _bucle_refresco(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.intervalo_refresco)
+            self._refrescos += 1
+            try:
+                if self._refrescos % self.recarga_completa_cada == 0:
+                    await loop.run_in_executor(None, self.cargar)
+                else:
+                    await loop.run_in_executor(None, self.refrescar)
+            except Exception as e:
+                print(f"Error refrescando índice de productos: {e}")
+
+
+# Instancia global
+indice_productos = IndiceProductos()
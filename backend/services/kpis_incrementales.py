@@ -0,0 +1,366 @@
+"""
+Agregador incremental de KPIs de inventario
+
+Mantiene los mismos indicadores que sp_calcular_kpis (total de productos,
+productos críticos, valor de inventario, costo de almacenamiento) más la
+rotación, actualizándolos en O(1) por cada movimiento o cambio de producto en
+lugar de recorrer toda la tabla productos.
+
+Fuentes de cambios:
+- ServicioMovimientos notifica cada stock resultante de este proceso al instante
+- IndiceProductos notifica los productos que cambian en cualquier worker
+  (polling por marca de agua), incluidos cambios de costo, mínimo o activo
+
+Cada cambio lleva la versión de la fila (rowversion, ver version_de_fila en
+indice_productos) y solo se aplica si es estrictamente más nueva que la última
+aplicada a ese producto: un movimiento propio que luego llega por polling no
+se cuenta dos veces en las unidades salientes.
+
+Cada `intervalo_snapshot_minutos` (alineado al reloj) se guarda un snapshot en
+la tabla kpis y cada N snapshots se reconcilia contra un recálculo completo
+(mismas consultas que sp_calcular_kpis). Con varios workers solo el primero en
+insertar el intervalo lo guarda: la fila se identifica por fecha_calculo. Reconciliación manual (desde backend/):
+    python -m services.kpis_incrementales
+"""
+import argparse
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from database import SessionLocal
+from models import KPI, Producto
+from services.indice_productos import version_de_fila
+
+# (activo, stock_actual, stock_minimo, costo_unitario, costo_almacenamiento)
+EstadoProducto = Tuple[bool, int, int, float, float]
+
+# (version_fila, orden dentro de la misma versión)
+VersionProducto = Tuple[bytes, int]
+
+SQL_RECALCULO_COMPLETO = text("""
+SELECT
+    COUNT(*) AS total_productos,
+    ISNULL(SUM(CASE WHEN stock_actual <= stock_minimo THEN 1 ELSE 0 END), 0) AS productos_criticos,
+    ISNULL(SUM(stock_actual * costo_unitario), 0) AS valor_inventario,
+    ISNULL(SUM(stock_actual * costo_almacenamiento), 0) AS costo_almacenamiento_total,
+    ISNULL(SUM(stock_actual), 0) AS stock_total
+FROM productos
+WHERE activo = 1
+""")
+
+# Un único snapshot por intervalo entre todos los workers
+SQL_INSERTAR_SNAPSHOT = text("""
+INSERT INTO kpis (
+    fecha_calculo, total_productos, productos_criticos, valor_inventario,
+    rotacion_promedio, costo_almacenamiento_total
+)
+OUTPUT inserted.id
+SELECT :fecha_calculo, :total_productos, :productos_criticos, :valor_inventario,
+       :rotacion_promedio, :costo_almacenamiento_total
+WHERE NOT EXISTS (
+    SELECT 1 FROM kpis WITH (UPDLOCK, HOLDLOCK) WHERE fecha_calculo = :fecha_calculo
+)
+""")
+
+# Diferencia tolerada en montos al reconciliar (errores de redondeo de float)
+TOLERANCIA_MONTOS = 0.01
+
+
+def _estado_desde_producto(producto) -> EstadoProducto:
+    return (
+        bool(producto.activo),
+        producto.stock_actual or 0,
+        producto.stock_minimo or 0,
+        float(producto.costo_unitario or 0),
+        float(producto.costo_almacenamiento or 0)
+    )
+
+
+class AgregadorKPIs:
+    """Contadores de KPIs que se actualizan por diferencia con el estado previo de cada producto"""
+
+    def __init__(
+        self,
+        session_factory: Callable = SessionLocal,
+        intervalo_snapshot_minutos: float = 15,
+        reconciliar_cada_snapshots: int = 4
+    ):
+        self.session_factory = session_factory
+        self.intervalo_snapshot = intervalo_snapshot_minutos * 60
+        self.reconciliar_cada = reconciliar_cada_snapshots
+
+        self._lock = threading.Lock()
+        self._productos: Dict[int, EstadoProducto] = {}
+        self._versiones: Dict[int, VersionProducto] = {}
+        self._tarea: Optional[asyncio.Task] = None
+        self._reiniciar_contadores()
+
+    def _reiniciar_contadores(self):
+        self.total_productos = 0
+        self.productos_criticos = 0
+        self.valor_inventario = 0.0
+        self.costo_almacenamiento_total = 0.0
+        self.stock_total = 0
+        # Acumuladores de rotación del periodo en curso
+        self.unidades_salientes = 0
+        self.stock_total_inicio_periodo = 0
+        self.inicio_periodo = datetime.now()
+
+    # ---------------------------------------------
+    # Actualización incremental
+    # ---------------------------------------------
+    def _aplicar(self, producto_id: int, nuevo: Optional[EstadoProducto]):
+        """Resta la contribución anterior del producto y suma la nueva (con el lock tomado)"""
+        anterior = self._productos.get(producto_id)
+
+        if anterior is not None and anterior[0]:
+            _, stock, minimo, costo, costo_alm = anterior
+            self.total_productos -= 1
+            self.productos_criticos -= 1 if stock <= minimo else 0
+            self.valor_inventario -= stock * costo
+            self.costo_almacenamiento_total -= stock * costo_alm
+            self.stock_total -= stock
+
+        if nuevo is not None and nuevo[0]:
+            _, stock, minimo, costo, costo_alm = nuevo
+            self.total_productos += 1
+            self.productos_criticos += 1 if stock <= minimo else 0
+            self.valor_inventario += stock * costo
+            self.costo_almacenamiento_total += stock * costo_alm
+            self.stock_total += stock
+
+            if anterior is not None and anterior[0] and stock < anterior[1]:
+                self.unidades_salientes += anterior[1] - stock
+
+        if nuevo is None:
+            self._productos.pop(producto_id, None)
+        else:
+            self._productos[producto_id] = nuevo
+
+    def _es_nueva(self, producto_id: int, version: VersionProducto) -> bool:
+        """Registra la versión si es más nueva que la aplicada (con el lock tomado)"""
+        conocida = self._versiones.get(producto_id)
+        if conocida is not None and version <= conocida:
+            return False
+        self._versiones[producto_id] = version
+        return True
+
+    def aplicar_producto(self, producto: Producto):
+        """Producto creado, modificado o desactivado (fila completa)"""
+        with self._lock:
+            if self._es_nueva(producto.id, version_de_fila(producto)):
+                self._aplicar(producto.id, _estado_desde_producto(producto))
+
+    def aplicar_stock(self, producto_id: int, stock_actual: int, version: VersionProducto):
+        """Nuevo stock de un producto tras un movimiento"""
+        with self._lock:
+            anterior = self._productos.get(producto_id)
+            if anterior is None:
+                # Producto aún no visto: llegará completo en el próximo refresco del índice
+                return
+            if self._es_nueva(producto_id, version) and anterior[1] != stock_actual:
+                self._aplicar(producto_id, (anterior[0], stock_actual) + anterior[2:])
+
+    # ---------------------------------------------
+    # Lecturas
+    # ---------------------------------------------
+    @property
+    def rotacion_promedio(self) -> float:
+        """Unidades salientes del periodo / stock promedio del periodo"""
+        stock_promedio = (self.stock_total_inicio_periodo + self.stock_total) / 2
+        return self.unidades_salientes / stock_promedio if stock_promedio else 0.0
+
+    def obtener_kpis(self) -> dict:
+        with self._lock:
+            return {
+                'total_productos': self.total_productos,
+                'productos_criticos': self.productos_criticos,
+                'valor_inventario': round(self.valor_inventario, 2),
+                'rotacion_promedio': round(self.rotacion_promedio, 4),
+                'costo_almacenamiento_total': round(self.costo_almacenamiento_total, 2),
+                'inicio_periodo': self.inicio_periodo
+            }
+
+    # ---------------------------------------------
+    # Carga, snapshots y reconciliación
+    # ---------------------------------------------
+    def cargar(self):
+        """Inicialización completa (una sola vez al arrancar o tras reconciliar con diferencias)"""
+        db = self.session_factory()
+        try:
+            productos = db.query(
+                Producto.id, Producto.activo, Producto.stock_actual, Producto.stock_minimo,
+                Producto.costo_unitario, Producto.costo_almacenamiento, Producto.version_fila
+            ).all()
+        finally:
+            db.close()
+
+        with self._lock:
+            unidades_salientes = self.unidades_salientes
+            stock_inicio = self.stock_total_inicio_periodo
+            inicio_periodo = self.inicio_periodo
+            cargado_antes = bool(self._productos)
+
+            self._productos = {}
+            self._versiones = {}
+            self._reiniciar_contadores()
+            for producto in productos:
+                self._versiones[producto.id] = version_de_fila(producto)
+                self._aplicar(producto.id, _estado_desde_producto(producto))
+
+            if cargado_antes:
+                # Una recarga no reinicia el periodo de rotación en curso
+                self.unidades_salientes = unidades_salientes
+                self.stock_total_inicio_periodo = stock_inicio
+                self.inicio_periodo = inicio_periodo
+            else:
+                self.stock_total_inicio_periodo = self.stock_total
+
+    def persistir_snapshot(
+        self,
+        reiniciar_periodo: bool = True,
+        intervalo: Optional[datetime] = None
+    ) -> Optional[KPI]:
+        """
+        Guarda los valores actuales en la tabla kpis
+        
+        Args:
+            reiniciar_periodo: Empezar un nuevo periodo de rotación
+            intervalo: Inicio del intervalo del snapshot; si otro worker ya lo
+                guardó no se inserta y se devuelve None
+        """
+        kpis = self.obtener_kpis()
+        valores = {
+            'total_productos': kpis['total_productos'],
+            'productos_criticos': kpis['productos_criticos'],
+            'valor_inventario': kpis['valor_inventario'],
+            'rotacion_promedio': kpis['rotacion_promedio'],
+            'costo_almacenamiento_total': kpis['costo_almacenamiento_total']
+        }
+
+        db = self.session_factory()
+        try:
+            if intervalo is None:
+                snapshot = KPI(**valores)
+                db.add(snapshot)
+                db.commit()
+                db.refresh(snapshot)
+            else:
+                snapshot_id = db.execute(SQL_INSERTAR_SNAPSHOT, {'fecha_calculo': intervalo, **valores}).scalar()
+                db.commit()
+                snapshot = db.get(KPI, snapshot_id) if snapshot_id is not None else None
+        finally:
+            db.close()
+
+        if reiniciar_periodo:
+            with self._lock:
+                self.unidades_salientes = 0
+                self.stock_total_inicio_periodo = self.stock_total
+                self.inicio_periodo = datetime.now()
+
+        return snapshot
+
+    def reconciliar(self, corregir: bool = True) -> dict:
+        """
+        Compara los contadores incrementales con un recálculo completo
+        Si hay diferencias y `corregir` es True, recarga el estado desde la BD
+        """
+        db = self.session_factory()
+        try:
+            completo = db.execute(SQL_RECALCULO_COMPLETO).first()
+        finally:
+            db.close()
+
+        with self._lock:
+            incremental = {
+                'total_productos': self.total_productos,
+                'productos_criticos': self.productos_criticos,
+                'valor_inventario': self.valor_inventario,
+                'costo_almacenamiento_total': self.costo_almacenamiento_total,
+                'stock_total': self.stock_total
+            }
+
+        diferencias = {}
+        for clave, valor in incremental.items():
+            esperado = float(getattr(completo, clave))
+            if abs(esperado - valor) > TOLERANCIA_MONTOS:
+                diferencias[clave] = {'incremental': valor, 'recalculo': esperado}
+
+        if diferencias:
+            print(f"⚠️ KPIs incrementales descuadrados: {diferencias}")
+            if corregir:
+                self.cargar()
+
+        return {
+            'consistente': not diferencias,
+            'diferencias': diferencias,
+            'fecha': datetime.now()
+        }
+
+    # ---------------------------------------------
+    # Ciclo de vida (startup/shutdown de FastAPI)
+    # ---------------------------------------------
+    async def iniciar(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.cargar)
+        except Exception as e:
+            print(f"Error cargando KPIs: {e}")
+        if self.intervalo_snapshot > 0:
+            self._tarea = asyncio.create_task(self._bucle_snapshots())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    def _inicio_intervalo(self) -> datetime:
+        """Inicio del intervalo de snapshot en curso, igual en todos los workers"""
+        ahora = time.time()
+        return datetime.fromtimestamp(ahora - ahora % self.intervalo_snapshot).replace(microsecond=0)
+
+    async def _bucle_snapshots(self):
+        loop = asyncio.get_running_loop()
+        snapshots = 0
+        while True:
+            # Dormir hasta el próximo límite de intervalo
+            await asyncio.sleep(self.intervalo_snapshot - time.time() % self.intervalo_snapshot)
+            intervalo = self._inicio_intervalo()
+            snapshots += 1
+            try:
+                if self.reconciliar_cada and snapshots % self.reconciliar_cada == 0:
+                    await loop.run_in_executor(None, self.reconciliar)
+                await loop.run_in_executor(None, self.persistir_snapshot, True, intervalo)
+            except Exception as e:
+                print(f"Error guardando snapshot de KPIs: {e}")
+
+
+# Instancia global
+agregador_kpis = AgregadorKPIs()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcilia los KPIs incrementales con un recálculo completo")
+    parser.add_argument("--snapshot", action="store_true", help="Guardar además un snapshot en kpis")
+    args = parser.parse_args()
+
+    print("🔄 Cargando estado incremental...")
+    agregador_kpis.cargar()
+    resultado = agregador_kpis.reconciliar(corregir=False)
+    if resultado['consistente']:
+        print("✅ KPIs incrementales coinciden con el recálculo completo")
+    else:
+        for clave, valores in resultado['diferencias'].items():
+            print(f"   {clave}: incremental {valores['incremental']}, recálculo {valores['recalculo']}")
+
+    if args.snapshot:
+        snapshot = agregador_kpis.persistir_snapshot()
+        print(f"💾 Snapshot guardado: id {snapshot.id}")
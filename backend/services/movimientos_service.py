@@ -0,0 +1,356 @@
+"""
+Servicio de movimientos de inventario con actualización atómica de stock
+"""
+import random
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from database import SessionLocal
+from services.indice_productos import indice_productos
+from services.kpis_incrementales import agregador_kpis
+from services.detector_stock import detector_stock
+
+TIPOS_MOVIMIENTO = ("ENTRADA", "SALIDA", "AJUSTE")
+
+# Códigos de error de SQL Server que justifican reintentar la transacción
+# 1205: víctima de deadlock, 1222: timeout de lock
+ERRORES_REINTENTABLES = ("1205", "1222")
+
+# Un solo batch: UPDATE atómico de stock + INSERT del movimiento.
+# El UPDATE relativo (stock_actual + delta) evita lecturas previas y con ello
+# las actualizaciones perdidas; el lock de fila dura solo este round trip.
+SQL_REGISTRAR_MOVIMIENTO = text("""
+SET NOCOUNT ON;
+DECLARE @producto TABLE (id INT, stock_actual INT, version_fila BINARY(8));
+DECLARE @movimiento TABLE (id INT, fecha_movimiento DATETIME2);
+
+UPDATE productos
+SET stock_actual = stock_actual + :delta,
+    fecha_actualizacion = SYSDATETIME()
+OUTPUT inserted.id, inserted.stock_actual, inserted.version_fila INTO @producto
+WHERE codigo = :codigo
+    AND activo = 1
+    AND stock_actual + :delta >= 0;
+
+INSERT INTO movimientos
+    (producto_id, tipo_movimiento, cantidad, referencia, observaciones, stock_resultante)
+OUTPUT inserted.id, inserted.fecha_movimiento INTO @movimiento
+SELECT id, :tipo_movimiento, :cantidad, :referencia, :observaciones, stock_actual
+FROM @producto;
+
+SELECT m.id AS movimiento_id, m.fecha_movimiento, p.id AS producto_id, p.stock_actual, p.version_fila
+FROM @movimiento m CROSS JOIN @producto p;
+""")
+
+SQL_STOCK_PRODUCTO = text("""
+SELECT stock_actual FROM productos WHERE codigo = :codigo AND activo = 1
+""")
+
+
+# Límite de SQL Server: 2100 parámetros por batch. Con 7 parámetros por
+# movimiento + 3 por producto, 200 movimientos por lote quedan bajo el límite.
+MAX_MOVIMIENTOS_POR_LOTE = 200
+
+
+def _placeholders(prefijo: str, cantidad: int) -> str:
+    return ", ".join(f":{prefijo}{i}" for i in range(cantidad))
+
+
+def sql_bloquear_productos(cantidad_codigos: int):
+    """SELECT con UPDLOCK de los productos de un lote (lee y bloquea su stock)"""
+    return text(f"""
+SELECT id, codigo, stock_actual
+FROM productos WITH (UPDLOCK, ROWLOCK)
+WHERE activo = 1 AND codigo IN ({_placeholders("c", cantidad_codigos)})
+""")
+
+
+def sql_escribir_lote(cantidad_productos: int, cantidad_movimientos: int):
+    """
+    UPDATE de stock con deltas agregados por producto + inserción multi-fila
+    de movimientos. INSERT ... SELECT ... ORDER BY garantiza que los IDENTITY
+    se asignen en el orden de llegada, así el i-ésimo id devuelto corresponde
+    al i-ésimo movimiento aceptado.
+    """
+    actualizar_stock = ""
+    if cantidad_productos:
+        # Sin productos con delta neto distinto de cero solo se insertan movimientos
+        valores_delta = ", ".join(f"(:pid{i}, :d{i})" for i in range(cantidad_productos))
+        actualizar_stock = f"""
+UPDATE p
+SET stock_actual = p.stock_actual + d.delta,
+    fecha_actualizacion = SYSDATETIME()
+FROM productos p
+JOIN (VALUES {valores_delta}) AS d (id, delta) ON p.id = d.id;
+"""
+    valores_movimientos = ", ".join(
+        f"(:s{i}, :p{i}, :t{i}, :q{i}, :r{i}, :o{i}, :e{i})" for i in range(cantidad_movimientos)
+    )
+    return text(f"""
+SET NOCOUNT ON;
+DECLARE @movimientos TABLE (id INT, fecha_movimiento DATETIME2, producto_id INT);
+{actualizar_stock}
+INSERT INTO movimientos
+    (producto_id, tipo_movimiento, cantidad, referencia, observaciones, stock_resultante)
+OUTPUT inserted.id, inserted.fecha_movimiento, inserted.producto_id INTO @movimientos
+SELECT producto_id, tipo_movimiento, cantidad, referencia, observaciones, stock_resultante
+FROM (VALUES {valores_movimientos})
+    AS origen (seq, producto_id, tipo_movimiento, cantidad, referencia, observaciones, stock_resultante)
+ORDER BY seq;
+
+SELECT m.id, m.fecha_movimiento, p.version_fila
+FROM @movimientos m JOIN productos p ON p.id = m.producto_id
+ORDER BY m.id;
+""")
+
+
+class ProductoNoEncontrado(Exception):
+    """El código no corresponde a un producto activo"""
+
+
+class StockInsuficiente(Exception):
+    """La salida dejaría el stock en negativo"""
+
+    def __init__(self, codigo: str, stock_actual: int, solicitado: int):
+        self.codigo = codigo
+        self.stock_actual = stock_actual
+        self.solicitado = solicitado
+        super().__init__(
+            f"Stock insuficiente para {codigo}: disponible {stock_actual}, solicitado {solicitado}"
+        )
+
+
+def calcular_delta(tipo_movimiento: str, cantidad: int) -> int:
+    """
+    Convierte un movimiento en la variación de stock que produce
+    ENTRADA suma, SALIDA resta y AJUSTE aplica la cantidad con su signo
+    """
+    if tipo_movimiento not in TIPOS_MOVIMIENTO:
+        raise ValueError(f"Tipo de movimiento inválido: {tipo_movimiento}")
+    if tipo_movimiento == "AJUSTE":
+        return cantidad
+    if cantidad <= 0:
+        raise ValueError("La cantidad debe ser mayor a cero")
+    return cantidad if tipo_movimiento == "ENTRADA" else -cantidad
+
+
+def es_error_reintentable(error: DBAPIError) -> bool:
+    mensaje = str(getattr(error, "orig", error))
+    return any(codigo in mensaje for codigo in ERRORES_REINTENTABLES)
+
+
+class ServicioMovimientos:
+    """
+    Registra movimientos y actualiza productos.stock_actual en una sola
+    transacción y un solo round trip. Ante deadlocks o timeouts de lock
+    reintenta con backoff exponencial y jitter.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable = SessionLocal,
+        max_reintentos: int = 5,
+        backoff_base: float = 0.005
+    ):
+        self.session_factory = session_factory
+        self.max_reintentos = max_reintentos
+        self.backoff_base = backoff_base
+
+    def registrar(
+        self,
+        codigo_producto: str,
+        tipo_movimiento: str,
+        cantidad: int,
+        referencia: Optional[str] = None,
+        observaciones: Optional[str] = None
+    ) -> dict:
+        """
+        Registra el movimiento y retorna el id creado y el stock resultante
+
+        Raises:
+            ValueError: tipo o cantidad inválidos
+            ProductoNoEncontrado: el producto no existe o está inactivo
+            StockInsuficiente: la salida dejaría el stock negativo
+        """
+        delta = calcular_delta(tipo_movimiento, cantidad)
+        params = {
+            "codigo": codigo_producto,
+            "delta": delta,
+            "tipo_movimiento": tipo_movimiento,
+            "cantidad": cantidad,
+            "referencia": referencia,
+            "observaciones": observaciones
+        }
+
+        def ejecutar(db):
+            fila = db.execute(SQL_REGISTRAR_MOVIMIENTO, params).first()
+            if fila is None:
+                db.rollback()
+                self._diagnosticar_fallo(db, codigo_producto, delta)
+            return fila
+
+        fila = self._con_reintentos(ejecutar)
+
+        indice_productos.actualizar_stock(codigo_producto, fila.stock_actual)
+        agregador_kpis.aplicar_stock(fila.producto_id, fila.stock_actual, (fila.version_fila, 0))
+        detector_stock.aplicar_stock(fila.producto_id, fila.stock_actual, (fila.version_fila, 0))
+
+        return {
+            "movimiento_id": fila.movimiento_id,
+            "producto_id": fila.producto_id,
+            "producto_codigo": codigo_producto,
+            "tipo_movimiento": tipo_movimiento,
+            "cantidad": cantidad,
+            "stock_anterior": fila.stock_actual - delta,
+            "nuevo_stock": fila.stock_actual,
+            "fecha": fila.fecha_movimiento
+        }
+
+    def registrar_lote(self, movimientos: List[dict]) -> List[Union[dict, Exception]]:
+        """
+        Registra varios movimientos en UNA transacción (group commit)
+
+        Cada movimiento es un dict con codigo_producto, tipo_movimiento,
+        cantidad, referencia y observaciones. Los movimientos se aplican en el
+        orden recibido; los que no son válidos se rechazan individualmente sin
+        afectar al resto del lote.
+
+        Returns:
+            En el mismo orden de entrada, el resultado de cada movimiento o la
+            excepción que lo rechazó
+        """
+        if len(movimientos) > MAX_MOVIMIENTOS_POR_LOTE:
+            raise ValueError(f"Máximo {MAX_MOVIMIENTOS_POR_LOTE} movimientos por lote")
+
+        invalidos: Dict[int, Exception] = {}
+        deltas: List[Optional[int]] = []
+        for i, mov in enumerate(movimientos):
+            try:
+                deltas.append(calcular_delta(mov["tipo_movimiento"], mov["cantidad"]))
+            except ValueError as e:
+                invalidos[i] = e
+                deltas.append(None)
+
+        codigos = sorted({
+            mov["codigo_producto"] for i, mov in enumerate(movimientos) if i not in invalidos
+        })
+        if not codigos:
+            return [invalidos[i] for i in range(len(movimientos))]
+
+        def ejecutar(db):
+            params = {f"c{i}": codigo for i, codigo in enumerate(codigos)}
+            filas = db.execute(sql_bloquear_productos(len(codigos)), params).all()
+            productos = {f.codigo: (f.id, f.stock_actual) for f in filas}
+            stock = {codigo: datos[1] for codigo, datos in productos.items()}
+
+            # Aplicar en orden de llegada sobre el stock bloqueado
+            resultados: Dict[int, Union[dict, Exception]] = dict(invalidos)
+            versiones: Dict[int, bytes] = {}
+            aceptados = []
+            for i, mov in enumerate(movimientos):
+                if i in invalidos:
+                    continue
+                codigo = mov["codigo_producto"]
+                if codigo not in productos:
+                    resultados[i] = ProductoNoEncontrado(f"Producto no encontrado: {codigo}")
+                    continue
+                nuevo_stock = stock[codigo] + deltas[i]
+                if nuevo_stock < 0:
+                    resultados[i] = StockInsuficiente(codigo, stock[codigo], -deltas[i])
+                    continue
+                resultados[i] = {
+                    "movimiento_id": None,
+                    "producto_id": productos[codigo][0],
+                    "producto_codigo": codigo,
+                    "tipo_movimiento": mov["tipo_movimiento"],
+                    "cantidad": mov["cantidad"],
+                    "stock_anterior": stock[codigo],
+                    "nuevo_stock": nuevo_stock,
+                    "fecha": None
+                }
+                stock[codigo] = nuevo_stock
+                aceptados.append(i)
+
+            if not aceptados:
+                return resultados, stock, versiones
+
+            variaciones = [
+                (datos[0], stock[codigo] - datos[1])
+                for codigo, datos in productos.items()
+                if stock[codigo] != datos[1]
+            ]
+            params = {}
+            for j, (producto_id, delta) in enumerate(variaciones):
+                params[f"pid{j}"] = producto_id
+                params[f"d{j}"] = delta
+            for j, i in enumerate(aceptados):
+                mov = movimientos[i]
+                params.update({
+                    f"s{j}": i,
+                    f"p{j}": resultados[i]["producto_id"],
+                    f"t{j}": mov["tipo_movimiento"],
+                    f"q{j}": mov["cantidad"],
+                    f"r{j}": mov.get("referencia"),
+                    f"o{j}": mov.get("observaciones"),
+                    f"e{j}": resultados[i]["nuevo_stock"]
+                })
+
+            sql = sql_escribir_lote(len(variaciones), len(aceptados))
+            insertados = db.execute(sql, params).all()
+            for i, (movimiento_id, fecha, version_fila) in zip(aceptados, insertados):
+                resultados[i]["movimiento_id"] = movimiento_id
+                resultados[i]["fecha"] = fecha
+                versiones[i] = version_fila
+
+            return resultados, stock, versiones
+
+        resultados, stock, versiones = self._con_reintentos(ejecutar)
+
+        for codigo, stock_actual in stock.items():
+            indice_productos.actualizar_stock(codigo, stock_actual)
+
+        resultados = [resultados[i] for i in range(len(movimientos))]
+        # Movimiento a movimiento: la rotación cuenta cada salida y cada cruce de banda se detecta
+        for i, resultado in enumerate(resultados):
+            if isinstance(resultado, dict):
+                # Mismo rowversion para todo el lote: la posición ordena los movimientos
+                agregador_kpis.aplicar_stock(resultado["producto_id"], resultado["nuevo_stock"], (versiones[i], i))
+                detector_stock.aplicar_stock(resultado["producto_id"], resultado["nuevo_stock"], (versiones[i], i))
+
+        return resultados
+
+    def _con_reintentos(self, ejecutar: Callable):
+        """
+        Ejecuta `ejecutar(db)` dentro de una transacción y hace commit.
+        Reintenta toda la transacción ante deadlocks o timeouts de lock.
+        """
+        intento = 0
+        while True:
+            db = self.session_factory()
+            try:
+                resultado = ejecutar(db)
+                db.commit()
+                return resultado
+            except DBAPIError as e:
+                db.rollback()
+                intento += 1
+                if intento > self.max_reintentos or not es_error_reintentable(e):
+                    raise
+                time.sleep(self.backoff_base * (2 ** intento) * random.uniform(0.5, 1.5))
+            finally:
+                db.close()
+
+    @staticmethod
+    def _diagnosticar_fallo(db, codigo_producto: str, delta: int):
+        """Solo en el camino de error: distingue producto inexistente de stock insuficiente"""
+        stock = db.execute(SQL_STOCK_PRODUCTO, {"codigo": codigo_producto}).scalar()
+        if stock is None:
+            raise ProductoNoEncontrado(f"Producto no encontrado: {codigo_producto}")
+        raise StockInsuficiente(codigo_producto, stock, -delta)
+
+
+# Instancia global
+servicio_movimientos = ServicioMovimientos()
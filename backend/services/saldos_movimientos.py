@@ -0,0 +1,197 @@
+"""
+Saldos por movimiento (stock_resultante): consultas y reconstrucción masiva
+
+Cada movimiento guarda el stock del producto inmediatamente después de
+aplicarse (lo escribe ServicioMovimientos en la misma transacción). Con el
+índice idx_producto_fecha (producto_id, fecha_movimiento, id) INCLUDE
+(stock_resultante), "stock en la fecha T" y "últimos N movimientos con saldo"
+son un seek en el índice, sin sumar el historial.
+
+Reconstrucción (desde backend/):
+    python -m services.saldos_movimientos               # anclados a stock_actual
+    python -m services.saldos_movimientos --desde-cero  # solo si los movimientos explican todo el stock
+
+Desde cero, un producto con stock inicial que nunca se registró como
+movimiento quedaría con saldos falsos, así que la reconstrucción sin anclar se
+niega a correr si algún stock_actual difiere de la suma de sus movimientos.
+"""
+import argparse
+import sys
+from datetime import datetime
+
+from sqlalchemy import select, text, case
+
+from models import Movimiento
+
+# Variación de stock de cada movimiento: SALIDA resta, ENTRADA suma, AJUSTE va con signo
+DELTA_SQL = "CASE m.tipo_movimiento WHEN 'SALIDA' THEN -m.cantidad ELSE m.cantidad END"
+
+delta_movimiento = case(
+    (Movimiento.tipo_movimiento == "SALIDA", -Movimiento.cantidad),
+    else_=Movimiento.cantidad
+)
+
+# Recalcula todos los saldos con una suma acumulada por producto en un solo
+# UPDATE. Con :anclar = 1 se desplaza cada serie para que el último saldo
+# coincida con stock_actual (stock inicial que nunca se registró como movimiento).
+SQL_RECONSTRUIR_SALDOS = text(f"""
+WITH saldos AS (
+    SELECT
+        m.stock_resultante,
+        SUM({DELTA_SQL}) OVER (
+            PARTITION BY m.producto_id
+            ORDER BY m.fecha_movimiento, m.id
+            ROWS UNBOUNDED PRECEDING
+        ) AS acumulado,
+        SUM({DELTA_SQL}) OVER (PARTITION BY m.producto_id) AS total,
+        p.stock_actual
+    FROM movimientos m
+    JOIN productos p ON p.id = m.producto_id
+)
+UPDATE saldos
+SET stock_resultante = acumulado + CASE WHEN :anclar = 1 THEN stock_actual - total ELSE 0 END;
+""")
+
+# Productos cuyo stock_actual no se explica por la suma de sus movimientos
+SQL_DESCUADRES = text(f"""
+SELECT p.id, p.codigo, p.stock_actual, ISNULL(SUM({DELTA_SQL}), 0) AS suma_movimientos
+FROM productos p
+LEFT JOIN movimientos m ON m.producto_id = p.id
+GROUP BY p.id, p.codigo, p.stock_actual
+HAVING p.stock_actual <> ISNULL(SUM({DELTA_SQL}), 0)
+ORDER BY p.codigo
+""")
+
+# Productos cuyo último saldo guardado difiere de stock_actual
+SQL_ULTIMO_SALDO_DISTINTO = text("""
+SELECT p.id, p.codigo, p.stock_actual, ultimo.stock_resultante
+FROM productos p
+CROSS APPLY (
+    SELECT TOP 1 m.stock_resultante
+    FROM movimientos m
+    WHERE m.producto_id = p.id
+    ORDER BY m.fecha_movimiento DESC, m.id DESC
+) AS ultimo
+WHERE ultimo.stock_resultante IS NULL OR ultimo.stock_resultante <> p.stock_actual
+ORDER BY p.codigo
+""")
+
+
+def consulta_saldo_en_fecha(producto_id: int, fecha: datetime):
+    """Último movimiento con fecha <= T (su stock_resultante es el stock en T)"""
+    return (
+        select(Movimiento.stock_resultante)
+        .where(Movimiento.producto_id == producto_id, Movimiento.fecha_movimiento <= fecha)
+        .order_by(Movimiento.fecha_movimiento.desc(), Movimiento.id.desc())
+        .limit(1)
+    )
+
+
+def consulta_saldo_previo_a_fecha(producto_id: int, fecha: datetime):
+    """
+    Para T anterior a todo movimiento: el stock previo al primer movimiento
+    posterior a T (stock_resultante - delta)
+    """
+    return (
+        select(Movimiento.stock_resultante - delta_movimiento)
+        .where(Movimiento.producto_id == producto_id, Movimiento.fecha_movimiento > fecha)
+        .order_by(Movimiento.fecha_movimiento, Movimiento.id)
+        .limit(1)
+    )
+
+
+def consulta_ultimos_con_saldo(producto_id: int, limite: int):
+    """Últimos N movimientos de un producto con su saldo"""
+    return (
+        select(Movimiento)
+        .where(Movimiento.producto_id == producto_id)
+        .order_by(Movimiento.fecha_movimiento.desc(), Movimiento.id.desc())
+        .limit(limite)
+    )
+
+
+def _descuadres(db) -> list:
+    return [
+        {
+            "producto_id": f.id,
+            "codigo": f.codigo,
+            "stock_actual": f.stock_actual,
+            "suma_movimientos": f.suma_movimientos,
+            "diferencia": f.stock_actual - f.suma_movimientos
+        }
+        for f in db.execute(SQL_DESCUADRES)
+    ]
+
+
+def reconstruir_saldos(db, anclar: bool = True) -> dict:
+    """
+    Recalcula stock_resultante de todos los movimientos y verifica el
+    resultado contra productos.stock_actual
+
+    Args:
+        db: Sesión síncrona de SQLAlchemy
+        anclar: Ajustar cada serie para terminar en stock_actual; con False
+            (saldos desde cero) lanza ValueError sin escribir nada si algún
+            producto tiene stock no explicado por sus movimientos
+
+    Returns:
+        Movimientos actualizados y productos descuadrados
+    """
+    if not anclar:
+        descuadres = _descuadres(db)
+        if descuadres:
+            raise ValueError(
+                f"{len(descuadres)} productos tienen stock_actual distinto de la suma de sus "
+                f"movimientos (p. ej. {descuadres[0]['codigo']}); reconstruir anclado"
+            )
+
+    actualizados = db.execute(SQL_RECONSTRUIR_SALDOS, {"anclar": 1 if anclar else 0}).rowcount
+    db.commit()
+
+    descuadres = _descuadres(db)
+    ultimo_saldo_distinto = [
+        {
+            "producto_id": f.id,
+            "codigo": f.codigo,
+            "stock_actual": f.stock_actual,
+            "ultimo_saldo": f.stock_resultante
+        }
+        for f in db.execute(SQL_ULTIMO_SALDO_DISTINTO)
+    ]
+
+    return {
+        "movimientos_actualizados": actualizados,
+        "anclado": anclar,
+        "descuadres": descuadres,
+        "ultimo_saldo_distinto": ultimo_saldo_distinto
+    }
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Reconstruye los saldos por movimiento")
+    parser.add_argument(
+        "--desde-cero", action="store_true",
+        help="Saldos desde cero sin anclar a productos.stock_actual (falla si hay stock no explicado)"
+    )
+    args = parser.parse_args()
+
+    print("🔄 Reconstruyendo saldos de movimientos...")
+    db = SessionLocal()
+    try:
+        resultado = reconstruir_saldos(db, anclar=not args.desde_cero)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+    print(f"✅ Movimientos actualizados: {resultado['movimientos_actualizados']}")
+    print(f"⚠️  Productos con stock no explicado por movimientos: {len(resultado['descuadres'])}")
+    for d in resultado["descuadres"][:20]:
+        print(f"   {d['codigo']}: stock {d['stock_actual']}, movimientos {d['suma_movimientos']} "
+              f"(diferencia {d['diferencia']})")
+    print(f"⚠️  Productos cuyo último saldo difiere de stock_actual: {len(resultado['ultimo_saldo_distinto'])}")
+    for d in resultado["ultimo_saldo_distinto"][:20]:
+        print(f"   {d['codigo']}: stock {d['stock_actual']}, último saldo {d['ultimo_saldo']}")
@@ -0,0 +1,67 @@
+"""
+Cursores opacos para paginación keyset (seek)
+"""
+import base64
+import json
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+# Fecha como texto de CAST(DATETIME2 AS VARCHAR): conserva los 100 ns que se
+# pierden al pasar por datetime (µs); ver fecha_cursor en routes/inventario.py
+_FECHA_SQL = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d{1,7})?$")
+
+
+def es_entero(valor: Any) -> bool:
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+
+def es_texto(valor: Any) -> bool:
+    return isinstance(valor, str)
+
+
+def es_fecha_sql(valor: Any) -> bool:
+    return isinstance(valor, str) and _FECHA_SQL.match(valor) is not None
+
+
+def codificar_cursor(valores: dict) -> str:
+    """Codifica los valores de la última fila de la página en un cursor opaco"""
+    serializable = {
+        clave: {"__fecha__": valor.isoformat()} if isinstance(valor, datetime) else valor
+        for clave, valor in valores.items()
+    }
+    crudo = json.dumps(serializable, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+
+def decodificar_cursor(
+    cursor: Optional[str],
+    claves: Optional[Dict[str, Callable[[Any], bool]]] = None
+) -> Optional[dict]:
+    """
+    Decodifica un cursor generado por codificar_cursor
+    
+    Args:
+        cursor: Cursor opaco (None o vacío = primera página)
+        claves: Validador de cada clave que el endpoint necesita; un cursor de
+            otro endpoint o con valores de otro tipo se rechaza
+    
+    Lanza ValueError si el cursor fue alterado o no es válido
+    """
+    if not cursor:
+        return None
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        if not isinstance(valores, dict):
+            raise ValueError("estructura inválida")
+        for clave, valido in (claves or {}).items():
+            if clave not in valores or not valido(valores[clave]):
+                raise ValueError(f"valor de '{clave}' ausente o inválido")
+        return {
+            clave: datetime.fromisoformat(valor["__fecha__"])
+            if isinstance(valor, dict) and "__fecha__" in valor else valor
+            for clave, valor in valores.items()
+        }
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Cursor inválido: {e}")
@@ -0,0 +1,24 @@
+-- =============================================
+-- Bandas de stock notificadas (bases de datos existentes)
+-- schema.sql ya la incluye para instalaciones nuevas
+--
+-- Con varios workers cada uno detecta el mismo cruce de banda (por su propio
+-- movimiento o por el polling del índice). Antes de entregar la alerta el
+-- worker registra el cruce aquí con un upsert condicional: solo el que cambia
+-- la banda con una versión más nueva la entrega. Requiere version_productos.sql.
+-- =============================================
+
+USE InventariosDB;
+GO
+
+IF OBJECT_ID('bandas_stock', 'U') IS NULL
+    CREATE TABLE bandas_stock (
+        producto_id INT PRIMARY KEY,
+        banda NVARCHAR(10) NOT NULL,
+        version_fila BINARY(8) NOT NULL,
+        orden BIGINT NOT NULL,
+        fecha_cruce DATETIME2 DEFAULT GETDATE()
+    );
+GO
+
+PRINT 'Tabla bandas_stock creada';
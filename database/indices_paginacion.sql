@@ -0,0 +1,21 @@
+-- =============================================
+-- Índices para paginación keyset (bases de datos existentes)
+-- schema.sql ya los incluye para instalaciones nuevas
+-- =============================================
+
+USE InventariosDB;
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'idx_categoria_codigo' AND object_id = OBJECT_ID('productos'))
+    CREATE INDEX idx_categoria_codigo ON productos(categoria, codigo);
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'idx_ubicacion_codigo' AND object_id = OBJECT_ID('productos'))
+    CREATE INDEX idx_ubicacion_codigo ON productos(ubicacion_bodega, codigo);
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'idx_producto_fecha' AND object_id = OBJECT_ID('movimientos'))
+    CREATE INDEX idx_producto_fecha ON movimientos(producto_id, fecha_movimiento, id);
+GO
+
+PRINT 'Índices de paginación creados';
@@ -0,0 +1,23 @@
+-- =============================================
+-- Saldo por movimiento (bases de datos existentes)
+-- schema.sql ya incluye la columna para instalaciones nuevas
+-- Después de ejecutarlo, poblar los saldos históricos con:
+--     python -m services.saldos_movimientos
+-- =============================================
+
+USE InventariosDB;
+GO
+
+IF COL_LENGTH('movimientos', 'stock_resultante') IS NULL
+    ALTER TABLE movimientos ADD stock_resultante INT NULL;
+GO
+
+-- Cubre "stock en fecha T" y "últimos N movimientos con saldo" sin key lookups
+IF EXISTS (SELECT * FROM sys.indexes WHERE name = 'idx_producto_fecha' AND object_id = OBJECT_ID('movimientos'))
+    DROP INDEX idx_producto_fecha ON movimientos;
+GO
+
+CREATE INDEX idx_producto_fecha ON movimientos(producto_id, fecha_movimiento, id) INCLUDE (stock_resultante);
+GO
+
+PRINT 'Columna stock_resultante e índice actualizados';
@@ -43,9 +43,15 @@ CREATE TABLE productos (
     activo BIT DEFAULT 1,
     fecha_creacion DATETIME2 DEFAULT GETDATE(),
     fecha_actualizacion DATETIME2,
+    -- Cambia en cada escritura de la fila: marca de agua del polling (services/indice_productos.py)
+    version_fila ROWVERSION,
     
     INDEX idx_codigo (codigo),
-    INDEX idx_categoria (categoria)
+    INDEX idx_version_fila (version_fila),
+    INDEX idx_categoria (categoria),
+    -- Paginación keyset por código con filtro de categoría / ubicación
+    INDEX idx_categoria_codigo (categoria, codigo),
+    INDEX idx_ubicacion_codigo (ubicacion_bodega, codigo)
 );
 GO
 
@@ -66,11 +72,16 @@ CREATE TABLE movimientos (
     referencia NVARCHAR(100),
     observaciones NVARCHAR(500),
     
+    -- Saldo del producto después del movimiento (ver services/saldos_movimientos.py)
+    stock_resultante INT NULL,
+    
     fecha_movimiento DATETIME2 DEFAULT GETDATE(),
     
     FOREIGN KEY (producto_id) REFERENCES productos(id),
     INDEX idx_producto_id (producto_id),
-    INDEX idx_fecha (fecha_movimiento)
+    INDEX idx_fecha (fecha_movimiento),
+    -- Paginación keyset (fecha_movimiento, id) filtrada por producto
+    INDEX idx_producto_fecha (producto_id, fecha_movimiento, id) INCLUDE (stock_resultante)
 );
 GO
 
@@ -96,6 +107,25 @@ CREATE TABLE kpis (
 );
 GO
 
+-- =============================================
+-- Tabla: Bandas de stock notificadas
+-- Último cruce de banda por producto ya entregado a los suscriptores
+-- (alertas de WhatsApp); cada worker detecta el cruce pero solo el que lo
+-- registra aquí primero lo entrega
+-- =============================================
+IF OBJECT_ID('bandas_stock', 'U') IS NOT NULL
+    DROP TABLE bandas_stock;
+GO
+
+CREATE TABLE bandas_stock (
+    producto_id INT PRIMARY KEY,
+    banda NVARCHAR(10) NOT NULL,
+    version_fila BINARY(8) NOT NULL,
+    orden BIGINT NOT NULL,
+    fecha_cruce DATETIME2 DEFAULT GETDATE()
+);
+GO
+
 -- =============================================
 -- Vista: Productos con Stock Crítico
 -- =============================================
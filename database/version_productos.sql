@@ -0,0 +1,22 @@
+-- =============================================
+-- Versión de fila de productos (bases de datos existentes)
+-- schema.sql ya la incluye para instalaciones nuevas
+--
+-- SQL Server asigna un ROWVERSION nuevo, creciente en toda la base, en cada
+-- INSERT/UPDATE. El índice de productos de cada worker lo usa como marca de
+-- agua (sin depender del reloj ni de la precisión de fecha_actualizacion) y
+-- los KPIs y el detector de stock lo usan para descartar filas viejas.
+-- =============================================
+
+USE InventariosDB;
+GO
+
+IF COL_LENGTH('productos', 'version_fila') IS NULL
+    ALTER TABLE productos ADD version_fila ROWVERSION;
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'idx_version_fila' AND object_id = OBJECT_ID('productos'))
+    CREATE INDEX idx_version_fila ON productos(version_fila);
+GO
+
+PRINT 'Columna productos.version_fila creada';